@@ -2,35 +2,28 @@
 
 from __future__ import division, annotations
 import os
+import time
 import argparse
-import tqdm
 import numpy as np
-import cv2
 
-import torch
-import torchvision.transforms as transforms
-from torch.utils.data import DataLoader
-from torch.autograd import Variable
+from typing import Optional, TYPE_CHECKING
 
-from typing import Optional
-
-from imgaug.augmentables.segmaps import SegmentationMapsOnImage
-
-from yoeo.models import load_model
 from yoeo.utils.class_config import ClassConfig
 from yoeo.utils.dataclasses import ClassNames, GroupConfig
-from yoeo.utils.utils import rescale_boxes, non_max_suppression, print_environment_info, rescale_segmentation
-from yoeo.utils.datasets import ImageFolder
-from yoeo.utils.transforms import Resize, DEFAULT_TRANSFORMS
+from yoeo.utils.runtime_profile import apply_runtime_profile, DEFAULT_RUNTIME_PROFILE, OBJECTIVES
+from yoeo.utils.latency import LatencyRecorder
+from yoeo.utils.process_profiler import DEFAULT_WINDOW, ProcessProfiler, parse_profile_window
 
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.ticker import NullLocator
+# PyTorch, the image libraries and the plotting are imported in the functions that need them,
+# so the command line interface (e.g. `yoeo-detect --help`) starts without loading them
+if TYPE_CHECKING:
+    from torch.utils.data import DataLoader
 
 
 def detect_directory(model_path, weights_path, img_path, class_config: ClassConfig, output_path,
                      batch_size=8, img_size=416, n_cpu=8, conf_thres=0.5, nms_thres=0.5,
-                     ):
+                     use_model_cache=False, latency_recorder: Optional[LatencyRecorder] = None,
+                     profiler: Optional[ProcessProfiler] = None, rect=False):
     """Detects objects on all images in specified directory and saves output images with drawn detections.
 
     :param model_path: Path to model definition file (.cfg)
@@ -53,9 +46,22 @@ def detect_directory(model_path, weights_path, img_path, class_config: ClassConf
     :type conf_thres: float, optional
     :param nms_thres: IOU threshold for non-maximum suppression, defaults to 0.5
     :type nms_thres: float, optional
+    :param use_model_cache: If True, the compiled model is loaded from the model cache, defaults to False
+    :type use_model_cache: bool, optional
+    :param latency_recorder: Records the duration of each stage if given, defaults to None
+    :type latency_recorder: Optional[LatencyRecorder]
+    :param profiler: Profiles a window of batches if given, defaults to None
+    :type profiler: Optional[ProcessProfiler]
+    :param rect: Letterboxes batches of images with similar aspect ratio to a rectangular shape, defaults to False
+    :type rect: bool, optional
     """
-    dataloader = _create_data_loader(img_path, batch_size, img_size, n_cpu)
-    model = load_model(model_path, weights_path)
+    dataloader = _create_data_loader(img_path, batch_size, img_size, n_cpu, rect)
+    if use_model_cache:
+        from yoeo.utils.model_cache import load_cached_model
+        model = load_cached_model(model_path, weights_path, img_size)
+    else:
+        from yoeo.models import load_model
+        model = load_model(model_path, weights_path)
 
     img_detections, segmentations, imgs = detect(
         model,
@@ -63,10 +69,13 @@ def detect_directory(model_path, weights_path, img_path, class_config: ClassConf
         output_path,
         conf_thres,
         nms_thres,
-        class_config.get_group_config()
+        class_config.get_group_config(),
+        latency_recorder,
+        profiler
     )
     _draw_and_save_output_images(
-        img_detections, segmentations, imgs, img_size, output_path, class_config.get_ungrouped_det_class_names())
+        img_detections, segmentations, imgs, img_size, output_path, class_config.get_ungrouped_det_class_names(),
+        latency_recorder, rect)
 
     print(f"---- Detections were saved to: '{output_path}' ----")
 
@@ -76,7 +85,8 @@ def detect_image(model,
                  img_size: int = 416, 
                  conf_thres: float = 0.5, 
                  nms_thres: float = 0.5,
-                 group_config: Optional[GroupConfig] = None
+                 group_config: Optional[GroupConfig] = None,
+                 latency_recorder: Optional[LatencyRecorder] = None
                  ):
     """Inferences one image with model.
 
@@ -92,35 +102,52 @@ def detect_image(model,
     :type nms_thres: float
     :param group_config: GroupConfiguration for this model (optional, defaults to None)
     :type group_config: Optional[GroupConfig]
+    :param latency_recorder: Records the duration of each stage as one frame if given, defaults to None
+    :type latency_recorder: Optional[LatencyRecorder]
 
     :return: Detections on image with each detection in the format: [x1, y1, x2, y2, confidence, class], Segmentation as 2d numpy array with the coresponding class id in each cell
     :rtype: nd.array, nd.array
     """
+    import torch
+    import torchvision.transforms as transforms
+    from yoeo.utils.transforms import Resize, DEFAULT_TRANSFORMS
+    from yoeo.utils.utils import rescale_boxes, non_max_suppression, rescale_segmentation
+
+    recorder = latency_recorder or LatencyRecorder(enabled=False)
+    start = time.perf_counter()
+
     model.eval()  # Set model to evaluation mode
     
     # Configure input
-    input_img = transforms.Compose([
-        DEFAULT_TRANSFORMS,
-        Resize(img_size)])((
-            image,
-            np.zeros((1, 5)),
-            np.zeros((img_size, img_size), dtype=np.uint8)))[0].unsqueeze(0)
-
-    if torch.cuda.is_available():
-        input_img = input_img.to("cuda")
+    with recorder.stage("preprocess"):
+        input_img = transforms.Compose([
+            DEFAULT_TRANSFORMS,
+            Resize(img_size)])((
+                image,
+                np.zeros((1, 5)),
+                np.zeros((img_size, img_size), dtype=np.uint8)))[0].unsqueeze(0)
+
+    with recorder.stage("h2d"):
+        if torch.cuda.is_available():
+            input_img = input_img.to("cuda")
 
     # Get detections
     with torch.no_grad():
-        detections, segmentations = model(input_img)
-        detections = non_max_suppression(
-            prediction=detections, 
-            conf_thres=conf_thres, 
-            iou_thres=nms_thres, 
-            group_config=group_config
-        )
-        detections = rescale_boxes(detections[0], img_size, image.shape[0:2])
-        segmentations = rescale_segmentation(segmentations, image.shape[0:2])
-    return detections.numpy(), segmentations.cpu().detach().numpy()
+        with recorder.stage("forward"):
+            detections, segmentations = model(input_img)
+        with recorder.stage("nms"):
+            detections = non_max_suppression(
+                prediction=detections, 
+                conf_thres=conf_thres, 
+                iou_thres=nms_thres, 
+                group_config=group_config
+            )
+        with recorder.stage("rescale"):
+            detections = rescale_boxes(detections[0], img_size, image.shape[0:2])
+            segmentations = rescale_segmentation(segmentations, image.shape[0:2])
+            detections, segmentations = detections.numpy(), segmentations.cpu().detach().numpy()
+    recorder.end_frame(total=time.perf_counter() - start)
+    return detections, segmentations
 
 
 def detect(model,
@@ -128,7 +155,9 @@ def detect(model,
            output_path: str, 
            conf_thres: float = 0.5, 
            nms_thres: float = 0.5,
-           group_config: Optional[GroupConfig] = None
+           group_config: Optional[GroupConfig] = None,
+           latency_recorder: Optional[LatencyRecorder] = None,
+           profiler: Optional[ProcessProfiler] = None
             ):
     """Inferences images with model.
 
@@ -144,12 +173,21 @@ def detect(model,
     :type nms_thres: float
     :param group_config: GroupConfig for this model (optional, defaults to None)
     :type group_config: Optional[GroupConfig]
+    :param latency_recorder: Records the duration of each stage per batch if given, defaults to None
+    :type latency_recorder: Optional[LatencyRecorder]
+    :param profiler: Profiles a window of batches if given, defaults to None
+    :type profiler: Optional[ProcessProfiler]
 
     :return: List of detections. The coordinates are given for the padded image that is provided by the dataloader.
         Use `utils.rescale_boxes` to transform them into the desired input image coordinate system before its transformed by the dataloader),
         List of input image paths
     :rtype: [Tensor], [str]
     """
+    import tqdm
+    import torch
+    from torch.autograd import Variable
+    from yoeo.utils.utils import non_max_suppression
+
     # Create output directory, if missing
     os.makedirs(output_path, exist_ok=True)
 
@@ -161,19 +199,24 @@ def detect(model,
     seg_detections = []
     imgs = []  # Stores image paths
 
-    for (img_paths, input_imgs) in tqdm.tqdm(dataloader, desc="Detecting"):
+    recorder = latency_recorder or LatencyRecorder(enabled=False)
+    profiler = profiler or ProcessProfiler(enabled=False)
+    for (img_paths, input_imgs) in tqdm.tqdm(profiler.iterate(recorder.iterate(dataloader)), total=len(dataloader), desc="Detecting"):
         # Configure input
-        input_imgs = Variable(input_imgs.type(Tensor))
+        with recorder.stage("h2d"):
+            input_imgs = Variable(input_imgs.type(Tensor))
 
         # Get detections
         with torch.no_grad():
-            detections, segmentations = model(input_imgs)
-            detections = non_max_suppression(
-                prediction=detections, 
-                conf_thres=conf_thres, 
-                iou_thres=nms_thres, 
-                group_config=group_config
-            )
+            with recorder.stage("forward"):
+                detections, segmentations = model(input_imgs)
+            with recorder.stage("nms"):
+                detections = non_max_suppression(
+                    prediction=detections, 
+                    conf_thres=conf_thres, 
+                    iou_thres=nms_thres, 
+                    group_config=group_config
+                )
 
         # Store image and detections
         img_detections.extend(detections)
@@ -182,7 +225,8 @@ def detect(model,
     return img_detections, seg_detections, imgs
 
 
-def _draw_and_save_output_images(img_detections, segmentations, imgs, img_size, output_path, classes):
+def _draw_and_save_output_images(img_detections, segmentations, imgs, img_size, output_path, classes,
+                                 latency_recorder: Optional[LatencyRecorder] = None, rect=False):
     """Draws detections in output images and stores them.
 
     :param img_detections: List of detections
@@ -197,15 +241,22 @@ def _draw_and_save_output_images(img_detections, segmentations, imgs, img_size,
     :type output_path: str
     :param classes: List of class names
     :type classes: [str]
+    :param latency_recorder: Records the output writing of each image as one frame if given, defaults to None
+    :type latency_recorder: Optional[LatencyRecorder]
+    :param rect: The images were letterboxed to the rectangular shape of their segmentation, defaults to False
+    :type rect: bool, optional
     """
+    recorder = latency_recorder or LatencyRecorder(enabled=False)
     # Iterate through images and save plot of detections
     for (image_path, detections, seg) in zip(imgs, img_detections, segmentations):
         print(f"Image {image_path}:")
-        _draw_and_save_output_image(
-            image_path, detections, seg, img_size, output_path, classes)
+        with recorder.stage("output"):
+            _draw_and_save_output_image(
+                image_path, detections, seg, img_size, output_path, classes, rect)
+        recorder.end_frame(image=image_path)
 
 
-def _draw_and_save_output_image(image_path, detections, seg, img_size, output_path, classes):
+def _draw_and_save_output_image(image_path, detections, seg, img_size, output_path, classes, rect=False):
     """Draws detections in output image and stores this.
 
     :param image_path: Path to input image
@@ -220,7 +271,17 @@ def _draw_and_save_output_image(image_path, detections, seg, img_size, output_pa
     :type output_path: str
     :param classes: List of class names
     :type classes: [str]
+    :param rect: The image was letterboxed to the rectangular shape of its segmentation, defaults to False
+    :type rect: bool, optional
     """
+    import cv2
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
+    from matplotlib.ticker import NullLocator
+    from imgaug.augmentables.segmaps import SegmentationMapsOnImage
+    from yoeo.utils.utils import rescale_boxes
+    from yoeo.utils.letterbox import letterbox_region, rescale_boxes_letterbox
+
     # Create plot
     img = cv2.imread(image_path)
     img = cv2.cvtColor(img,cv2.COLOR_BGR2RGB)
@@ -230,25 +291,27 @@ def _draw_and_save_output_image(image_path, detections, seg, img_size, output_pa
     seg = seg.cpu().detach().numpy().astype(np.uint8)
     # Draw all of it
 
-    # The amount of padding that was added
-    pad_x = max(img.shape[0] - img.shape[1], 0) * (img_size / max(img.shape[:2])) // 2
-    pad_y = max(img.shape[1] - img.shape[0], 0) * (img_size / max(img.shape[:2])) // 2
-
-
-    seg_map = seg[
+    # The image was letterboxed to the shape of its batch, which is the shape of the segmentation
+    letterbox_shape = seg.shape[-2:]
+    if rect:
+        top, left, height, width = letterbox_region(img.shape[:2], letterbox_shape)
+        seg = seg[top:top + height, left:left + width]
+    else:
+        # The amount of padding that was added
+        pad_x = max(img.shape[0] - img.shape[1], 0) * (img_size / max(img.shape[:2])) // 2
+        pad_y = max(img.shape[1] - img.shape[0], 0) * (img_size / max(img.shape[:2])) // 2
+
+        seg = seg[
                 int(pad_y) : int(img_size - pad_y),
                 int(pad_x) : int(img_size - pad_x),
-                ] * 255
+                ]
 
-
-    ax.imshow(
-        SegmentationMapsOnImage(
-            seg[
-                int(pad_y) : int(img_size - pad_y),
-                int(pad_x) : int(img_size - pad_x),
-                ], shape=img.shape).draw_on_image(img)[0])
+    ax.imshow(SegmentationMapsOnImage(seg, shape=img.shape).draw_on_image(img)[0])
     # Rescale boxes to original image
-    detections = rescale_boxes(detections, img_size, img.shape[:2])
+    if rect:
+        detections = rescale_boxes_letterbox(detections, letterbox_shape, img.shape[:2])
+    else:
+        detections = rescale_boxes(detections, img_size, img.shape[:2])
     unique_labels = detections[:, -1].cpu().unique()
     n_cls_preds = len(unique_labels)
     # Bounding-box colors
@@ -295,7 +358,7 @@ def _draw_and_save_output_image(image_path, detections, seg, img_size, output_pa
     cv2.imwrite(output_path_1, img)
 
 
-def _create_data_loader(img_path, batch_size, img_size, n_cpu):
+def _create_data_loader(img_path, batch_size, img_size, n_cpu, rect=False):
     """Creates a DataLoader for inferencing.
 
     :param img_path: Path to file containing all paths to validation images.
@@ -306,9 +369,27 @@ def _create_data_loader(img_path, batch_size, img_size, n_cpu):
     :type img_size: int
     :param n_cpu: Number of cpu threads to use during batch generation
     :type n_cpu: int
+    :param rect: Groups images of similar aspect ratio into batches with a rectangular shape, defaults to False
+    :type rect: bool
     :return: Returns DataLoader
     :rtype: DataLoader
     """
+    import torchvision.transforms as transforms
+    from torch.utils.data import DataLoader, SequentialSampler
+    from yoeo.utils.datasets import ImageFolder, AspectRatioBatchSampler
+    from yoeo.utils.transforms import Resize, DEFAULT_TRANSFORMS
+
+    if rect:
+        # The dataset letterboxes each image to the shape of its batch, which the batch sampler selects
+        dataset = ImageFolder(img_path, transform=DEFAULT_TRANSFORMS, rect=True)
+        batch_sampler = AspectRatioBatchSampler(
+            SequentialSampler(dataset), dataset.image_sizes(), batch_size, img_size=img_size)
+        return DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            num_workers=n_cpu,
+            pin_memory=True)
+
     dataset = ImageFolder(
         img_path,
         transform=transforms.Compose([DEFAULT_TRANSFORMS, Resize(img_size)]))
@@ -322,25 +403,54 @@ def _create_data_loader(img_path, batch_size, img_size, n_cpu):
 
 
 def run():
-    print_environment_info()
     parser = argparse.ArgumentParser(description="Detect objects on images.")
     parser.add_argument("-m", "--model", type=str, default="config/yoeo.cfg", help="Path to model definition file (.cfg)")
     parser.add_argument("-w", "--weights", type=str, default="weights/yoeo.pth", help="Path to weights or checkpoint file (.weights or .pth)")
     parser.add_argument("-i", "--images", type=str, default="data/samples", help="Path to directory with images to inference")
     parser.add_argument("-c", "--classes", type=str, default="data/yoeo_names.yaml", help="Path to .yaml file containing the classes' names")
     parser.add_argument("-o", "--output", type=str, default="output", help="Path to output directory")
-    parser.add_argument("-b", "--batch_size", type=int, default=1, help="Size of each image batch")
+    parser.add_argument("-b", "--batch_size", type=int, default=None, help="Size of each image batch (defaults to the runtime profile or 1)")
     parser.add_argument("--img_size", type=int, default=416, help="Size of each image dimension for yolo")
-    parser.add_argument("--n_cpu", type=int, default=8, help="Number of cpu threads to use during batch generation")
+    parser.add_argument("--n_cpu", type=int, default=None,
+                        help="Number of cpu threads to use during batch generation (defaults to the runtime profile or 8)")
+    parser.add_argument("--runtime_profile", type=str, default=DEFAULT_RUNTIME_PROFILE, help="Runtime profile created by yoeo-autotune")
+    parser.add_argument("--objective", type=str, choices=OBJECTIVES, default="throughput", help="Objective of the runtime profile settings")
     parser.add_argument("--conf_thres", type=float, default=0.5, help="Object confidence threshold")
     parser.add_argument("--nms_thres", type=float, default=0.4, help="IOU threshold for non-maximum suppression")
     parser.add_argument("--class_config", type=str, default="class_config/default.yaml", help="Class configuration for evaluation")
+    parser.add_argument("--model_cache", action="store_true",
+                        help="Loads the compiled model from the model cache ($YOEO_CACHE_DIR or ~/.cache/yoeo) and compiles it on the first run")
+    parser.add_argument("--rect_batches", action="store_true",
+                        help="Letterboxes batches of images with similar aspect ratio to a rectangular shape "
+                             "instead of padding each image to a square")
+    parser.add_argument("--latency", action="store_true", help="Prints the percentiles of the duration of each processing stage")
+    parser.add_argument("--latency_output", type=str, default=None,
+                        help="Writes the stage durations of each batch and output image as json lines to this file (implies --latency)")
+    parser.add_argument("--profile", type=str, nargs="?", const=DEFAULT_WINDOW, default=None, metavar="START:END",
+                        help=f"Profiles the batches START to END-1 (default {DEFAULT_WINDOW}) with the PyTorch profiler and cProfile")
+    parser.add_argument("--profile_dir", type=str, default="profile", help="Directory of the profiling results")
     args = parser.parse_args()
+    if args.rect_batches and args.model_cache:
+        parser.error("--rect_batches can not be combined with --model_cache, whose model is traced for square images")
+
+    from yoeo.utils.utils import print_environment_info
+    print_environment_info()
+
+    apply_runtime_profile(args, args.objective, default_batch_size=1, default_n_cpu=8)
     print(f"Command line arguments: {args}")
 
     class_names = ClassNames.load_from(args.classes)
     class_config = ClassConfig.load_from(args.class_config, class_names)
 
+    latency_recorder = None
+    if args.latency or args.latency_output:
+        import torch
+        latency_recorder = LatencyRecorder(synchronize=torch.cuda.is_available())
+
+    profiler = None
+    if args.profile:
+        profiler = ProcessProfiler(args.profile_dir, *parse_profile_window(args.profile))
+
     detect_directory(
         args.model,
         args.weights,
@@ -352,8 +462,21 @@ def run():
         n_cpu=args.n_cpu,
         conf_thres=args.conf_thres,
         nms_thres=args.nms_thres,
+        use_model_cache=args.model_cache,
+        latency_recorder=latency_recorder,
+        profiler=profiler,
+        rect=args.rect_batches,
     )
 
+    if profiler is not None:
+        profiler.close()
+
+    if latency_recorder is not None:
+        print(latency_recorder.table())
+        if args.latency_output:
+            latency_recorder.save_frames(args.latency_output)
+            print(f"---- Stage durations were saved to: '{args.latency_output}' ----")
+
 
 if __name__ == '__main__':
     run()
@@ -5,10 +5,12 @@ import os
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 import numpy as np
 
 from yoeo.utils.parse_config import parse_model_config
 from yoeo.utils.utils import weights_init_normal, to_cpu, seg_iou
+from yoeo.utils.mmap_weights import load_mmap_weights, save_mmap_weights, MMAP_WEIGHTS_EXTENSION
 
 
 def create_modules(module_defs):
@@ -194,12 +196,15 @@ class Darknet(nn.Module):
         self.num_seg_classes = self.seg_layers[0].num_classes
         self.seen = 0
         self.header_info = np.array([0, 0, 0, self.seen, 0], dtype=np.int32)
+        self.layer_profiler = None  # Set by yoeo.utils.layer_profiler.LayerProfiler
 
     def forward(self, x, bb_targets=None, mask_targets=None):
         img_size = x.size(2)
         loss = 0
         layer_outputs, yolo_outputs, segmentation_outputs = [], [], []
         for i, (module_def, module) in enumerate(zip(self.module_defs, self.module_list)):
+            if self.layer_profiler is not None:
+                self.layer_profiler.start_layer(x)
             if module_def["type"] in ["convolutional", "upsample", "maxpool"]:
                 x = module(x)
             elif module_def["type"] == "route":
@@ -217,10 +222,16 @@ class Darknet(nn.Module):
                 x = module[0](x)
                 segmentation_outputs.append(x)
             layer_outputs.append(x)
+            if self.layer_profiler is not None:
+                self.layer_profiler.end_layer(i, module_def, module, x)
         return (yolo_outputs, segmentation_outputs) if self.training else (torch.cat(yolo_outputs, 1), torch.cat(segmentation_outputs, 1))
 
     def load_darknet_weights(self, weights_path):
-        """Parses and loads the weights stored in 'weights_path'"""
+        """Parses and loads the weights stored in 'weights_path'
+
+        :return: Number of loaded tensors and names of the tensors of convolutional layers that were not loaded
+        :rtype: Tuple[int, list]
+        """
 
         # Open the weights file
         with open(weights_path, "rb") as f:
@@ -228,22 +239,16 @@ class Darknet(nn.Module):
             header = np.fromfile(f, dtype=np.int32, count=5)
             self.header_info = header  # Needed to write header when saving weights
             self.seen = header[3]  # number of images seen during training
-            weights = np.fromfile(f, dtype=np.float32)  # The rest are weights
+        # The rest are weights, they are mapped instead of read so only the used part of the file is loaded
+        weights = np.memmap(weights_path, dtype=np.float32, mode="c", offset=header.nbytes)
 
         # Establish cutoff for loading backbone weights
-        cutoff = None
-        # If the weights file has a cutoff, we can find out about it by looking at the filename
-        # examples: darknet53.conv.74 -> cutoff is 74
-        filename = os.path.basename(weights_path)
-        if ".conv." in filename:
-            try:
-                cutoff = int(filename.split(".")[-1])  # use last part of filename
-            except ValueError:
-                pass
+        cutoff = _cutoff_from_filename(weights_path)
 
         ptr = 0
+        loaded_layers = set()
         for i, (module_def, module) in enumerate(zip(self.module_defs, self.module_list)):
-            if ptr >= weights.length():
+            if ptr >= weights.size:
                 break
             if i == cutoff:
                 break
@@ -286,6 +291,17 @@ class Darknet(nn.Module):
                     weights[ptr: ptr + num_w]).view_as(conv_layer.weight)
                 conv_layer.weight.data.copy_(conv_w)
                 ptr += num_w
+                loaded_layers.add(i)
+
+        num_loaded, unloaded = 0, []
+        for i, (module_def, module) in enumerate(zip(self.module_defs, self.module_list)):
+            if module_def["type"] == "convolutional":
+                names = [f"module_list.{i}.{name}" for name, _ in module.named_parameters()]
+                if i in loaded_layers:
+                    num_loaded += len(names)
+                else:
+                    unloaded += names
+        return num_loaded, unloaded
 
     def save_darknet_weights(self, path, cutoff=-1):
         """
@@ -315,37 +331,130 @@ class Darknet(nn.Module):
 
         fp.close()
 
+    def load_mmap_weights(self, weights_path, cutoff=None):
+        """Maps the weights stored in the memory-mapped weights file 'weights_path' (.mmw) into the model
+
+        :param weights_path: Path to the weights file
+        :type weights_path: str
+        :param cutoff: Only layers with a lower index are loaded, defaults to the cutoff in the filename (e.g. yoeo.conv.74.mmw)
+        :type cutoff: int, optional
+        :return: Number of loaded tensors and names of the tensors that are missing or have a different shape
+        :rtype: Tuple[int, list]
+        """
+        if cutoff is None:
+            cutoff = _cutoff_from_filename(weights_path)
+        return load_mmap_weights(self, weights_path, cutoff)
+
+    def save_mmap_weights(self, path):
+        """
+            @:param path    - path of the new memory-mapped weights file (.mmw)
+        """
+        save_mmap_weights(self.state_dict(), path, seen=int(self.seen))
 
-def load_model(model_path, weights_path=None,device="cpu"):
+    def fuse(self):
+        """Folds the batch normalization layers into the preceding convolutions for faster inference.
+
+        The model is set to evaluation mode and can not be trained afterwards,
+        as the batch normalization statistics are baked into the convolutions.
+
+        :return: The fused model
+        :rtype: Darknet
+        """
+        self.eval()
+        for i, (module_def, module) in enumerate(zip(self.module_defs, self.module_list)):
+            if module_def["type"] == "convolutional" and int(module_def["batch_normalize"]):
+                conv_layer, bn_layer = module[0], module[1]
+                setattr(module, f"conv_{i}", fuse_conv_bn_eval(conv_layer, bn_layer))
+                setattr(module, f"batch_norm_{i}", nn.Identity())
+        return self
+
+
+def _cutoff_from_filename(weights_path):
+    """Returns the layer index up to which a weights file should be loaded or None.
+
+    If the weights file has a cutoff, we can find out about it by looking at the filename
+    examples: darknet53.conv.74 -> cutoff is 74, yoeo.conv.74.mmw -> cutoff is 74
+    """
+    filename = os.path.basename(weights_path)
+    if filename.endswith(MMAP_WEIGHTS_EXTENSION):
+        filename = filename[:-len(MMAP_WEIGHTS_EXTENSION)]
+    if ".conv." in filename:
+        try:
+            return int(filename.split(".")[-1])  # use last part of filename
+        except ValueError:
+            pass
+    return None
+
+
+def load_model(model_path, weights_path=None, device="cpu"):
     """Loads the yolo model from file.
 
+    The random initialization is only applied to the layers that are not covered by the weights file,
+    so fully pretrained models start without initializing all layers first.
+
     :param model_path: Path to model definition file (.cfg)
     :type model_path: str
-    :param weights_path: Path to weights or checkpoint file (.weights or .pth)
+    :param weights_path: Path to weights or checkpoint file (.weights, .pth or .mmw)
     :type weights_path: str
+    :param device: Device the model is loaded to, defaults to "cpu"
+    :type device: str or torch.device
     :return: Returns model
     :rtype: Darknet
     """
-    
     model = Darknet(model_path).to(device)
 
-    model.apply(weights_init_normal)
+    # Train from scratch
+    if not weights_path:
+        model.apply(weights_init_normal)
+        return model
 
     # If pretrained weights are specified, start from checkpoint or weight file
-    if weights_path:
-        if weights_path.endswith(".pth"):
-            # Load checkpoint weights
-            #model.load_state_dict(torch.load(weights_path, map_location=device))
-            print("Initializing network from saved statedict")
-            saved_statedict = torch.load(weights_path)
-            state_dict=model.state_dict()        
-            for layer_name,layer_tensor in saved_statedict.items():
-                if state_dict[layer_name].shape==layer_tensor.shape:
-                    print(" - Loading weights for layer "+layer_name)
-                    state_dict[layer_name]=layer_tensor
-                else:
-                    print(" X Ignoring layer "+layer_name)
-        else:
-            # Load darknet weights
-            model.load_darknet_weights(weights_path)
+    if weights_path.endswith(".pth"):
+        # Load checkpoint weights
+        num_loaded, unloaded = _load_matching_state_dict(model, _load_checkpoint(weights_path, device))
+    elif weights_path.endswith(MMAP_WEIGHTS_EXTENSION):
+        # Map memory-mapped weights
+        num_loaded, unloaded = model.load_mmap_weights(weights_path)
+    else:
+        # Load darknet weights
+        num_loaded, unloaded = model.load_darknet_weights(weights_path)
+
+    print(f"Loaded {num_loaded} tensors from '{weights_path}'")
+    if unloaded:
+        # Names have the format 'module_list.<layer index>.<module>.<tensor>'
+        layers = sorted({int(name.split(".")[1]) for name in unloaded})
+        print(f"Randomly initializing {len(layers)} layers that are missing or have a different shape in the weights: "
+              f"{', '.join(map(str, layers))}")
+        _init_unloaded_modules(model, unloaded)
+
     return model
+
+
+def _load_matching_state_dict(model, saved_state_dict):
+    """Loads all tensors of a checkpoint that have a counterpart with the same shape in the model in one go.
+
+    :return: Number of loaded tensors and names of the model's tensors that were not loaded
+    :rtype: Tuple[int, list]
+    """
+    state_dict = model.state_dict()
+    matching_state_dict = {
+        name: tensor for name, tensor in saved_state_dict.items()
+        if name in state_dict and state_dict[name].shape == tensor.shape}
+    model.load_state_dict(matching_state_dict, strict=False)
+    unloaded = [name for name in state_dict if name not in matching_state_dict]
+    return len(matching_state_dict), unloaded
+
+
+def _init_unloaded_modules(model, unloaded):
+    """Applies the random initialization to all modules that own one of the given tensors."""
+    for module_name in sorted({name.rsplit(".", 1)[0] for name in unloaded}):
+        model.get_submodule(module_name).apply(weights_init_normal)
+
+
+def _load_checkpoint(weights_path, device):
+    """Loads a checkpoint state dict, memory-mapping the file where the installed PyTorch version supports it."""
+    try:
+        return torch.load(weights_path, map_location=device, mmap=True)
+    except (TypeError, RuntimeError):
+        # Older PyTorch versions and checkpoints in the legacy (non zip) format can not be mapped
+        return torch.load(weights_path, map_location=device)
@@ -0,0 +1,243 @@
+#! /usr/bin/env python3
+
+from __future__ import division, annotations
+
+import os
+import time
+import argparse
+import multiprocessing
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+import numpy as np
+from terminaltables import AsciiTable
+
+from yoeo.utils.runtime_profile import RuntimeProfile, RuntimeSettings, apply_thread_settings, \
+    DEFAULT_RUNTIME_PROFILE, OBJECTIVES
+
+# PyTorch and the model are only imported in the processes that measure them
+if TYPE_CHECKING:
+    import torch
+
+
+def _default_thread_counts() -> List[int]:
+    max_threads = os.cpu_count() or 1
+    thread_counts = {max_threads}
+    n = 1
+    while n < max_threads:
+        thread_counts.add(n)
+        n *= 2
+    return sorted(thread_counts)
+
+
+def _load_images(img_path: str, img_size: int, num_images: int) -> torch.Tensor:
+    import torch
+    import torchvision.transforms as transforms
+    from yoeo.utils.datasets import ImageFolder
+    from yoeo.utils.transforms import Resize, DEFAULT_TRANSFORMS
+
+    dataset = ImageFolder(img_path, transform=transforms.Compose([DEFAULT_TRANSFORMS, Resize(img_size)]))
+    assert len(dataset) > 0, f"No images found in '{img_path}'"
+    return torch.stack([dataset[i % len(dataset)][1] for i in range(num_images)])
+
+
+def _measure_model(model_path: str, weights_path: Optional[str], img_path: Optional[str], img_size: int,
+                   num_threads: int, num_interop_threads: int, batch_sizes: List[int],
+                   iterations: int, warmup: int) -> Dict[int, float]:
+    """Measures the median time of forward pass and non-maximum suppression for each batch size.
+
+    This runs in a fresh process for each thread configuration,
+    because the inter-op thread pool of PyTorch can only be sized once per process.
+
+    :return: Median seconds per batch for each batch size
+    :rtype: Dict[int, float]
+    """
+    import torch
+    from yoeo.models import load_model
+    from yoeo.utils.utils import non_max_suppression
+
+    apply_thread_settings(num_threads, num_interop_threads)
+
+    model = load_model(model_path, weights_path)
+    model.eval()
+
+    if img_path:
+        images = _load_images(img_path, img_size, max(batch_sizes))
+    else:
+        images = torch.rand(max(batch_sizes), 3, img_size, img_size)
+
+    results = {}
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            batch = images[:batch_size]
+            times = []
+            for i in range(warmup + iterations):
+                t = time.perf_counter()
+                detections, _ = model(batch)
+                non_max_suppression(detections, conf_thres=0.5, iou_thres=0.5)
+                if i >= warmup:
+                    times.append(time.perf_counter() - t)
+            results[batch_size] = float(np.median(times))
+    return results
+
+
+def _measure_data_loader(img_path: str, img_size: int, batch_size: int, n_cpu: int, num_batches: int) -> float:
+    """Measures the images per second the inference data loader delivers, including the worker startup.
+
+    :return: Images per second
+    :rtype: float
+    """
+    from yoeo.detect import _create_data_loader
+
+    dataloader = _create_data_loader(img_path, batch_size, img_size, n_cpu)
+    num_images = 0
+    t = time.perf_counter()
+    while True:
+        for _, imgs in dataloader:
+            num_images += len(imgs)
+            num_batches -= 1
+            if num_batches == 0:
+                return num_images / (time.perf_counter() - t)
+
+
+def _select_n_cpu(loader_throughput: Dict[int, float], model_throughput: float) -> int:
+    """Returns the lowest number of workers that keeps up with the model or the fastest one if none does."""
+    for n_cpu in sorted(loader_throughput):
+        if loader_throughput[n_cpu] >= model_throughput:
+            return n_cpu
+    return max(loader_throughput, key=loader_throughput.get)
+
+
+def autotune(model_path: str, weights_path: Optional[str], img_size: int, img_path: Optional[str] = None,
+             thread_counts: Optional[List[int]] = None, interop_thread_counts: Optional[List[int]] = None,
+             batch_sizes: Optional[List[int]] = None, n_cpu_counts: Optional[List[int]] = None,
+             objectives: List[str] = OBJECTIVES, iterations: int = 10, warmup: int = 2) -> RuntimeProfile:
+    """Sweeps the thread pools, batch size and data loader workers and returns the best settings for each objective.
+
+    :param model_path: Path to model definition file (.cfg)
+    :type model_path: str
+    :param weights_path: Path to weights or checkpoint file (.weights or .pth), None for random weights
+    :type weights_path: Optional[str]
+    :param img_size: Size of each image dimension for yolo
+    :type img_size: int
+    :param img_path: Directory with real images, defaults to None (synthetic images)
+    :type img_path: Optional[str]
+    :param thread_counts: Intra-op thread counts to try, defaults to powers of two up to the number of cores
+    :type thread_counts: Optional[List[int]]
+    :param interop_thread_counts: Inter-op thread counts to try, defaults to [1, 2]
+    :type interop_thread_counts: Optional[List[int]]
+    :param batch_sizes: Batch sizes to try, defaults to [1, 2, 4, 8]
+    :type batch_sizes: Optional[List[int]]
+    :param n_cpu_counts: Data loader worker counts to try, only used with real images, defaults to [0, 1, 2, 4, 8]
+    :type n_cpu_counts: Optional[List[int]]
+    :param objectives: Objectives to tune for, defaults to ('latency', 'throughput')
+    :type objectives: List[str]
+    :param iterations: Number of timed runs per configuration, defaults to 10
+    :type iterations: int
+    :param warmup: Number of untimed runs per configuration, defaults to 2
+    :type warmup: int
+    :return: Profile with the best settings for each objective
+    :rtype: RuntimeProfile
+    """
+    thread_counts = thread_counts or _default_thread_counts()
+    interop_thread_counts = interop_thread_counts or [1, 2]
+    batch_sizes = sorted(set(batch_sizes or [1, 2, 4, 8]) | ({1} if "latency" in objectives else set()))
+    n_cpu_counts = n_cpu_counts or [n for n in [0, 1, 2, 4, 8] if n <= (os.cpu_count() or 1)]
+
+    # Measure every thread configuration in its own process
+    seconds_per_batch = {}
+    context = multiprocessing.get_context("spawn")
+    for num_threads in thread_counts:
+        for num_interop_threads in interop_thread_counts:
+            with context.Pool(1) as pool:
+                results = pool.apply(_measure_model, (
+                    model_path, weights_path, img_path, img_size, num_threads, num_interop_threads,
+                    batch_sizes, iterations, warmup))
+            for batch_size, seconds in results.items():
+                seconds_per_batch[(num_threads, num_interop_threads, batch_size)] = seconds
+
+    table = [["Threads", "Inter-op threads", "Batch size", "Latency (ms)", "Images/s"]]
+    for (num_threads, num_interop_threads, batch_size), seconds in seconds_per_batch.items():
+        table.append([num_threads, num_interop_threads, batch_size, f"{seconds * 1000:.2f}", f"{batch_size / seconds:.2f}"])
+    print(AsciiTable(table).table)
+
+    # The absolute path identifies the model, regardless of the working directory of the later runs
+    profile = RuntimeProfile(model=os.path.abspath(model_path), img_size=img_size)
+    for objective in objectives:
+        if objective == "latency":
+            candidates = {key: value for key, value in seconds_per_batch.items() if key[2] == 1}
+            num_threads, num_interop_threads, batch_size = min(candidates, key=candidates.get)
+        else:
+            num_threads, num_interop_threads, batch_size = max(
+                seconds_per_batch, key=lambda key: key[2] / seconds_per_batch[key])
+        seconds = seconds_per_batch[(num_threads, num_interop_threads, batch_size)]
+        images_per_second = batch_size / seconds
+
+        if img_path:
+            loader_throughput = {
+                n_cpu: _measure_data_loader(img_path, img_size, batch_size, n_cpu, num_batches=iterations)
+                for n_cpu in n_cpu_counts}
+            print(f"Data loader images/s per worker count ({objective}): {loader_throughput}")
+            n_cpu = _select_n_cpu(loader_throughput, images_per_second)
+        else:
+            # Without real images the data loader can not be measured, so the cores left by the model are used
+            n_cpu = max((os.cpu_count() or 1) - num_threads, 0)
+
+        settings = RuntimeSettings(
+            num_threads=num_threads,
+            num_interop_threads=num_interop_threads,
+            batch_size=batch_size,
+            n_cpu=n_cpu,
+            latency_ms=seconds * 1000,
+            images_per_second=images_per_second)
+        print(f"Best {objective} settings: {settings}")
+        setattr(profile, objective, settings)
+
+    return profile
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Find the fastest thread, batch size and data loader settings for this machine.")
+    parser.add_argument("-m", "--model", type=str, default="config/yoeo.cfg", help="Path to model definition file (.cfg)")
+    parser.add_argument("-w", "--weights", type=str, default=None,
+                        help="Path to weights or checkpoint file (.weights or .pth). Uses random weights if not given")
+    parser.add_argument("-i", "--images", type=str, default=None,
+                        help="Directory with real images. Uses synthetic images and skips the data loader sweep if not given")
+    parser.add_argument("-o", "--output", type=str, default=DEFAULT_RUNTIME_PROFILE, help="Path to the runtime profile that is written")
+    parser.add_argument("--img_size", type=int, default=416, help="Size of each image dimension for yolo")
+    parser.add_argument("--objective", type=str, choices=OBJECTIVES, nargs="+", default=list(OBJECTIVES), help="Objectives to tune for")
+    parser.add_argument("--threads", type=int, nargs="+", default=None, help="Intra-op thread counts to try")
+    parser.add_argument("--interop_threads", type=int, nargs="+", default=None, help="Inter-op thread counts to try")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=None, help="Batch sizes to try")
+    parser.add_argument("--n_cpu", type=int, nargs="+", default=None, help="Data loader worker counts to try")
+    parser.add_argument("--iterations", type=int, default=10, help="Number of timed runs per configuration")
+    parser.add_argument("--warmup", type=int, default=2, help="Number of untimed runs per configuration")
+    args = parser.parse_args()
+    print(f"Command line arguments: {args}")
+
+    profile = autotune(
+        args.model,
+        args.weights,
+        args.img_size,
+        img_path=args.images,
+        thread_counts=args.threads,
+        interop_thread_counts=args.interop_threads,
+        batch_sizes=args.batch_sizes,
+        n_cpu_counts=args.n_cpu,
+        objectives=args.objective,
+        iterations=args.iterations,
+        warmup=args.warmup)
+
+    # Keep the settings of objectives that were not tuned this time
+    if os.path.isfile(args.output):
+        previous_profile = RuntimeProfile.load_from(args.output)
+        if (previous_profile.model, previous_profile.img_size) == (profile.model, profile.img_size):
+            for objective in OBJECTIVES:
+                if profile.get(objective) is None:
+                    setattr(profile, objective, previous_profile.get(objective))
+
+    profile.save_to(args.output)
+    print(f"---- Runtime profile was saved to: '{args.output}' ----")
+
+
+if __name__ == "__main__":
+    run()
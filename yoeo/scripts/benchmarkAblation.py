@@ -0,0 +1,286 @@
+#! /usr/bin/env python3
+
+import os
+import sys
+import csv
+import glob
+import time
+import argparse
+import multiprocessing
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from terminaltables import AsciiTable
+
+from yoeo.utils.cost_model import estimate_model_cost
+from yoeo.utils.runtime_profile import apply_thread_settings
+
+WEIGHTS_EXTENSIONS = (".pth", ".mmw", ".weights")
+
+COLUMNS = ["model", "img_size", "batch_size", "latency_ms", "latency_p90_ms", "ms_per_image", "images_per_second",
+           "peak_rss_mib", "model_memory_mib", "params", "gmacs", "size_mib", "mAP", "mIoU", "pareto"]
+
+
+def find_weights(model_path: str, weights_dir: Optional[str]) -> Optional[str]:
+    """Returns the checkpoint in `weights_dir` that has the same name as the model definition (e.g. yoeo-rev-3.pth).
+
+    :param model_path: Path to model definition file (.cfg)
+    :type model_path: str
+    :param weights_dir: Directory with the checkpoints, defaults to None
+    :type weights_dir: Optional[str]
+    :return: Path to the checkpoint, None if there is none
+    :rtype: Optional[str]
+    """
+    if not weights_dir:
+        return None
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    for extension in WEIGHTS_EXTENSIONS:
+        path = os.path.join(weights_dir, name + extension)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _max_rss_mib() -> Optional[float]:
+    # The high water mark of the process memory starts fresh with each exec, unlike ru_maxrss which is inherited
+    # from the parent process. Both are given in KiB. Neither exists on Windows, where None is returned.
+    if sys.platform == "win32":
+        return None
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure_model(model_path: str, weights_path: Optional[str], img_sizes: List[int], batch_sizes: List[int],
+                   iterations: int, warmup: int, num_threads: Optional[int]) -> Dict:
+    """Measures the forward pass times of a model for each image and batch size.
+
+    This runs in a fresh process for each model, so the peak memory belongs to this model only.
+
+    :return: Seconds of each timed run for each (image size, batch size) and the peak memory
+    :rtype: Dict
+    """
+    import torch
+    from yoeo.models import load_model
+
+    if num_threads:
+        apply_thread_settings(num_threads)
+
+    baseline_rss = _max_rss_mib()
+    model = load_model(model_path, weights_path)
+    model.eval()
+
+    times = {}
+    with torch.no_grad():
+        for img_size in img_sizes:
+            for batch_size in batch_sizes:
+                images = torch.rand(batch_size, 3, img_size, img_size)
+                runs = []
+                for i in range(warmup + iterations):
+                    t = time.perf_counter()
+                    model(images)
+                    if i >= warmup:
+                        runs.append(time.perf_counter() - t)
+                times[(img_size, batch_size)] = runs
+
+    peak_rss = _max_rss_mib()
+    model_memory = peak_rss - baseline_rss if peak_rss is not None and baseline_rss is not None else None
+    return {"times": times, "peak_rss_mib": peak_rss, "model_memory_mib": model_memory}
+
+
+def _evaluate_model(model_path: str, weights_path: str, data_config: Dict, class_config_path: str,
+                    img_size: int, batch_size: int, n_cpu: int) -> Tuple[float, float]:
+    """Evaluates a model on the validation set of the data config.
+
+    :return: Mean average precision of the detection and mean IoU of the segmentation
+    :rtype: Tuple[float, float]
+    """
+    from yoeo.models import load_model
+    from yoeo.test import _create_validation_data_loader, _evaluate
+    from yoeo.utils.class_config import ClassConfig
+    from yoeo.utils.dataclasses import ClassNames
+
+    class_names = ClassNames.load_from(data_config["names"])
+    class_config = ClassConfig.load_from(class_config_path, class_names)
+    dataloader = _create_validation_data_loader(data_config["valid"], batch_size, img_size, n_cpu, is_segment=True)
+    model = load_model(model_path, weights_path)
+
+    result = _evaluate(model, dataloader, class_config, img_size, iou_thres=0.5, conf_thres=0.01, nms_thres=0.4, verbose=False)
+    if result is None:
+        return float("nan"), float("nan")
+    metrics_output, seg_class_ious, _ = result
+    return float(metrics_output[2].mean()), float(np.nanmean(seg_class_ious))
+
+
+def pareto_front(rows: Sequence[Dict], minimize: Sequence[str], maximize: Sequence[str]) -> List[bool]:
+    """Marks the rows that are not dominated by any other row.
+    A row dominates another one if it is at least as good in every column and better in at least one.
+
+    :param rows: Rows with the compared columns
+    :type rows: Sequence[Dict]
+    :param minimize: Columns where lower values are better
+    :type minimize: Sequence[str]
+    :param maximize: Columns where higher values are better
+    :type maximize: Sequence[str]
+    :return: For each row if it is on the Pareto front
+    :rtype: List[bool]
+    """
+    # Express everything as "lower is better"
+    values = np.array([[row[key] for key in minimize] + [-row[key] for key in maximize] for row in rows], dtype=float)
+    front = []
+    for value in values:
+        dominated = np.any(np.all(values <= value, axis=1) & np.any(values < value, axis=1))
+        front.append(not dominated)
+    return front
+
+
+def benchmark_ablation(model_paths: List[str], weights_dir: Optional[str] = None, img_sizes: Sequence[int] = (416,),
+                       batch_sizes: Sequence[int] = (1,), iterations: int = 10, warmup: int = 2,
+                       num_threads: Optional[int] = None, data_config: Optional[Dict] = None,
+                       class_config_path: str = "class_config/default.yaml", n_cpu: int = 8) -> List[Dict]:
+    """Measures latency, memory and model size of each model definition and joins them with validation metrics.
+
+    :param model_paths: Paths to model definition files (.cfg)
+    :type model_paths: List[str]
+    :param weights_dir: Directory with a checkpoint named like each model definition, defaults to None (random weights)
+    :type weights_dir: Optional[str]
+    :param img_sizes: Input sizes to measure, defaults to (416,)
+    :type img_sizes: Sequence[int]
+    :param batch_sizes: Batch sizes to measure, defaults to (1,)
+    :type batch_sizes: Sequence[int]
+    :param iterations: Number of timed runs per setting, defaults to 10
+    :type iterations: int
+    :param warmup: Number of untimed runs per setting, defaults to 2
+    :type warmup: int
+    :param num_threads: Number of intra-op threads, defaults to None (PyTorch default)
+    :type num_threads: Optional[int]
+    :param data_config: Parsed data config with 'valid' and 'names', the models with checkpoints are evaluated if given
+    :type data_config: Optional[Dict]
+    :param class_config_path: Class configuration for evaluation, defaults to "class_config/default.yaml"
+    :type class_config_path: str
+    :param n_cpu: Number of cpu threads to use during batch generation of the evaluation, defaults to 8
+    :type n_cpu: int
+    :return: One row per model, image size and batch size with the columns of `COLUMNS`
+    :rtype: List[Dict]
+    """
+    rows = []
+    context = multiprocessing.get_context("spawn")
+    for model_path in model_paths:
+        weights_path = find_weights(model_path, weights_dir)
+        print(f"---- Benchmarking '{model_path}' with weights '{weights_path}' ----")
+
+        with context.Pool(1) as pool:
+            measurement = pool.apply(_measure_model, (
+                model_path, weights_path, list(img_sizes), list(batch_sizes), iterations, warmup, num_threads))
+
+        map_score = miou_score = float("nan")
+        if weights_path and data_config:
+            map_score, miou_score = _evaluate_model(
+                model_path, weights_path, data_config, class_config_path, img_sizes[0], batch_sizes[-1], n_cpu)
+
+        for img_size in img_sizes:
+            cost = estimate_model_cost(model_path, img_size)
+            size_bytes = os.path.getsize(weights_path) if weights_path else cost.param_bytes
+            for batch_size in batch_sizes:
+                times = np.asarray(measurement["times"][(img_size, batch_size)])
+                latency = float(np.median(times))
+                rows.append({
+                    "model": model_path,
+                    "img_size": img_size,
+                    "batch_size": batch_size,
+                    "latency_ms": latency * 1000,
+                    "latency_p90_ms": float(np.percentile(times, 90)) * 1000,
+                    "ms_per_image": latency * 1000 / batch_size,
+                    "images_per_second": batch_size / latency,
+                    "peak_rss_mib": measurement["peak_rss_mib"],
+                    "model_memory_mib": measurement["model_memory_mib"],
+                    "params": cost.params,
+                    "gmacs": cost.macs / 1e9,
+                    "size_mib": size_bytes / 2 ** 20,
+                    "mAP": map_score,
+                    "mIoU": miou_score,
+                })
+
+    # Compare the models within each setting. With metrics speed is traded against accuracy, otherwise against memory
+    has_metrics = any(not np.isnan(row["mAP"]) for row in rows)
+    for setting in {(row["img_size"], row["batch_size"]) for row in rows}:
+        group = [row for row in rows if (row["img_size"], row["batch_size"]) == setting]
+        if has_metrics:
+            group = [row for row in group if not np.isnan(row["mAP"])]
+            front = pareto_front(group, minimize=["ms_per_image"], maximize=["mAP", "mIoU"])
+        else:
+            # The memory is only compared if it could be measured on this platform
+            memory = ["peak_rss_mib"] if all(row["peak_rss_mib"] is not None for row in group) else []
+            front = pareto_front(group, minimize=["ms_per_image"] + memory, maximize=[])
+        for row, on_front in zip(group, front):
+            row["pareto"] = on_front
+
+    return sorted(rows, key=lambda row: (row["img_size"], row["batch_size"], row["ms_per_image"]))
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Compare latency, memory, size and accuracy of model definitions.")
+    parser.add_argument("models", type=str, nargs="*", help="Paths to model definition files (.cfg), defaults to config/ablation_cfg/*.cfg")
+    parser.add_argument("-w", "--weights_dir", type=str, default=None,
+                        help="Directory with a checkpoint named like each .cfg (e.g. yoeo-rev-3.pth). Uses random weights otherwise")
+    parser.add_argument("-d", "--data", type=str, default=None,
+                        help="Path to data config file (.data). Evaluates the models with checkpoints on its validation set")
+    parser.add_argument("--class_config", type=str, default="class_config/default.yaml", help="Class configuration for evaluation")
+    parser.add_argument("--img_sizes", type=int, nargs="+", default=[416], help="Input sizes to measure")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4], help="Batch sizes to measure")
+    parser.add_argument("--iterations", type=int, default=10, help="Number of timed runs per setting")
+    parser.add_argument("--warmup", type=int, default=2, help="Number of untimed runs per setting")
+    parser.add_argument("--threads", type=int, default=None, help="Number of PyTorch threads")
+    parser.add_argument("--n_cpu", type=int, default=8, help="Number of cpu threads to use during batch generation of the evaluation")
+    parser.add_argument("-o", "--output", type=str, default="ablation.csv", help="Path to the csv file with the results")
+    args = parser.parse_args()
+    print(f"Command line arguments: {args}")
+
+    model_paths = args.models or sorted(glob.glob("config/ablation_cfg/*.cfg"))
+
+    data_config = None
+    if args.data:
+        from yoeo.utils.parse_config import parse_data_config
+        data_config = parse_data_config(args.data)
+
+    rows = benchmark_ablation(
+        model_paths,
+        weights_dir=args.weights_dir,
+        img_sizes=args.img_sizes,
+        batch_sizes=args.batch_sizes,
+        iterations=args.iterations,
+        warmup=args.warmup,
+        num_threads=args.threads,
+        data_config=data_config,
+        class_config_path=args.class_config,
+        n_cpu=args.n_cpu)
+
+    table = [["Model", "Size", "Batch", "ms/batch", "p90 ms", "ms/image", "Peak RSS (MiB)", "Params", "GMACs", "mAP", "mIoU",
+              "Pareto"]]
+    for row in rows:
+        table.append([
+            os.path.basename(row["model"]), row["img_size"], row["batch_size"],
+            f"{row['latency_ms']:.1f}", f"{row['latency_p90_ms']:.1f}", f"{row['ms_per_image']:.1f}",
+            "n/a" if row["peak_rss_mib"] is None else f"{row['peak_rss_mib']:.0f}", row["params"], f"{row['gmacs']:.2f}",
+            f"{row['mAP']:.4f}", f"{row['mIoU']:.4f}", "*" if row.get("pareto") else ""])
+    print(AsciiTable(table).table)
+
+    with open(args.output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, "pareto": bool(row.get("pareto"))})
+    print(f"---- Results were saved to: '{args.output}' ----")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,262 @@
+#! /usr/bin/env python3
+
+from __future__ import annotations
+
+import json
+import time
+import argparse
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+from terminaltables import AsciiTable
+
+from yoeo.utils.parse_config import parse_data_config
+
+# PyTorch and the data pipeline are imported once the command line arguments are parsed
+if TYPE_CHECKING:
+    from yoeo.utils.datasets import ListDataset
+
+
+def _read_proc_mib(pid: int, filename: str, key: str) -> Optional[float]:
+    """Reads a memory field in kB (e.g. 'VmHWM' of 'status' or 'Pss' of 'smaps_rollup') of a process in MiB."""
+    try:
+        with open(f"/proc/{pid}/{filename}") as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _worker_pids(iterator) -> List[int]:
+    # The worker processes are not part of the public DataLoader API, so memory is only reported if they can be found
+    return [worker.pid for worker in getattr(iterator, "_workers", [])]
+
+
+def profile_stages(dataset: ListDataset, num_samples: int, batch_size: int) -> Dict[str, float]:
+    """Measures the mean duration of each stage of the sample pipeline in a single process.
+
+    The stages are the methods `ListDataset.__getitem__` calls (image decode, label parse, mask decode),
+    each transform of the `Compose`, the resize to the image size and `collate_fn`, whose time is divided by the batch size.
+
+    :param dataset: Dataset with the transforms of the benchmark
+    :type dataset: ListDataset
+    :param num_samples: Number of samples to measure
+    :type num_samples: int
+    :param batch_size: Size of the batches passed to `collate_fn`
+    :type batch_size: int
+    :return: Mean milliseconds per sample of each stage
+    :rtype: Dict[str, float]
+    """
+    from yoeo.utils.datasets import resize
+
+    stage_times: Dict[str, float] = {}
+
+    def add(name, start):
+        stage_times[name] = stage_times.get(name, 0.0) + time.perf_counter() - start
+
+    transforms = getattr(dataset.transform, "transforms", [dataset.transform] if dataset.transform else [])
+    samples = []
+    for index in range(num_samples):
+        start = time.perf_counter()
+        img_path, img = dataset.load_image(index)
+        add("decode", start)
+
+        start = time.perf_counter()
+        boxes = dataset.load_boxes(index)
+        add("label_parse", start)
+
+        start = time.perf_counter()
+        mask = dataset.load_mask(index, img)
+        add("mask_decode", start)
+
+        data = (img, boxes, mask)
+        for transform in transforms:
+            start = time.perf_counter()
+            data = transform(data)
+            add(f"transform/{type(transform).__name__}", start)
+
+        start = time.perf_counter()
+        img, boxes, mask = data
+        data = (resize(img, dataset.img_size), boxes, resize(mask, dataset.img_size))
+        add("resize", start)
+        samples.append((img_path, *data))
+
+        if len(samples) == batch_size or index == num_samples - 1:
+            start = time.perf_counter()
+            dataset.collate_fn(samples)
+            add("collate", start)
+            samples = []
+
+    return {name: seconds * 1000 / num_samples for name, seconds in stage_times.items()}
+
+
+def measure_throughput(dataloader, num_batches: int, warmup: int = 2) -> Dict[str, Optional[float]]:
+    """Iterates over a data loader and measures the samples per second and the memory of the workers.
+
+    The growth of the private memory of each worker between the start of the measurement and its end shows
+    the memory the workers copy from the main process (copy-on-write), which should stay flat over an epoch.
+
+    :param dataloader: Data loader
+    :type dataloader: DataLoader
+    :param num_batches: Number of measured batches (the data loader is restarted if it has less batches),
+        0 measures the rest of the first epoch after the warmup
+    :type num_batches: int
+    :param warmup: Number of batches before the measurement, which includes the start of the workers, defaults to 2
+    :type warmup: int, optional
+    :return: Time to the first batch, size of a batch in MiB, samples and distinct images per second, peak RSS of the largest worker,
+        summed PSS of all workers and the largest growth of the private memory of a worker in MiB
+    :rtype: Dict[str, Optional[float]]
+    """
+    if num_batches <= 0:
+        num_batches = max(len(dataloader) - warmup, 1)
+    worker_rss, worker_pss = [], []
+    private_start, private_end = {}, {}
+    samples = images = 0
+    batches = 0
+    start = time.perf_counter()
+    first_batch = measure_start = batch_mib = None
+    while batches < warmup + num_batches:
+        iterator = iter(dataloader)
+        for batch in iterator:
+            if first_batch is None:
+                first_batch = time.perf_counter() - start
+                # Size of the tensors, which are transferred from the workers and pinned
+                batch_mib = sum(tensor.element_size() * tensor.nelement() for tensor in batch[1:]) / 2 ** 20
+            batches += 1
+            if batches == warmup:
+                measure_start = time.perf_counter()
+            elif batches > warmup:
+                samples += len(batch[1])
+                # Repeated augmentations of an image are decoded once
+                images += len(set(batch[0]))
+
+            pids = _worker_pids(iterator)
+            rss = [_read_proc_mib(pid, "status", "VmHWM") for pid in pids]
+            pss = [_read_proc_mib(pid, "smaps_rollup", "Pss") for pid in pids]
+            if rss and None not in rss:
+                worker_rss.append(max(rss))
+            if pss and None not in pss:
+                worker_pss.append(sum(pss))
+            if batches >= warmup:
+                for pid in pids:
+                    private = _read_proc_mib(pid, "smaps_rollup", "Private_Dirty")
+                    if private is not None:
+                        private_start.setdefault(pid, private)
+                        private_end[pid] = private
+            if batches == warmup + num_batches:
+                break
+        if measure_start is None:  # Less batches than the warmup, measure from the start
+            measure_start = start
+    duration = time.perf_counter() - measure_start
+
+    return {
+        "first_batch_s": first_batch,
+        "batch_mib": batch_mib,
+        "samples_per_s": samples / duration if duration > 0 else None,
+        "images_per_s": images / duration if duration > 0 else None,
+        "worker_peak_rss_mib": max(worker_rss) if worker_rss else None,
+        "worker_pss_mib": max(worker_pss) if worker_pss else None,
+        "worker_private_growth_mib": max(private_end[pid] - private_start[pid] for pid in private_start) if private_start else None,
+    }
+
+
+def _format(value: Optional[float], precision: int = 1) -> str:
+    return "-" if value is None else f"{value:.{precision}f}"
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Measures the throughput of the training data pipeline without a model.")
+    parser.add_argument("-d", "--data", type=str, default="config/torso.data", help="Path to data config file (.data)")
+    parser.add_argument("--key", type=str, default="yolotrain", help="Key of the image list in the data config (e.g. 'unettrain' or 'valid')")
+    parser.add_argument("--transforms", type=str, default="augmentation", choices=["augmentation", "default"],
+                        help="Uses the training augmentations or only the default transforms of the evaluation")
+    parser.add_argument("-b", "--batch_size", type=int, default=8, help="Size of each image batch")
+    parser.add_argument("--img_size", type=int, default=416, help="Size of each image dimension")
+    parser.add_argument("--multiscale_training", action="store_true", help="Changes the image size every tenth batch like in training")
+    parser.add_argument("--no_detect", action="store_true", help="Does not load the bounding box labels")
+    parser.add_argument("--no_segment", action="store_true", help="Does not load the segmentation masks")
+    parser.add_argument("--cache_images", action="store_true", help="Reads the decoded images and masks from the memory-mapped cache")
+    parser.add_argument("--uint8_batches", action="store_true", help="Keeps the images and masks uint8 in the data loader")
+    parser.add_argument("--repeat_augmentations", type=int, default=1,
+                        help="Decodes each image once and augments it this many times in the same batch like in training")
+    parser.add_argument("--n_cpu", type=int, nargs="+", default=[0, 1, 2, 4], help="Numbers of data loader workers to compare")
+    parser.add_argument("--batches", type=int, default=20,
+                        help="Number of measured batches for each number of workers, 0 measures a whole epoch")
+    parser.add_argument("--warmup", type=int, default=2, help="Number of batches before the measurement")
+    parser.add_argument("--stage_samples", type=int, default=32, help="Number of samples for the per stage profile (0 to skip)")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Writes the results as json to this file")
+    args = parser.parse_args()
+    print(f"Command line arguments: {args}")
+
+    from yoeo.train import _create_data_loader
+    from yoeo.utils.augmentations import AUGMENTATION_TRANSFORMS
+    from yoeo.utils.transforms import DEFAULT_TRANSFORMS
+
+    data_config = parse_data_config(args.data)
+    list_path = data_config.get(args.key) or data_config["train"]
+    transform = AUGMENTATION_TRANSFORMS if args.transforms == "augmentation" else DEFAULT_TRANSFORMS
+
+    def create_data_loader(n_cpu):
+        return _create_data_loader(
+            list_path, args.batch_size, args.img_size, n_cpu,
+            multiscale_training=args.multiscale_training,
+            is_detect=not args.no_detect,
+            is_segment=not args.no_segment,
+            transform=transform,
+            cache_images=args.cache_images,
+            uint8=args.uint8_batches,
+            repeats=args.repeat_augmentations)
+
+    results = {"list": list_path, "transforms": args.transforms, "batch_size": args.batch_size,
+               "repeat_augmentations": args.repeat_augmentations, "stages": {}, "workers": []}
+
+    if args.stage_samples > 0:
+        dataset = create_data_loader(0).dataset
+        stages = profile_stages(dataset, min(args.stage_samples, len(dataset)), args.batch_size)
+        results["stages"] = stages
+        total = sum(stages.values())
+        table = [["Stage", "ms / sample", "Share"]]
+        for name, milliseconds in stages.items():
+            table.append([name, f"{milliseconds:.2f}", f"{milliseconds / total:.1%}"])
+        table.append(["total", f"{total:.2f}", "100.0%"])
+        print(f"---- Stages of {list_path} in a single process ----")
+        print(AsciiTable(table).table)
+        print(f"---- At most {1000 / total:.1f} samples/s per worker ----")
+        if args.repeat_augmentations > 1:
+            # The decoding is shared by the repeated augmentations, the transforms run for each of them
+            decode = sum(stages.get(name, 0.0) for name in ("decode", "label_parse", "mask_decode"))
+            repeated = decode / args.repeat_augmentations + total - decode
+            print(f"---- At most {1000 / repeated:.1f} samples/s per worker with {args.repeat_augmentations} augmentations per decoded image ----")
+
+    table = [["Workers", "First batch (s)", "Batch (MiB)", "Samples/s", "Images/s", "Speedup", "Worker peak RSS (MiB)",
+              "Worker PSS total (MiB)", "Worker private growth (MiB)"]]
+    for n_cpu in args.n_cpu:
+        result = {"n_cpu": n_cpu, **measure_throughput(create_data_loader(n_cpu), args.batches, args.warmup)}
+        results["workers"].append(result)
+        baseline = results["workers"][0]["samples_per_s"]
+        speedup = result["samples_per_s"] / baseline if result["samples_per_s"] and baseline else None
+        table.append([
+            n_cpu,
+            _format(result["first_batch_s"], 2),
+            _format(result["batch_mib"]),
+            _format(result["samples_per_s"]),
+            _format(result["images_per_s"]),
+            _format(speedup, 2),
+            _format(result["worker_peak_rss_mib"]),
+            _format(result["worker_pss_mib"]),
+            _format(result["worker_private_growth_mib"]),
+        ])
+    print(f"---- Throughput with batch size {args.batch_size} ----")
+    print(AsciiTable(table).table)
+    if args.repeat_augmentations > 1:
+        print(f"---- Each image is decoded once for {args.repeat_augmentations} augmented samples, so an epoch of the same length "
+              f"sees 1 / {args.repeat_augmentations} of the images and each batch {args.repeat_augmentations}x fewer distinct images ----")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    run()
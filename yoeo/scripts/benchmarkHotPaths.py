@@ -0,0 +1,303 @@
+#! /usr/bin/env python3
+
+from __future__ import annotations
+
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from terminaltables import AsciiTable
+
+# Each case gets the path of the model definition and returns the function that is timed,
+# the setup of the inputs is not measured
+Case = Callable[[str], Callable[[], object]]
+
+IMG_SIZE = 416
+
+
+def _random_predictions(batch_size: int, num_boxes: int, num_classes: int, all_above_threshold: bool = False):
+    """Raw model output (batch, boxes, xywh + objectness + class scores) like it is passed to the non-maximum suppression."""
+    import torch
+
+    prediction = torch.rand(batch_size, num_boxes, 5 + num_classes)
+    prediction[..., :2] *= IMG_SIZE
+    prediction[..., 2:4] = prediction[..., 2:4] * IMG_SIZE / 4 + 2
+    if all_above_threshold:
+        # Every box and class survives the confidence filter, which is the worst case for the suppression
+        prediction[..., 4:] = 0.9 + 0.1 * prediction[..., 4:]
+    return prediction
+
+
+def _random_xyxy(num_boxes: int):
+    import torch
+
+    xy = torch.rand(num_boxes, 2) * IMG_SIZE * 0.8
+    wh = torch.rand(num_boxes, 2) * IMG_SIZE * 0.2 + 4
+    return torch.cat((xy, xy + wh), 1)
+
+
+def _nms_case(batch_size: int, num_boxes: int, num_classes: int, all_above_threshold: bool = False) -> Case:
+    def setup(model_path):
+        from yoeo.utils.utils import non_max_suppression
+        prediction = _random_predictions(batch_size, num_boxes, num_classes, all_above_threshold)
+        return lambda: non_max_suppression(prediction, conf_thres=0.5, iou_thres=0.5)
+    return setup
+
+
+def _batch_statistics_case(batch_size: int, num_detections: int, num_targets: int, num_classes: int) -> Case:
+    def setup(model_path):
+        import torch
+        from yoeo.utils.utils import get_batch_statistics
+
+        outputs = []
+        targets = []
+        for sample_i in range(batch_size):
+            target_boxes = _random_xyxy(num_targets)
+            target_labels = torch.randint(0, num_classes, (num_targets, 1)).float()
+            targets.append(torch.cat((torch.full((num_targets, 1), float(sample_i)), target_labels, target_boxes), 1))
+            # Half of the detections are jittered targets, the others are random boxes
+            matched = target_boxes[torch.randint(0, num_targets, (num_detections // 2,))] + torch.randn(num_detections // 2, 4) * 4
+            boxes = torch.cat((matched, _random_xyxy(num_detections - num_detections // 2)))
+            scores = torch.rand(num_detections, 1).sort(0, descending=True)[0]
+            labels = torch.randint(0, num_classes, (num_detections, 1)).float()
+            outputs.append(torch.cat((boxes, scores, labels), 1))
+        targets = torch.cat(targets)
+        return lambda: get_batch_statistics(outputs, targets, iou_threshold=0.5)
+    return setup
+
+
+def _ap_per_class_case(num_detections: int, num_targets: int, num_classes: int) -> Case:
+    def setup(model_path):
+        from yoeo.utils.utils import ap_per_class
+
+        true_positives = (np.random.rand(num_detections) > 0.5).astype(np.float64)
+        conf = np.random.rand(num_detections)
+        pred_cls = np.random.randint(0, num_classes, num_detections).astype(np.float64)
+        target_cls = np.random.randint(0, num_classes, num_targets).astype(np.float64)
+        return lambda: ap_per_class(true_positives, conf, pred_cls, target_cls)
+    return setup
+
+
+def _seg_iou_case(batch_size: int, num_classes: int) -> Case:
+    def setup(model_path):
+        import torch
+        from yoeo.utils.utils import seg_iou
+
+        pred = torch.randint(0, num_classes, (batch_size, IMG_SIZE, IMG_SIZE), dtype=torch.uint8)
+        target = torch.randint(0, num_classes, (batch_size, IMG_SIZE, IMG_SIZE))
+        return lambda: seg_iou(pred, target, num_classes)
+    return setup
+
+
+def _yolo_training_inputs(model_path: str, batch_size: int, targets_per_image: int):
+    """Training outputs of the model and normalized targets (image, class, x, y, w, h)."""
+    import torch
+    from yoeo.models import Darknet
+
+    model = Darknet(model_path)
+    model.train()
+    with torch.no_grad():
+        # The forward pass sets the strides of the yolo layers, the outputs of a large batch are generated
+        predictions, seg_predictions = model(torch.rand(1, 3, IMG_SIZE, IMG_SIZE))
+    predictions = [torch.randn(batch_size, *p.shape[1:]) for p in predictions]
+    seg_predictions = [torch.randn(batch_size, *p.shape[1:]) for p in seg_predictions]
+
+    num_targets = batch_size * targets_per_image
+    image_ids = torch.arange(batch_size).repeat_interleave(targets_per_image).float()[:, None]
+    labels = torch.randint(0, model.yolo_layers[0].num_classes, (num_targets, 1)).float()
+    xy = torch.rand(num_targets, 2) * 0.8 + 0.1
+    wh = torch.rand(num_targets, 2) * 0.3 + 0.01
+    targets = torch.cat((image_ids, labels, xy, wh), 1)
+    return model, (predictions, seg_predictions), targets
+
+
+def _build_targets_case(batch_size: int, targets_per_image: int) -> Case:
+    def setup(model_path):
+        from yoeo.utils.loss import build_targets
+        model, (predictions, _), targets = _yolo_training_inputs(model_path, batch_size, targets_per_image)
+        return lambda: build_targets(predictions, targets, model)
+    return setup
+
+
+def _yolo_loss_case(batch_size: int, targets_per_image: int) -> Case:
+    def setup(model_path):
+        from yoeo.utils.loss import yolo_loss
+        model, outputs, targets = _yolo_training_inputs(model_path, batch_size, targets_per_image)
+        return lambda: yolo_loss(outputs, targets, model)
+    return setup
+
+
+CASES: Dict[str, Case] = {
+    # The non-maximum suppression stops after the image that exceeds its time limit of 1 s,
+    # so the cases are sized to stay below it and measure the complete work
+    "nms/b8_2535boxes_3cls": _nms_case(8, 2535, 3),
+    "nms/b8_10647boxes_3cls": _nms_case(8, 10647, 3),
+    "nms/b1_10647boxes_10cls": _nms_case(1, 10647, 10),
+    "nms/b1_2535boxes_3cls_all_above_threshold": _nms_case(1, 2535, 3, all_above_threshold=True),
+    "nms/b1_500boxes_20cls_all_above_threshold": _nms_case(1, 500, 20, all_above_threshold=True),
+    "get_batch_statistics/b8_100det_20gt_3cls": _batch_statistics_case(8, 100, 20, 3),
+    "get_batch_statistics/b8_300det_100gt_80cls": _batch_statistics_case(8, 300, 100, 80),
+    "ap_per_class/10k_det_3cls": _ap_per_class_case(10000, 2000, 3),
+    "ap_per_class/100k_det_80cls": _ap_per_class_case(100000, 20000, 80),
+    "seg_iou/b8_3cls": _seg_iou_case(8, 3),
+    "seg_iou/b8_20cls": _seg_iou_case(8, 20),
+    "build_targets/b8_20gt": _build_targets_case(8, 20),
+    "build_targets/b32_100gt": _build_targets_case(32, 100),
+    "yolo_loss/b8_20gt": _yolo_loss_case(8, 20),
+    "yolo_loss/b32_100gt": _yolo_loss_case(32, 100),
+}
+
+
+def _time_case(function: Callable[[], object], repeats: int, warmup: int, min_time: float) -> List[float]:
+    for _ in range(warmup):
+        function()
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeats or time.perf_counter() - start < min_time:
+        t = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - t)
+    return times
+
+
+def run_benchmarks(names: Optional[List[str]] = None, repeats: int = 10, warmup: int = 2, min_time: float = 0.5,
+                   num_threads: int = 1, model_path: str = "config/yoeo.cfg") -> Dict:
+    """Runs the hot path benchmarks on synthetic inputs.
+
+    :param names: Names or name prefixes (e.g. 'nms') of the cases to run, defaults to None (all cases)
+    :type names: Optional[List[str]]
+    :param repeats: Minimum number of timed runs per case, defaults to 10
+    :type repeats: int, optional
+    :param warmup: Number of untimed runs per case, defaults to 2
+    :type warmup: int, optional
+    :param min_time: Minimum seconds of timed runs per case, defaults to 0.5
+    :type min_time: float, optional
+    :param num_threads: Number of PyTorch threads, a single thread gives the most stable results, defaults to 1
+    :type num_threads: int, optional
+    :param model_path: Path to the model definition file (.cfg) of the build_targets and yolo_loss cases,
+                       defaults to "config/yoeo.cfg"
+    :type model_path: str, optional
+    :return: Environment and median, minimum and number of runs in milliseconds for each case
+    :rtype: Dict
+    """
+    import torch
+
+    torch.set_num_threads(num_threads)
+    results = {}
+    for name, setup in CASES.items():
+        if names and not any(name == n or name.startswith(n.rstrip("/") + "/") for n in names):
+            continue
+        # Same inputs on every run, so the results of different versions are comparable
+        torch.manual_seed(0)
+        np.random.seed(0)
+        function = setup(model_path)
+        # Keep the progress bars of the measured functions out of the output
+        with contextlib.redirect_stderr(io.StringIO()):
+            times = np.asarray(_time_case(function, repeats, warmup, min_time)) * 1000
+        results[name] = {"median_ms": float(np.median(times)), "min_ms": float(times.min()), "runs": len(times)}
+        print(f"{name:<50} {results[name]['median_ms']:10.3f} ms (median of {len(times)})")
+
+    return {
+        "meta": {
+            "torch": torch.__version__,
+            "numpy": np.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "threads": num_threads,
+        },
+        "results": results,
+    }
+
+
+def compare_results(baseline: Dict, current: Dict, threshold: float) -> Tuple[List[List], List[str]]:
+    """Compares the median times of the current cases with the baseline.
+
+    :param baseline: Results of `run_benchmarks` used as reference
+    :type baseline: Dict
+    :param current: Results of `run_benchmarks` that are checked
+    :type current: Dict
+    :param threshold: Allowed relative slowdown (e.g. 0.1 for 10 %)
+    :type threshold: float
+    :return: Table rows and the names of the regressed cases
+    :rtype: Tuple[List[List], List[str]]
+    """
+    rows = [["Case", "Baseline (ms)", "Current (ms)", "Change", "Status"]]
+    regressions = []
+    # Cases that only exist in the baseline were not selected for this run
+    for name in sorted(current["results"]):
+        if name not in baseline["results"]:
+            rows.append([name, "-", f"{current['results'][name]['median_ms']:.3f}", "-", "new"])
+            continue
+        before = baseline["results"][name]["median_ms"]
+        after = current["results"][name]["median_ms"]
+        change = after / before - 1
+        status = "ok"
+        if change > threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            status = "faster"
+        rows.append([name, f"{before:.3f}", f"{after:.3f}", f"{change * 100:+.1f} %", status])
+    return rows, regressions
+
+
+def _load(path: str) -> Dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmark the post-processing, metric and loss hot paths and check them for regressions.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("cases", type=str, nargs="*", help=f"Cases or groups to run (e.g. 'nms'), defaults to all: {', '.join(CASES)}")
+    run_parser.add_argument("-o", "--output", type=str, default=None, help="Writes the results as json to this file (e.g. to store a baseline)")
+    run_parser.add_argument("-b", "--baseline", type=str, default=None, help="Compares the results with this baseline and fails on regressions")
+    run_parser.add_argument("-t", "--threshold", type=float, default=0.1, help="Allowed relative slowdown compared to the baseline")
+    run_parser.add_argument("-r", "--repeats", type=int, default=10, help="Minimum number of timed runs per case")
+    run_parser.add_argument("--warmup", type=int, default=2, help="Number of untimed runs per case")
+    run_parser.add_argument("--min_time", type=float, default=0.5, help="Minimum seconds of timed runs per case")
+    run_parser.add_argument("--threads", type=int, default=1, help="Number of PyTorch threads")
+    run_parser.add_argument("-m", "--model", type=str, default="config/yoeo.cfg",
+                            help="Path to model definition file (.cfg) of the build_targets and yolo_loss cases")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files and fail on regressions")
+    compare_parser.add_argument("baseline", type=str, help="Results used as reference")
+    compare_parser.add_argument("current", type=str, help="Results that are checked")
+    compare_parser.add_argument("-t", "--threshold", type=float, default=0.1, help="Allowed relative slowdown compared to the baseline")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        current = run_benchmarks(args.cases, args.repeats, args.warmup, args.min_time, args.threads, args.model)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=2)
+            print(f"---- Results were saved to: '{args.output}' ----")
+        if not args.baseline:
+            return
+        baseline = _load(args.baseline)
+    else:
+        baseline, current = _load(args.baseline), _load(args.current)
+
+    if baseline.get("meta") != current.get("meta"):
+        print(f"WARNING: The environments differ, baseline: {baseline.get('meta')}, current: {current.get('meta')}")
+
+    rows, regressions = compare_results(baseline, current, args.threshold)
+    print(AsciiTable(rows).table)
+    if regressions:
+        print(f"---- {len(regressions)} cases are more than {args.threshold * 100:.0f} % slower than the baseline: {', '.join(regressions)} ----")
+        sys.exit(1)
+    print(f"---- No case is more than {args.threshold * 100:.0f} % slower than the baseline ----")
+
+
+if __name__ == "__main__":
+    run()
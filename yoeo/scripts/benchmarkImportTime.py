@@ -0,0 +1,120 @@
+#! /usr/bin/env python3
+
+# Only the standard library is imported here, the entry points are measured in fresh processes.
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from importlib import metadata
+from typing import Dict, List
+
+# Dependencies that take long to import and should only be loaded by the code paths that need them
+HEAVY_MODULES = ("torch", "torchvision", "matplotlib", "cv2", "imgaug", "tensorboard", "torchsummary", "onnx", "tvm")
+
+
+def get_entry_points() -> Dict[str, str]:
+    """
+    Returns all `yoeo-*` console scripts of the installed package, or of the `pyproject.toml` of the repository
+    if the package is not installed.
+
+    :return: Mapping of the script names to their 'module:function' reference
+    :rtype: Dict[str, str]
+    """
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        console_scripts = entry_points.select(group="console_scripts")
+    else:
+        console_scripts = entry_points.get("console_scripts", [])
+    scripts = {entry_point.name: entry_point.value for entry_point in console_scripts
+               if entry_point.name.startswith("yoeo-")}
+    if scripts:
+        return scripts
+
+    pyproject = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "pyproject.toml")
+    with open(pyproject, "r") as f:
+        return dict(re.findall(r'^(yoeo-[\w-]+)\s*=\s*"([\w.]+:\w+)"', f.read(), re.MULTILINE))
+
+
+def _measure_entry_point(name: str, reference: str) -> Dict:
+    module, function = reference.split(":")
+    code = (
+        "import sys, time, json\n"
+        "t = time.perf_counter()\n"
+        f"import {module}\n"
+        "import_time = time.perf_counter() - t\n"
+        f"sys.argv = [{name!r}, '--help']\n"
+        "try:\n"
+        f"    {module}.{function}()\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        f"heavy = sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)\n"
+        "sys.stdout.write('\\n' + json.dumps({'import': import_time, 'heavy_modules': heavy}) + '\\n')\n")
+    t = time.perf_counter()
+    output = subprocess.check_output([sys.executable, "-c", code], stderr=subprocess.DEVNULL).decode("utf-8")
+    result = json.loads(output.strip().splitlines()[-1])
+    result["help"] = time.perf_counter() - t
+    return result
+
+
+def benchmark_import_time(entry_points: Dict[str, str], repeats: int = 3) -> Dict[str, Dict]:
+    """
+    Measures the import time of the module of each entry point and the wall time of a complete `<entry point> --help`
+    call (including the interpreter startup) in fresh processes.
+
+    :param entry_points: Mapping of the script names to their 'module:function' reference
+    :type entry_points: Dict[str, str]
+    :param repeats: Number of processes per entry point, the median is reported, defaults to 3
+    :type repeats: int, optional
+    :return: Median import and help time in seconds and the heavy modules loaded by `--help` for each entry point
+    :rtype: Dict[str, Dict]
+    """
+    results = {}
+    for name, reference in sorted(entry_points.items()):
+        runs = [_measure_entry_point(name, reference) for _ in range(repeats)]
+        results[name] = {
+            "import": statistics.median(run["import"] for run in runs),
+            "help": statistics.median(run["help"] for run in runs),
+            "heavy_modules": runs[-1]["heavy_modules"],
+        }
+    return results
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Measure the startup time of all yoeo-* commands and check it against a budget.")
+    parser.add_argument("--budget", type=float, default=1.0, help="Maximum seconds a '<command> --help' call may take")
+    parser.add_argument("-r", "--repeats", type=int, default=3, help="Number of fresh processes per command")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Writes the results as json to this file")
+    parser.add_argument("commands", type=str, nargs="*", help="Commands to measure, defaults to all yoeo-* commands")
+    args = parser.parse_args()
+
+    entry_points = get_entry_points()
+    if args.commands:
+        entry_points = {name: entry_points[name] for name in args.commands}
+
+    results = benchmark_import_time(entry_points, args.repeats)
+
+    over_budget: List[str] = []
+    for name, result in results.items():
+        status = "ok"
+        if result["help"] > args.budget:
+            status = "OVER BUDGET"
+            over_budget.append(name)
+        print(f"{name:<24} import {result['import'] * 1000:8.1f} ms | --help {result['help'] * 1000:8.1f} ms | "
+              f"{status} | heavy modules loaded by --help: {', '.join(result['heavy_modules']) or '-'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"budget": args.budget, "results": results}, f, indent=2)
+
+    if over_budget:
+        print(f"---- {len(over_budget)} commands exceed the budget of {args.budget} s: {', '.join(over_budget)} ----")
+        sys.exit(1)
+    print(f"---- All commands are within the budget of {args.budget} s ----")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,84 @@
+#! /usr/bin/env python3
+
+# Only the standard library is imported at module level,
+# so the child processes can measure the import of the heavy dependencies themselves.
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from typing import Dict, Optional
+
+
+def measure_startup(model_path: str, weights_path: Optional[str], img_size: int = 416) -> Dict[str, float]:
+    """Measures the phases of the model startup in the current process.
+
+    Should be called in a fresh process, as already imported modules and warm caches hide most of the startup time.
+
+    :param model_path: Path to model definition file (.cfg)
+    :type model_path: str
+    :param weights_path: Path to weights or checkpoint file (.weights, .pth or .mmw)
+    :type weights_path: Optional[str]
+    :param img_size: Size of each image dimension for yolo, defaults to 416
+    :type img_size: int, optional
+    :return: Seconds spent for each phase
+    :rtype: Dict[str, float]
+    """
+    t = time.perf_counter()
+    import torch
+    from yoeo.models import load_model
+    times = {"import": time.perf_counter() - t}
+
+    t = time.perf_counter()
+    model = load_model(model_path, weights_path)
+    model.eval()
+    times["load_model"] = time.perf_counter() - t
+
+    input_img = torch.rand(1, 3, img_size, img_size)
+    with torch.no_grad():
+        t = time.perf_counter()
+        model(input_img)
+        times["first_inference"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        model(input_img)
+        times["second_inference"] = time.perf_counter() - t
+
+    times["time_to_first_inference"] = times["import"] + times["load_model"] + times["first_inference"]
+    return times
+
+
+def _measure_startup_in_subprocess(model_path: str, weights_path: Optional[str], img_size: int) -> Dict[str, float]:
+    code = (
+        "import json, sys\n"
+        "from yoeo.scripts.benchmarkStartup import measure_startup\n"
+        f"times = measure_startup({model_path!r}, {weights_path!r}, {img_size!r})\n"
+        "sys.stdout.write('\\n' + json.dumps(times) + '\\n')\n")
+    t = time.perf_counter()
+    output = subprocess.check_output([sys.executable, "-c", code], stderr=subprocess.DEVNULL).decode("utf-8")
+    process_time = time.perf_counter() - t
+    # The model loading may print as well, the measurements are the last line
+    times = json.loads(output.strip().splitlines()[-1])
+    times["process"] = process_time
+    return times
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Measure the time from process start to the first inference.")
+    parser.add_argument("-m", "--model", type=str, default="config/yoeo.cfg", help="Path to model definition file (.cfg)")
+    parser.add_argument("-w", "--weights", type=str, default=None, help="Path to weights or checkpoint file (.weights, .pth or .mmw)")
+    parser.add_argument("--img_size", type=int, default=416, help="Size of each image dimension for yolo")
+    parser.add_argument("-r", "--repeats", type=int, default=5, help="Number of fresh processes that are measured")
+    args = parser.parse_args()
+
+    runs = [_measure_startup_in_subprocess(args.model, args.weights, args.img_size) for _ in range(args.repeats)]
+
+    print(f"Startup of '{args.model}' with weights '{args.weights}' (median of {args.repeats} processes):")
+    for phase in runs[0]:
+        median = statistics.median(times[phase] for times in runs)
+        print(f"  {phase:<24} {median * 1000:10.1f} ms")
+
+
+if __name__ == "__main__":
+    run()
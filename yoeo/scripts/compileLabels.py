@@ -0,0 +1,52 @@
+#! /usr/bin/env python3
+
+import argparse
+
+from terminaltables import AsciiTable
+
+from yoeo.utils.parse_config import parse_data_config
+from yoeo.utils.label_index import LabelIndex, get_label_files, get_label_index_path
+
+
+def compile_labels(list_path: str, verbose: bool = False) -> LabelIndex:
+    """Parses and validates the label files of a list file and saves the index to the cache.
+
+    :param list_path: Path of the list file of the dataset
+    :type list_path: str
+    :param verbose: Prints each invalid label file, defaults to False
+    :type verbose: bool, optional
+    :return: Index of the labels
+    :rtype: LabelIndex
+    """
+    with open(list_path, "r") as file:
+        img_files = file.readlines()
+    index = LabelIndex.compile(get_label_files(img_files), verbose=verbose)
+    index.save(get_label_index_path(list_path))
+    return index
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description="Compiles the YOLO label files of the datasets into label indices, which the data loaders read instead of the label files.")
+    parser.add_argument("-d", "--data", type=str, default="config/custom.data", help="Path to data config file (.data)")
+    parser.add_argument("-v", "--verbose", action='store_true', help="Prints each invalid label file")
+    args = parser.parse_args()
+    print(f"Command line arguments: {args}")
+
+    data_config = parse_data_config(args.data)
+    # The detection splits can have their own list files
+    list_paths = []
+    for key in ("train", "valid", "yolotrain", "yolovalid"):
+        if key in data_config and data_config[key] not in list_paths:
+            list_paths.append(data_config[key])
+
+    rows = [["List file", "Index", "Samples", "Boxes", "Invalid label files", "Boxes outside of the image"]]
+    for list_path in list_paths:
+        stats = compile_labels(list_path, verbose=args.verbose).stats()
+        rows.append([list_path, get_label_index_path(list_path), stats["samples"], stats["boxes"],
+                     stats["invalid_label_files"], stats["boxes_outside_image"]])
+    print(AsciiTable(rows).table)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,40 @@
+#! /usr/bin/env python3
+
+import argparse
+
+import tqdm
+
+from yoeo.utils.parse_config import parse_data_config
+from yoeo.utils.segmentation_masks import convert_mask_file, get_mask_files
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description="Converts the 3-channel segmentation masks of the datasets to single-channel masks in place.")
+    parser.add_argument("-d", "--data", type=str, default="config/custom.data", help="Path to data config file (.data)")
+    parser.add_argument("--mode", type=str, default="P", choices=["P", "L"],
+                        help="'P' stores palette masks with 1, 2 or 4 bits per pixel for up to 16 classes, 'L' 8 bit grayscale masks")
+    args = parser.parse_args()
+    print(f"Command line arguments: {args}")
+
+    data_config = parse_data_config(args.data)
+    mask_files = []
+    for key in ("train", "valid", "unettrain", "unetvalid"):
+        if key not in data_config:
+            continue
+        with open(data_config[key], "r") as file:
+            for mask_file in get_mask_files([path.rstrip() for path in file.readlines()]):
+                if mask_file not in mask_files:
+                    mask_files.append(mask_file)
+
+    skipped = 0
+    for mask_file in tqdm.tqdm(mask_files, desc="Converting masks"):
+        reason = convert_mask_file(mask_file, args.mode)
+        if reason is not None:
+            print(f"Skipped '{mask_file}': {reason}")
+            skipped += 1
+    print(f"Converted {len(mask_files) - skipped} of {len(mask_files)} masks")
+
+
+if __name__ == "__main__":
+    run()
@@ -2,17 +2,6 @@ import argparse
 import sys
 from shutil import copyfile
 
-import onnx
-
-try:
-    from tvm.driver import tvmc
-    from tvm.driver.tvmc.model import TVMCModel
-    from tvm.relay.transform import ToMixedPrecision
-    from tvm import relay
-except ModuleNotFoundError:
-    print("Please install Apache TVM!")
-    sys.exit(1)
-
 
 def make_parser():
     parser = argparse.ArgumentParser("YOEO TVM Tuning")
@@ -72,6 +61,18 @@ def run():
     # Make CLI
     args = make_parser().parse_args()
 
+    # Import the heavy dependencies only after the arguments are parsed, so `--help` works without TVM
+    import onnx
+
+    try:
+        from tvm.driver import tvmc
+        from tvm.driver.tvmc.model import TVMCModel
+        from tvm.relay.transform import ToMixedPrecision
+        from tvm import relay
+    except ModuleNotFoundError:
+        print("Please install Apache TVM!")
+        sys.exit(1)
+
     # Define model input
     input_name = "InputLayer"
     shape_list = {input_name : (1, 3, args.input_size, args.input_size)}
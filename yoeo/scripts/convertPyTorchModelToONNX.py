@@ -1,20 +1,26 @@
 #! /usr/bin/env python3
+from __future__ import annotations
+
 import argparse
 import os.path
-from typing import Tuple
-
-import onnx
-import torch
+from typing import Tuple, TYPE_CHECKING
 
-import yoeo.models
+# ONNX, PyTorch and the model are imported in the functions that need them, so `--help` starts instantly
+if TYPE_CHECKING:
+    import onnx
+    import yoeo.models
 
 
 def convert_model(model_cfg: str, weights_pth: str, output_path: str) -> None:
+    import yoeo.models
+
     pytorch_model = yoeo.models.load_model(model_cfg, weights_pth)
     convert_to_onnx(model=pytorch_model, output_path=output_path)
 
 
 def convert_to_onnx(model: yoeo.models.Darknet, output_path: str, image_size: int = 416, batch_size: int = 1) -> None:
+    import torch
+
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
     model.to(device)
@@ -38,10 +44,14 @@ def check_model(model_path: str) -> None:
 
 
 def load_onnx(path: str) -> onnx.onnx_ml_pb2.ModelProto:
+    import onnx
+
     return onnx.load(path)
 
 
 def check_onnx(model: onnx.onnx_ml_pb2.ModelProto) -> None:
+    import onnx
+
     # https://github.com/onnx/onnx/blob/main/docs/PythonAPIOverview.md (April 7, 2022)
     print("="*30)
     try:
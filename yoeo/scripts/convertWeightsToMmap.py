@@ -0,0 +1,53 @@
+#! /usr/bin/env python3
+import argparse
+import os.path
+
+
+def convert_weights(model_cfg: str, weights_path: str, output_path: str) -> None:
+    import torch
+    import yoeo.models
+
+    model = yoeo.models.Darknet(model_cfg)
+    if weights_path.endswith(".pth"):
+        model.load_state_dict(torch.load(weights_path, map_location="cpu"))
+    else:
+        model.load_darknet_weights(weights_path)
+    model.save_mmap_weights(output_path)
+
+
+def construct_path(weights_path: str) -> str:
+    from yoeo.utils.mmap_weights import MMAP_WEIGHTS_EXTENSION
+
+    filename, ext = os.path.splitext(os.path.abspath(weights_path))
+    return f"{filename}{MMAP_WEIGHTS_EXTENSION}"
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Convert YOEO weights to the memory-mapped weights format (.mmw)')
+    parser.add_argument(
+        "model_cfg",
+        type=str,
+        help="full path to model file (.cfg)."
+    )
+    parser.add_argument(
+        "model_weights",
+        type=str,
+        help="full path to model weights file (.pth or .weights). The .mmw file will be output with the same filename."
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="path of the memory-mapped weights file, overwrites the default output path."
+    )
+
+    args = parser.parse_args()
+
+    output_path = args.output or construct_path(args.model_weights)
+    convert_weights(args.model_cfg, args.model_weights, output_path)
+    print(f"---- Memory-mapped weights were saved to: '{output_path}' ----")
+
+
+if __name__ == "__main__":
+    run()
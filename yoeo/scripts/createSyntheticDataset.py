@@ -0,0 +1,35 @@
+#! /usr/bin/env python3
+
+import argparse
+
+from yoeo.utils.synthetic_dataset import create_synthetic_dataset, parse_resolution
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Creates a random dataset in the YOEO layout for benchmarks and tests.")
+    parser.add_argument("output_dir", type=str, help="Directory of the dataset")
+    parser.add_argument("-n", "--names", type=str, default="data/yoeo_names.yaml", help="Path to the class names file (.yaml)")
+    parser.add_argument("--num_images", type=int, default=100, help="Number of images over the train and validation split")
+    parser.add_argument("--resolutions", type=str, nargs="+", default=["640x480"],
+                        help="Image resolutions as WIDTHxHEIGHT, each image uses one of them at random")
+    parser.add_argument("--max_boxes", type=int, default=10, help="Maximum number of bounding boxes per image")
+    parser.add_argument("--valid_fraction", type=float, default=0.2, help="Fraction of the images in the validation split")
+    parser.add_argument("--image_format", type=str, default="jpg", choices=["jpg", "png"], help="File format of the images")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed, the same seed creates the same dataset")
+    args = parser.parse_args()
+    print(f"Command line arguments: {args}")
+
+    data_path = create_synthetic_dataset(
+        args.output_dir,
+        names_path=args.names,
+        num_images=args.num_images,
+        resolutions=[parse_resolution(resolution) for resolution in args.resolutions],
+        max_boxes=args.max_boxes,
+        valid_fraction=args.valid_fraction,
+        image_format=args.image_format,
+        seed=args.seed)
+    print(f"Created {args.num_images} images, use '--data {data_path}' with yoeo-train and yoeo-test")
+
+
+if __name__ == "__main__":
+    run()
@@ -105,11 +105,8 @@ for partition in ['train', 'test']:  # Handle both TORSO-21 partitions
             mask = np.zeros(seg_in.shape[:2], dtype=np.uint8)
             mask += ((seg_in == (127, 127, 127)).all(axis=2)).astype(np.uint8)  # Lines
             mask += (((seg_in >= (254, 254, 254)).all(axis=2)).astype(np.uint8) * 2)  # Field
-            seg_out = np.zeros(seg_in.shape, dtype=np.uint8)
-            seg_out[..., 0] = mask
-            seg_out[..., 1] = mask
-            seg_out[..., 2] = mask
-            cv2.imwrite(os.path.join(yoeo_segmentation_dir, img_name_without_extension + ".png"), seg_out)
+            # Single-channel mask with the class id of each pixel
+            cv2.imwrite(os.path.join(yoeo_segmentation_dir, img_name_without_extension + ".png"), mask)
         else:
             print(f"No segmentation found: '{seg_in_path}'")
             continue
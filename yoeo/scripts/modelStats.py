@@ -0,0 +1,67 @@
+#! /usr/bin/env python3
+
+import json
+import argparse
+
+from terminaltables import AsciiTable
+
+from yoeo.utils.cost_model import estimate_model_cost
+
+
+def _mib(num_bytes):
+    return f"{num_bytes / 2 ** 20:.2f}"
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Estimate parameters, MACs and memory of model definitions without building them.")
+    parser.add_argument("models", type=str, nargs="+", help="Paths to model definition files (.cfg)")
+    parser.add_argument("--img_size", type=int, default=None, help="Size of each image dimension (defaults to the width in the .cfg)")
+    parser.add_argument("-l", "--layers", action="store_true", help="Prints the costs of each layer")
+    parser.add_argument("--json", action="store_true", help="Prints the results as json instead of tables")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Writes the results including all layers as json to this file")
+    args = parser.parse_args()
+
+    costs = [estimate_model_cost(model, args.img_size) for model in args.models]
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump([cost.to_dict() for cost in costs], f, indent=2)
+
+    if args.json:
+        print(json.dumps([cost.to_dict(layers=args.layers) for cost in costs], indent=2))
+        return
+
+    if args.layers:
+        for cost in costs:
+            table = [["Index", "Type", "Output shape", "Params", "MMACs", "Activation (MiB)", "Live (MiB)"]]
+            for layer in cost.layers:
+                table.append([
+                    layer.index,
+                    layer.type,
+                    "x".join(map(str, layer.output_shape)),
+                    layer.params,
+                    f"{layer.macs / 1e6:.1f}",
+                    _mib(layer.activation_bytes),
+                    _mib(layer.live_bytes),
+                ])
+            print(f"---- {cost.model} ({cost.img_size}x{cost.img_size}) ----")
+            print(AsciiTable(table).table)
+
+    # Memory of the weights and all layer outputs, which the model keeps during the forward pass
+    table = [["Model", "Image size", "Params", "GMACs", "Weights (MiB)", "Activations (MiB)", "Peak live (MiB)", "Peak (MiB)"]]
+    for cost in costs:
+        table.append([
+            cost.model,
+            cost.img_size,
+            cost.params,
+            f"{cost.macs / 1e9:.2f}",
+            _mib(cost.param_bytes),
+            _mib(cost.activation_bytes),
+            _mib(cost.peak_live_bytes),
+            _mib(cost.param_bytes + cost.activation_bytes),
+        ])
+    print(AsciiTable(table).table)
+
+
+if __name__ == "__main__":
+    run()
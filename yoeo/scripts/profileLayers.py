@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+
+import argparse
+
+from yoeo.utils.layer_profiler import LayerProfiler, SORT_KEYS
+
+
+def profile_layers(model_path, weights_path=None, img_size=416, batch_size=1, runs=10, warmup=2, device="cpu"):
+    """Runs the model on random images and records the statistics of each layer.
+
+    :param model_path: Path to model definition file (.cfg)
+    :type model_path: str
+    :param weights_path: Path to weights or checkpoint file (.weights, .pth or .mmw), defaults to None (random weights)
+    :type weights_path: str, optional
+    :param img_size: Size of each image dimension for yolo, defaults to 416
+    :type img_size: int, optional
+    :param batch_size: Size of each image batch, defaults to 1
+    :type batch_size: int, optional
+    :param runs: Number of recorded forward passes, defaults to 10
+    :type runs: int, optional
+    :param warmup: Number of forward passes before the recording starts, defaults to 2
+    :type warmup: int, optional
+    :param device: Device the model runs on, defaults to "cpu"
+    :type device: str, optional
+    :return: Profiler with the recorded layers
+    :rtype: LayerProfiler
+    """
+    import torch
+    from yoeo.models import load_model
+
+    model = load_model(model_path, weights_path, device=device)
+    model.eval()
+
+    images = torch.rand(batch_size, 3, img_size, img_size, device=device)
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(images)
+        with LayerProfiler(model) as profiler:
+            for _ in range(runs):
+                model(images)
+    return profiler
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Measure time, memory, parameters and FLOPs of each layer of a model.")
+    parser.add_argument("-m", "--model", type=str, default="config/yoeo.cfg", help="Path to model definition file (.cfg)")
+    parser.add_argument("-w", "--weights", type=str, default=None,
+                        help="Path to weights or checkpoint file (.weights, .pth or .mmw). Uses random weights if not given")
+    parser.add_argument("-b", "--batch_size", type=int, default=1, help="Size of each image batch")
+    parser.add_argument("--img_size", type=int, default=416, help="Size of each image dimension for yolo")
+    parser.add_argument("-r", "--runs", type=int, default=10, help="Number of recorded forward passes")
+    parser.add_argument("--warmup", type=int, default=2, help="Number of forward passes before the recording starts")
+    parser.add_argument("--device", type=str, default="cpu", help="Device the model runs on (e.g. 'cpu' or 'cuda')")
+    parser.add_argument("--sort", type=str, choices=SORT_KEYS, default="time", help="Column the table is sorted by")
+    parser.add_argument("--top", type=int, default=None, help="Only show this many layers")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Writes a Chrome trace with the layer summary to this json file")
+    args = parser.parse_args()
+    print(f"Command line arguments: {args}")
+
+    profiler = profile_layers(
+        args.model,
+        args.weights,
+        img_size=args.img_size,
+        batch_size=args.batch_size,
+        runs=args.runs,
+        warmup=args.warmup,
+        device=args.device)
+
+    print(profiler.table(args.sort, args.top))
+
+    if args.output:
+        profiler.save_trace(args.output)
+        print(f"---- Trace was saved to: '{args.output}' ----")
+
+
+if __name__ == "__main__":
+    run()
@@ -4,28 +4,26 @@ from __future__ import division, annotations
 from typing import List, Optional, Tuple
 
 import argparse
-import tqdm
 import numpy as np
 
 from terminaltables import AsciiTable
 
-import torch
-from torch.utils.data import DataLoader
-from torch.autograd import Variable
-
-from yoeo.models import load_model
-from yoeo.utils.utils import ap_per_class, get_batch_statistics, non_max_suppression, to_cpu, xywh2xyxy, \
-    print_environment_info, seg_iou
-from yoeo.utils.datasets import ListDataset
-from yoeo.utils.transforms import DEFAULT_TRANSFORMS
 from yoeo.utils.dataclasses import ClassNames
 from yoeo.utils.class_config import ClassConfig
 from yoeo.utils.parse_config import parse_data_config
 from yoeo.utils.metric import Metric
+from yoeo.utils.runtime_profile import apply_runtime_profile, DEFAULT_RUNTIME_PROFILE, OBJECTIVES
+from yoeo.utils.latency import LatencyRecorder
+from yoeo.utils.process_profiler import DEFAULT_WINDOW, ProcessProfiler, parse_profile_window
+
+# PyTorch and the data pipeline are imported in the functions that need them,
+# so the command line interface (e.g. `yoeo-test --help`) starts without loading them
 
 
 def evaluate_model_file(model_path, weights_path, img_path, class_config, batch_size=8, img_size=416,
-                        n_cpu=8, iou_thres=0.5, conf_thres=0.5, nms_thres=0.5, verbose=True):
+                        n_cpu=8, iou_thres=0.5, conf_thres=0.5, nms_thres=0.5, verbose=True, use_model_cache=False,
+                        latency_recorder: Optional[LatencyRecorder] = None, profiler: Optional[ProcessProfiler] = None,
+                        uint8: bool = False, rect: bool = False):
     """Evaluate model on validation dataset.
 
     :param model_path: Path to model definition file (.cfg)
@@ -50,11 +48,26 @@ def evaluate_model_file(model_path, weights_path, img_path, class_config, batch_
     :type nms_thres: float, optional
     :param verbose: If True, prints stats of model, defaults to True
     :type verbose: bool, optional
+    :param use_model_cache: If True, the compiled model is loaded from the model cache, defaults to False
+    :type use_model_cache: bool, optional
+    :param latency_recorder: Records the duration of each stage per batch if given, defaults to None
+    :type latency_recorder: Optional[LatencyRecorder]
+    :param profiler: Profiles a window of batches if given, defaults to None
+    :type profiler: Optional[ProcessProfiler]
+    :param uint8: Transfers the batches as uint8 and converts them on the device, defaults to False
+    :type uint8: bool, optional
+    :param rect: Letterboxes batches of images with similar aspect ratio to a rectangular shape, defaults to False
+    :type rect: bool, optional
     :return: Returns precision, recall, AP, f1, ap_class
     """
     dataloader = _create_validation_data_loader(
-        img_path, batch_size, img_size, n_cpu,is_segment=True)
-    model = load_model(model_path, weights_path)
+        img_path, batch_size, img_size, n_cpu,is_segment=True, uint8=uint8, rect=rect)
+    if use_model_cache:
+        from yoeo.utils.model_cache import load_cached_model
+        model = load_cached_model(model_path, weights_path, img_size)
+    else:
+        from yoeo.models import load_model
+        model = load_model(model_path, weights_path)
     metrics_output, seg_class_ious, secondary_metric = _evaluate(
         model,
         dataloader,
@@ -63,7 +76,9 @@ def evaluate_model_file(model_path, weights_path, img_path, class_config, batch_
         iou_thres,
         conf_thres,
         nms_thres,
-        verbose)
+        verbose,
+        latency_recorder,
+        profiler)
     return metrics_output, seg_class_ious, secondary_metric
 
 
@@ -117,7 +132,8 @@ def print_eval_stats(metrics_output: Optional[Tuple[np.ndarray]],
     print(f"----Average IoU {mean_seg_class_ious:.5f} ----")
 
 
-def _evaluate(model, dataloader, class_config, img_size, iou_thres, conf_thres, nms_thres, verbose):
+def _evaluate(model, dataloader, class_config, img_size, iou_thres, conf_thres, nms_thres, verbose,
+              latency_recorder: Optional[LatencyRecorder] = None, profiler: Optional[ProcessProfiler] = None):
     """Evaluate model on validation dataset.
 
     :param model: Model to evaluate
@@ -136,11 +152,22 @@ def _evaluate(model, dataloader, class_config, img_size, iou_thres, conf_thres,
     :type nms_thres: float
     :param verbose: If True, prints stats of model
     :type verbose: bool
+    :param latency_recorder: Records the duration of each stage per batch if given, defaults to None
+    :type latency_recorder: Optional[LatencyRecorder]
+    :param profiler: Profiles a window of batches if given, defaults to None
+    :type profiler: Optional[ProcessProfiler]
     :return: Returns precision, recall, AP, f1, ap_class
     """
+    import tqdm
+    import torch
+    from torch.autograd import Variable
+    from yoeo.utils.utils import ap_per_class, get_batch_statistics, non_max_suppression, to_cpu, xywh2xyxy, seg_iou
+    from yoeo.utils.transforms import normalize_batch
+
     model.eval()  # Set model to evaluation mode
 
     Tensor = torch.cuda.FloatTensor if torch.cuda.is_available() else torch.FloatTensor
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
     labels = []
     sample_metrics = []  # List of tuples (TP, confs, pred)
@@ -153,7 +180,10 @@ def _evaluate(model, dataloader, class_config, img_size, iou_thres, conf_thres,
     else:
         secondary_metric = None
 
-    for _, imgs, bb_targets, mask_targets in tqdm.tqdm(dataloader, desc="Validating"):
+    recorder = latency_recorder or LatencyRecorder(enabled=False)
+    profiler = profiler or ProcessProfiler(enabled=False)
+    for _, imgs, bb_targets, mask_targets in tqdm.tqdm(
+            profiler.iterate(recorder.iterate(dataloader)), total=len(dataloader), desc="Validating"):
         # Extract labels
         labels += bb_targets[:, 1].tolist()
 
@@ -162,36 +192,43 @@ def _evaluate(model, dataloader, class_config, img_size, iou_thres, conf_thres,
         if class_config.classes_should_be_grouped():
             labels = class_config.group(labels)
 
-        # Rescale target
+        # Rescale target, the batches of an `AspectRatioBatchSampler` are not square
         bb_targets[:, 2:] = xywh2xyxy(bb_targets[:, 2:])
-        bb_targets[:, 2:] *= img_size
+        bb_targets[:, [2, 4]] *= imgs.shape[3]
+        bb_targets[:, [3, 5]] *= imgs.shape[2]
 
-        imgs = Variable(imgs.type(Tensor), requires_grad=False)
+        with recorder.stage("h2d"):
+            # uint8 batches are converted to float after the transfer
+            imgs, _ = normalize_batch(imgs.to(device, non_blocking=True))
+            imgs = Variable(imgs.type(Tensor), requires_grad=False)
 
         with torch.no_grad():
             t1 = time.time()
-            yolo_outputs, segmentation_outputs = model(imgs)
+            with recorder.stage("forward"):
+                yolo_outputs, segmentation_outputs = model(imgs)
             times.append(time.time() - t1)
-            yolo_outputs = non_max_suppression(
-                yolo_outputs,
-                conf_thres=conf_thres,
-                iou_thres=nms_thres,
+            with recorder.stage("nms"):
+                yolo_outputs = non_max_suppression(
+                    yolo_outputs,
+                    conf_thres=conf_thres,
+                    iou_thres=nms_thres,
+                    group_config=class_config.get_group_config()
+                )
+
+        with recorder.stage("metrics"):
+            sample_stat, secondary_stat = get_batch_statistics(
+                yolo_outputs, 
+                bb_targets, 
+                iou_threshold=iou_thres, 
                 group_config=class_config.get_group_config()
             )
 
-        sample_stat, secondary_stat = get_batch_statistics(
-            yolo_outputs, 
-            bb_targets, 
-            iou_threshold=iou_thres, 
-            group_config=class_config.get_group_config()
-        )
+            sample_metrics += sample_stat
 
-        sample_metrics += sample_stat
+            if class_config.classes_should_be_grouped():
+                secondary_metric += secondary_stat
 
-        if class_config.classes_should_be_grouped():
-            secondary_metric += secondary_stat
-
-        seg_ious.append(seg_iou(to_cpu(segmentation_outputs), mask_targets, model.num_seg_classes))
+            seg_ious.append(seg_iou(to_cpu(segmentation_outputs), mask_targets, model.num_seg_classes))
 
     if len(sample_metrics) == 0:  # No detections over whole validation set.
         print("---- No detections over whole validation set ----")
@@ -223,7 +260,8 @@ def _evaluate(model, dataloader, class_config, img_size, iou_thres, conf_thres,
     return yolo_metrics_output, seg_class_ious, secondary_metric
 
 
-def _create_validation_data_loader(img_path, batch_size, img_size, n_cpu, is_segment=False, is_detect=False):
+def _create_validation_data_loader(img_path, batch_size, img_size, n_cpu, is_segment=False, is_detect=False, cache_images=False,
+                                   uint8=False, rect=False):
     """
     Creates a DataLoader for validation.
 
@@ -235,12 +273,31 @@ def _create_validation_data_loader(img_path, batch_size, img_size, n_cpu, is_seg
     :type img_size: int
     :param n_cpu: Number of cpu threads to use during batch generation
     :type n_cpu: int
+    :param cache_images: Reads the decoded images from a memory-mapped cache, defaults to False
+    :type cache_images: bool
+    :param uint8: Returns uint8 images and masks, which `normalize_batch` converts on the device, defaults to False
+    :type uint8: bool
+    :param rect: Groups images of similar aspect ratio into batches with a rectangular shape, defaults to False
+    :type rect: bool
     :return: Returns DataLoader
     :rtype: DataLoader
     """
+    from torch.utils.data import DataLoader, SequentialSampler
+    from yoeo.utils.datasets import ListDataset, AspectRatioBatchSampler
+    from yoeo.utils.transforms import DEFAULT_TRANSFORMS, uint8_transforms
+
     dataset = ListDataset(img_path, img_size=img_size, 
-                          multiscale=False, transform=DEFAULT_TRANSFORMS,
-                          is_detect=is_detect,is_segment=is_segment)
+                          multiscale=False, transform=uint8_transforms(DEFAULT_TRANSFORMS) if uint8 else DEFAULT_TRANSFORMS,
+                          is_detect=is_detect,is_segment=is_segment, cache_images=cache_images, rect=rect)
+    if rect:
+        batch_sampler = AspectRatioBatchSampler(
+            SequentialSampler(dataset), dataset.image_sizes(), batch_size, img_size=img_size)
+        return DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            num_workers=n_cpu,
+            pin_memory=True,
+            collate_fn=dataset.collate_fn)
     dataloader = DataLoader(
         dataset,
         batch_size=batch_size,
@@ -252,23 +309,45 @@ def _create_validation_data_loader(img_path, batch_size, img_size, n_cpu, is_seg
 
 
 def run():
-    print_environment_info()
     parser = argparse.ArgumentParser(description="Evaluate validation data.")
     parser.add_argument("-m", "--model", type=str, default="config/yoeo.cfg",
                         help="Path to model definition file (.cfg)")
     parser.add_argument("-w", "--weights", type=str, default="weights/yoeo.pth",
                         help="Path to weights or checkpoint file (.weights or .pth)")
     parser.add_argument("-d", "--data", type=str, default="config/torso.data", help="Path to data config file (.data)")
-    parser.add_argument("-b", "--batch_size", type=int, default=8, help="Size of each image batch")
+    parser.add_argument("-b", "--batch_size", type=int, default=None, help="Size of each image batch (defaults to the runtime profile or 8)")
     parser.add_argument("-v", "--verbose", action='store_true', help="Makes the validation more verbose")
     parser.add_argument("--img_size", type=int, default=416, help="Size of each image dimension for yolo")
-    parser.add_argument("--n_cpu", type=int, default=8, help="Number of cpu threads to use during batch generation")
+    parser.add_argument("--n_cpu", type=int, default=None,
+                        help="Number of cpu threads to use during batch generation (defaults to the runtime profile or 8)")
+    parser.add_argument("--runtime_profile", type=str, default=DEFAULT_RUNTIME_PROFILE, help="Runtime profile created by yoeo-autotune")
+    parser.add_argument("--objective", type=str, choices=OBJECTIVES, default="throughput", help="Objective of the runtime profile settings")
     parser.add_argument("--iou_thres", type=float, default=0.5, help="IOU threshold required to qualify as detected")
     parser.add_argument("--conf_thres", type=float, default=0.01, help="Object confidence threshold")
     parser.add_argument("--nms_thres", type=float, default=0.4, help="IOU threshold for non-maximum suppression")
     parser.add_argument("--class_config", type=str, default="class_config/default.yaml", help="Class configuration for evaluation")
+    parser.add_argument("--model_cache", action="store_true",
+                        help="Loads the compiled model from the model cache ($YOEO_CACHE_DIR or ~/.cache/yoeo) and compiles it on the first run")
+    parser.add_argument("--uint8_batches", action="store_true",
+                        help="Keeps the images uint8 in the data loader and converts them on the device")
+    parser.add_argument("--rect_batches", action="store_true",
+                        help="Letterboxes batches of images with similar aspect ratio to a rectangular shape "
+                             "instead of padding each image to a square")
+    parser.add_argument("--latency", action="store_true", help="Prints the percentiles of the duration of each processing stage")
+    parser.add_argument("--latency_output", type=str, default=None,
+                        help="Writes the stage durations of each batch as json lines to this file (implies --latency)")
+    parser.add_argument("--profile", type=str, nargs="?", const=DEFAULT_WINDOW, default=None, metavar="START:END",
+                        help=f"Profiles the batches START to END-1 (default {DEFAULT_WINDOW}) with the PyTorch profiler and cProfile")
+    parser.add_argument("--profile_dir", type=str, default="profile", help="Directory of the profiling results")
 
     args = parser.parse_args()
+    if args.rect_batches and args.model_cache:
+        parser.error("--rect_batches can not be combined with --model_cache, whose model is traced for square images")
+
+    from yoeo.utils.utils import print_environment_info
+    print_environment_info()
+
+    apply_runtime_profile(args, args.objective, default_batch_size=8, default_n_cpu=8)
     print(f"Command line arguments: {args}")
 
     # Load configuration from data file
@@ -279,6 +358,15 @@ def run():
     class_names = ClassNames.load_from(data_config["names"])  # Detection and segmentation class names
     class_config = ClassConfig.load_from(args.class_config, class_names)
 
+    latency_recorder = None
+    if args.latency or args.latency_output:
+        import torch
+        latency_recorder = LatencyRecorder(synchronize=torch.cuda.is_available())
+
+    profiler = None
+    if args.profile:
+        profiler = ProcessProfiler(args.profile_dir, *parse_profile_window(args.profile))
+
     evaluate_model_file(
         args.model,
         args.weights,
@@ -291,8 +379,22 @@ def run():
         conf_thres=args.conf_thres,
         nms_thres=args.nms_thres,
         verbose=args.verbose,
+        use_model_cache=args.model_cache,
+        latency_recorder=latency_recorder,
+        profiler=profiler,
+        uint8=args.uint8_batches,
+        rect=args.rect_batches,
     )
 
+    if profiler is not None:
+        profiler.close()
+
+    if latency_recorder is not None:
+        print(latency_recorder.table())
+        if args.latency_output:
+            latency_recorder.save_frames(args.latency_output)
+            print(f"---- Stage durations were saved to: '{args.latency_output}' ----")
+
 
 if __name__ == "__main__":
     run()
@@ -4,33 +4,22 @@ from __future__ import division, annotations
 
 import os
 import argparse
-import tqdm
 
 import numpy as np
 
-import torch
-from torch.utils.data import DataLoader
-import torch.optim as optim
-from torch.autograd import Variable
-
-from yoeo.models import load_model
-from yoeo.utils.logger import Logger
-from yoeo.utils.utils import to_cpu, print_environment_info, provide_determinism, worker_seed_set
-from yoeo.utils.datasets import ListDataset
 from yoeo.utils.dataclasses import ClassNames
 from yoeo.utils.class_config import ClassConfig
-from yoeo.utils.augmentations import AUGMENTATION_TRANSFORMS
-from yoeo.utils.transforms import DEFAULT_TRANSFORMS
 from yoeo.utils.parse_config import parse_data_config
-from yoeo.utils.loss import compute_loss,unet_loss,yolo_loss
-from yoeo.test import _evaluate, _create_validation_data_loader
+from yoeo.utils.process_profiler import DEFAULT_WINDOW, ProcessProfiler, parse_profile_window
 
 from terminaltables import AsciiTable
 
-from torchsummary import summary
+# PyTorch, TensorBoard and the data pipeline are imported once the command line arguments are parsed,
+# so the command line interface (e.g. `yoeo-train --help`) starts without loading them
 
 
-def _create_data_loader(img_path, batch_size, img_size, n_cpu, multiscale_training=False,is_detect=False,is_segment=False):
+def _create_data_loader(img_path, batch_size, img_size, n_cpu, multiscale_training=False,is_detect=False,is_segment=False, transform=None,
+                        cache_images=False, uint8=False, rect=False, repeats=1):
     """Creates a DataLoader for training.
 
     :param img_path: Path to file containing all paths to training images.
@@ -43,18 +32,47 @@ def _create_data_loader(img_path, batch_size, img_size, n_cpu, multiscale_traini
     :type n_cpu: int
     :param multiscale_training: Scale images to different sizes randomly
     :type multiscale_training: bool
+    :param transform: Transforms of each sample, defaults to None (AUGMENTATION_TRANSFORMS)
+    :type transform: Optional[Callable]
+    :param cache_images: Reads the decoded images from a memory-mapped cache, defaults to False
+    :type cache_images: bool
+    :param uint8: Returns uint8 images and masks, which `normalize_batch` converts on the device, defaults to False
+    :type uint8: bool
+    :param rect: Groups images of similar aspect ratio into batches with a rectangular shape, defaults to False
+    :type rect: bool
+    :param repeats: Number of independently augmented copies of each decoded image, defaults to 1
+    :type repeats: int
     :return: Returns DataLoader
     :rtype: DataLoader
     """
+    from torch.utils.data import DataLoader, RandomSampler
+    from yoeo.utils.datasets import ListDataset, MultiscaleBatchSampler, AspectRatioBatchSampler
+    from yoeo.utils.augmentations import AUGMENTATION_TRANSFORMS
+    from yoeo.utils.transforms import uint8_transforms
+    from yoeo.utils.utils import worker_seed_set
+
+    transform = transform or AUGMENTATION_TRANSFORMS
+    if uint8:
+        transform = uint8_transforms(transform)
+
     dataset = ListDataset(
         img_path,
         img_size=img_size,
         multiscale=multiscale_training,
-        transform=AUGMENTATION_TRANSFORMS,is_detect=is_detect,is_segment=is_segment)
+        transform=transform,is_detect=is_detect,is_segment=is_segment,
+        cache_images=cache_images,
+        rect=rect)
+    # The batch sampler selects the (multiscale) image size of each batch, which the workers resize the samples to
+    sizes = dict(img_size=img_size, multiscale=multiscale_training, min_size=dataset.min_size, max_size=dataset.max_size,
+                 repeats=repeats)
+    if rect:
+        batch_sampler = AspectRatioBatchSampler(
+            RandomSampler(dataset), dataset.image_sizes(), batch_size, shuffle=True, **sizes)
+    else:
+        batch_sampler = MultiscaleBatchSampler(RandomSampler(dataset), batch_size, **sizes)
     dataloader = DataLoader(
         dataset,
-        batch_size=batch_size,
-        shuffle=True,
+        batch_sampler=batch_sampler,
         num_workers=n_cpu,
         pin_memory=True,
         collate_fn=dataset.collate_fn,
@@ -63,7 +81,6 @@ def _create_data_loader(img_path, batch_size, img_size, n_cpu, multiscale_traini
 
 
 def run():
-    print_environment_info()
     parser = argparse.ArgumentParser(description="Trains the YOEO model.")
     parser.add_argument("-m", "--model", type=str, default="config/yoeo.cfg", help="Path to model definition file (.cfg)")
     parser.add_argument("-d", "--data", type=str, default="config/torso.data", help="Path to data config file (.data)")
@@ -76,19 +93,66 @@ def run():
     parser.add_argument("--checkpoint_dir", type=str, default="checkpoints", help="Directory in which the checkpoints are stored")
     parser.add_argument("--evaluation_interval", type=int, default=1, help="Interval of epochs between evaluations on validation set")
     parser.add_argument("--multiscale_training", action="store_true", help="Allow multi-scale training")
+    parser.add_argument("--augmentation", type=str, default="sample", choices=["sample", "batch"],
+                        help="Augments each sample with imgaug in the data loader workers or whole batches with PyTorch on the training device")
+    parser.add_argument("--uint8_batches", action="store_true",
+                        help="Keeps the images and masks uint8 in the data loader and converts them on the training device")
+    parser.add_argument("--cache_images", action="store_true",
+                        help="Decodes the images and masks once into a memory-mapped cache ($YOEO_CACHE_DIR/images or ~/.cache/yoeo/images)")
+    parser.add_argument("--rect_batches", action="store_true",
+                        help="Letterboxes batches of images with similar aspect ratio to a rectangular shape "
+                             "instead of padding each image to a square")
+    parser.add_argument("--repeat_augmentations", type=int, default=1,
+                        help="Decodes each training image once and augments it this many times in the same batch, "
+                             "an epoch then sees 1 / N of the images")
     parser.add_argument("--iou_thres", type=float, default=0.5, help="Evaluation: IOU threshold required to qualify as detected")
     parser.add_argument("--conf_thres", type=float, default=0.1, help="Evaluation: Object confidence threshold")
     parser.add_argument("--nms_thres", type=float, default=0.5, help="Evaluation: IOU threshold for non-maximum suppression")
     parser.add_argument("--logdir", type=str, default="logs", help="Directory for training log files (e.g. for TensorBoard)")
+    parser.add_argument("--log_backends", type=str, nargs="+", default=["tensorboard"], choices=["tensorboard", "jsonl", "csv"],
+                        help="Backends of the training logs in --logdir")
+    parser.add_argument("--log_aggregate_steps", type=int, default=10,
+                        help="Logs the mean, min and max learning rate of this many batches instead of each value")
     parser.add_argument("--seed", type=int, default=-1, help="Makes results reproducable. Set -1 to disable.")
     parser.add_argument("--class_config", type=str, default="class_config/default.yaml", help="Class configuration for evaluation")
+    parser.add_argument("--telemetry_interval", type=int, default=50, help="Interval of batches between logging the training throughput")
+    parser.add_argument("--stall_threshold", type=float, default=0.3,
+                        help="Warns if more than this fraction of the training time is spent waiting for the data loader")
+    parser.add_argument("--sync_telemetry", action="store_true",
+                        help="Synchronizes CUDA after each training stage for exact compute and optimizer times (slower)")
+    parser.add_argument("--count_syncs", action="store_true",
+                        help="Counts the CUDA synchronizations of each training step with the sync debug mode of PyTorch (slower)")
+    parser.add_argument("--profile", type=str, nargs="?", const=DEFAULT_WINDOW, default=None, metavar="START:END",
+                        help=f"Profiles the batches START to END-1 (default {DEFAULT_WINDOW}) with the PyTorch profiler and cProfile")
+    parser.add_argument("--profile_dir", type=str, default="profile", help="Directory of the profiling results")
     args = parser.parse_args()
+
+    import tqdm
+    import torch
+    import torch.optim as optim
+    from torch.autograd import Variable
+
+    from yoeo.models import load_model
+    from yoeo.utils.logger import Logger
+    from yoeo.utils.utils import print_environment_info, provide_determinism
+    from yoeo.utils.loss import unet_loss, yolo_loss
+    from yoeo.test import _evaluate, _create_validation_data_loader
+    from yoeo.utils.train_telemetry import TrainTelemetry
+    from yoeo.utils.transforms import DEFAULT_TRANSFORMS, normalize_batch
+    from yoeo.utils.batch_augmentations import BATCH_AUGMENTATIONS, BatchAugmentation
+
+    print_environment_info()
     print(f"Command line arguments: {args}")
 
     if args.seed != -1:
         provide_determinism(args.seed)
 
-    logger = Logger(args.logdir)  # Tensorboard logger
+    # Buffered logger, which writes in a background thread
+    logger = Logger(
+        args.logdir,
+        backends=args.log_backends,
+        aggregate_tags=("train/learning_rate",),
+        aggregate_steps=args.log_aggregate_steps)
 
     # Create output directories if missing
     os.makedirs("output", exist_ok=True)
@@ -117,6 +181,7 @@ def run():
 
     # Print model
     if args.verbose:
+        from torchsummary import summary
         summary(model, input_size=(3, model.hyperparams['height'], model.hyperparams['height']))
 
     mini_batch_size = model.hyperparams['batch'] // model.hyperparams['subdivisions']
@@ -125,20 +190,35 @@ def run():
     # Create Dataloader
     # #################
 
+    # With batch augmentation, the workers only pad the samples and the batches are augmented on the device
+    batch_augmentation = None
+    train_transform = None
+    if args.augmentation == "batch":
+        batch_augmentation = BatchAugmentation(**BATCH_AUGMENTATIONS["default"], seed=args.seed if args.seed != -1 else None)
+        train_transform = DEFAULT_TRANSFORMS
+
     # Load training dataloader
     yolodataloader = _create_data_loader(
         yolotrain_path,
         mini_batch_size,
         model.hyperparams['height'],
         args.n_cpu,
-        args.multiscale_training,is_detect=True)
+        args.multiscale_training,is_detect=True,
+        transform=train_transform,
+        cache_images=args.cache_images,
+        uint8=args.uint8_batches,
+        rect=args.rect_batches,
+        repeats=args.repeat_augmentations)
 
     # Load validation dataloader
     yolovalidation_dataloader = _create_validation_data_loader(
         yolovalid_path,
         mini_batch_size,
         model.hyperparams['height'],
-        args.n_cpu,is_detect=True)
+        args.n_cpu,is_detect=True,
+        cache_images=args.cache_images,
+        uint8=args.uint8_batches,
+        rect=args.rect_batches)
 
     # Load training dataloader
     unetdataloader = _create_data_loader(
@@ -146,14 +226,22 @@ def run():
         mini_batch_size,
         model.hyperparams['height'],
         args.n_cpu,
-        args.multiscale_training,is_segment=True)
+        args.multiscale_training,is_segment=True,
+        transform=train_transform,
+        cache_images=args.cache_images,
+        uint8=args.uint8_batches,
+        rect=args.rect_batches,
+        repeats=args.repeat_augmentations)
 
     # Load validation dataloader
     unetvalidation_dataloader = _create_validation_data_loader(
         unetvalid_path,
         mini_batch_size,
         model.hyperparams['height'],
-        args.n_cpu,is_segment=True)
+        args.n_cpu,is_segment=True,
+        cache_images=args.cache_images,
+        uint8=args.uint8_batches,
+        rect=args.rect_batches)
     """
     # ###########
     # Check image
@@ -206,27 +294,45 @@ def run():
     # instead of: 0, 10, 20
     batches_done=0
 
+    # Throughput of the training loop, the losses are accumulated on the device
+    telemetry = TrainTelemetry(
+        device,
+        logger,
+        log_interval=args.telemetry_interval,
+        stall_threshold=args.stall_threshold,
+        synchronize=args.sync_telemetry,
+        count_syncs=args.count_syncs)
+
+    # Profiles a window of batches over both data loaders, if requested
+    profiler = ProcessProfiler(args.profile_dir, *parse_profile_window(args.profile or DEFAULT_WINDOW), enabled=bool(args.profile))
+
     #print(model)
 
     for epoch in range(1, args.epochs+1):
 
         print("\n---- Training Model ----")
-        seg_loss = iou_loss = obj_loss = cls_loss = total_loss = 0
         model.train()  # Set model to training mode
 
-        for batch_i, (_, imgs, bb_targets, mask_targets) in enumerate(tqdm.tqdm(unetdataloader, desc=f"Training Epoch {epoch} / SEGM")):
+        for batch_i, (_, imgs, bb_targets, mask_targets) in enumerate(tqdm.tqdm(
+                profiler.iterate(telemetry.iterate(unetdataloader)), total=len(unetdataloader), desc=f"Training Epoch {epoch} / SEGM")):
             batches_done += 1
 
-            imgs = Variable(imgs.to(device, non_blocking=True))
-            mask_targets = Variable(mask_targets.to(device=device), requires_grad=False)
+            if batch_augmentation is not None:
+                with telemetry.stage("augmentation"):
+                    imgs, _, mask_targets = batch_augmentation(
+                        imgs.to(device, non_blocking=True), mask_targets=mask_targets.to(device=device))
+
+            with telemetry.stage("compute"):
+                imgs, mask_targets = normalize_batch(imgs.to(device, non_blocking=True), mask_targets.to(device=device))
+                imgs = Variable(imgs)
+                mask_targets = Variable(mask_targets, requires_grad=False)
 
-            outputs = model(imgs)
+                outputs = model(imgs)
 
-            loss = unet_loss(outputs, mask_targets, model)
-            seg_loss += to_cpu(loss).item()
-            total_loss += to_cpu(loss).item()
+                loss = unet_loss(outputs, mask_targets, model)
+                loss.backward()
 
-            loss.backward()
+            telemetry.add_losses(seg_loss=loss, loss=loss)
 
             ###############
             # Run optimizer
@@ -250,27 +356,35 @@ def run():
                 for g in optimizer.param_groups:
                     g['lr'] = lr
 
-                # Run optimizer
-                optimizer.step()
-                # Reset gradients
-                optimizer.zero_grad()
+                with telemetry.stage("optimizer"):
+                    # Run optimizer
+                    optimizer.step()
+                    # Reset gradients
+                    optimizer.zero_grad()
 
             model.seen += imgs.size(0)
 
-        for batch_i, (_, imgs, bb_targets, mask_targets) in enumerate(tqdm.tqdm(yolodataloader, desc=f"Training Epoch {epoch} / YOLO")):
+        for batch_i, (_, imgs, bb_targets, mask_targets) in enumerate(tqdm.tqdm(
+                profiler.iterate(telemetry.iterate(yolodataloader)), total=len(yolodataloader), desc=f"Training Epoch {epoch} / YOLO")):
             batches_done += 1
 
-            imgs = Variable(imgs.to(device, non_blocking=True))
-            bb_targets = Variable(bb_targets.to(device=device), requires_grad=False)
+            if batch_augmentation is not None:
+                with telemetry.stage("augmentation"):
+                    imgs, bb_targets, _ = batch_augmentation(
+                        imgs.to(device, non_blocking=True), bb_targets=bb_targets.to(device=device))
+
+            with telemetry.stage("compute"):
+                imgs, _ = normalize_batch(imgs.to(device, non_blocking=True))
+                imgs = Variable(imgs)
+                bb_targets = Variable(bb_targets.to(device=device), requires_grad=False)
+
+                outputs = model(imgs)
 
-            outputs = model(imgs)
+                loss,loss_detail = yolo_loss(outputs, bb_targets, model)
+                loss.backward()
 
-            loss,loss_detail = yolo_loss(outputs, bb_targets, model)
-            iou_loss += float(loss_detail[0])
-            obj_loss += float(loss_detail[1])
-            cls_loss += float(loss_detail[2])
-            total_loss += to_cpu(loss).item()
-            loss.backward()
+            # IoU, object, class and total loss
+            telemetry.add_losses(yolo_loss=loss_detail, loss=loss)
 
             ###############
             # Run optimizer
@@ -294,18 +408,23 @@ def run():
                 for g in optimizer.param_groups:
                     g['lr'] = lr
 
-                # Run optimizer
-                optimizer.step()
-                # Reset gradients
-                optimizer.zero_grad()
+                with telemetry.stage("optimizer"):
+                    # Run optimizer
+                    optimizer.step()
+                    # Reset gradients
+                    optimizer.zero_grad()
 
             model.seen += imgs.size(0)
 
-        seg_loss /= unetdataloader.size()
-        iou_loss /= yolodataloader.size()
-        cls_loss /= yolodataloader.size()
-        obj_loss /= yolodataloader.size()
-        
+        # Logs the remaining batches, so the throughput does not include the checkpoint and evaluation
+        telemetry.log()
+
+        # Copies the mean losses of the epoch to the host
+        epoch_losses = telemetry.epoch_losses()
+        seg_loss = epoch_losses.get("seg_loss", 0.0)
+        iou_loss, obj_loss, cls_loss = epoch_losses.get("yolo_loss", [0.0] * 4)[:3]
+        total_loss = epoch_losses.get("loss", 0.0)
+
         # ############
         # Log progress
         # ############
@@ -317,20 +436,19 @@ def run():
                     ["Object loss", obj_loss],
                     ["Class loss", cls_loss],
                     ["Segmentation loss", seg_loss],
-                    ["Epoch loss", to_cpu(loss).item()],
+                    ["Epoch loss", total_loss],
                 ]).table)
         else:
             print(f'Epoch loss: {total_loss}')
-        """
+
         # Tensorboard logging
         tensorboard_log = [
-            ("train/iou_loss", float(loss_components[0])),
-            ("train/obj_loss", float(loss_components[1])),
-            ("train/class_loss", float(loss_components[2])),
-            ("train/seg_loss", float(loss_components[3])),
-            ("train/loss", to_cpu(loss).item())]
+            ("train/iou_loss", iou_loss),
+            ("train/obj_loss", obj_loss),
+            ("train/class_loss", cls_loss),
+            ("train/seg_loss", seg_loss),
+            ("train/loss", total_loss)]
         logger.list_of_scalars_summary(tensorboard_log, batches_done)
-        """
 
         # #############
         # Save progress
@@ -376,6 +494,8 @@ def run():
                 logger.list_of_scalars_summary(evaluation_metrics, epoch)
         """
 
+    profiler.close()
+    logger.close()
     print(f"****  Training finished   ****\n---- Saving network")
     torch.save(model.state_dict,"weights/pfd_network_sd.pth")
     torch.save(model,"weights/pfd_network.pth")
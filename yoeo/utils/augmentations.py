@@ -1,6 +1,6 @@
 import imgaug.augmenters as iaa
 from torchvision import transforms
-from yoeo.utils.transforms import ToTensor, PadSquare, RelativeLabels, AbsoluteLabels, ImgAug
+from yoeo.utils.transforms import ToTensor, PadSquare, AbsoluteLabels, ImgAug
 
 
 class DefaultAug(ImgAug):
@@ -29,23 +29,20 @@ class StrongAug(ImgAug):
 AUGMENTATION_TRANSFORMS = transforms.Compose([
     AbsoluteLabels(),
     DefaultAug(),
-    PadSquare(),
-    RelativeLabels(),
+    PadSquare(relative_labels=True),
     ToTensor(),
 ])
 
 YOLO_TRANSFORMS = transforms.Compose([
     AbsoluteLabels(),
     DefaultAug(),
-    PadSquare(),
-    RelativeLabels(),
+    PadSquare(relative_labels=True),
     ToTensor(),
 ])
 
 UNET_TRANSFORMS = transforms.Compose([
     AbsoluteLabels(),
     DefaultAug(),
-    PadSquare(),
-    RelativeLabels(),
+    PadSquare(relative_labels=True),
     ToTensor(),
 ])
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import math
+from typing import Optional, Tuple, TYPE_CHECKING
+
+# PyTorch is only imported when an augmentation is created
+if TYPE_CHECKING:
+    import torch
+
+# Parameters of the batch versions of `DefaultAug` and `StrongAug` (yoeo.utils.augmentations)
+BATCH_AUGMENTATIONS = {
+    "default": dict(sharpen=(0.0, 0.1), rotate=(0.0, 0.0), translate=(-0.1, 0.1), scale=(0.8, 1.5),
+                    brightness=(-60, 40), hue=(-10, 10), flip=0.5, dropout=(0.0, 0.0)),
+    "strong": dict(sharpen=(0.0, 0.1), rotate=(-10.0, 10.0), translate=(-0.1, 0.1), scale=(0.8, 1.5),
+                   brightness=(-60, 40), hue=(-20, 20), flip=0.5, dropout=(0.0, 0.01)),
+}
+
+# RGB to YIQ, the hue is rotated in the IQ plane
+_RGB_TO_YIQ = (
+    (0.299, 0.587, 0.114),
+    (0.595716, -0.274453, -0.321263),
+    (0.211456, -0.522591, 0.311135),
+)
+
+
+class BatchAugmentation(object):
+    """Augments whole batches after the collation with vectorized PyTorch operations, on the device of the batch.
+
+    It applies the transforms of the imgaug augmentations `DefaultAug` and `StrongAug` to each image of a batch
+    with its own random parameters: pixel dropout, sharpening, an affine transform (rotation, translation and scale),
+    horizontal flip, brightness and hue. The affine transform and the flip are combined into one resampling,
+    which also moves the boxes and masks. Unlike the imgaug augmentations, it transforms the padded square images,
+    so translations are relative to the padded size and the padding can be moved into the image.
+
+    The brightness and hue ranges use the units of imgaug (`AddToBrightness` and `AddToHue`, i.e. -255 to 255).
+    The hue is rotated in the YIQ color space, which approximates the HSV hue of imgaug.
+
+    Usage::
+
+        augmentation = BatchAugmentation(**BATCH_AUGMENTATIONS["default"], seed=0)
+        imgs, bb_targets, mask_targets = augmentation(imgs, bb_targets, mask_targets)
+
+    :param sharpen: Range of the blending factor of the sharpened image, defaults to (0.0, 0.1)
+    :type sharpen: Tuple[float, float], optional
+    :param rotate: Range of the rotation in degrees, defaults to (0.0, 0.0)
+    :type rotate: Tuple[float, float], optional
+    :param translate: Range of the translation as a fraction of the image size, defaults to (-0.1, 0.1)
+    :type translate: Tuple[float, float], optional
+    :param scale: Range of the scale, defaults to (0.8, 1.5)
+    :type scale: Tuple[float, float], optional
+    :param brightness: Range of the value added to the brightness, defaults to (-60, 40)
+    :type brightness: Tuple[float, float], optional
+    :param hue: Range of the value added to the hue, defaults to (-10, 10)
+    :type hue: Tuple[float, float], optional
+    :param flip: Probability of a horizontal flip, defaults to 0.5
+    :type flip: float, optional
+    :param dropout: Range of the probability to set a pixel to zero, defaults to (0.0, 0.0)
+    :type dropout: Tuple[float, float], optional
+    :param seed: Seed of the random parameters, defaults to None (the global PyTorch random generator is used)
+    :type seed: Optional[int], optional
+    """
+
+    def __init__(
+            self,
+            sharpen: Tuple[float, float] = (0.0, 0.1),
+            rotate: Tuple[float, float] = (0.0, 0.0),
+            translate: Tuple[float, float] = (-0.1, 0.1),
+            scale: Tuple[float, float] = (0.8, 1.5),
+            brightness: Tuple[float, float] = (-60, 40),
+            hue: Tuple[float, float] = (-10, 10),
+            flip: float = 0.5,
+            dropout: Tuple[float, float] = (0.0, 0.0),
+            seed: Optional[int] = None):
+        import torch
+
+        self.sharpen = sharpen
+        self.rotate = rotate
+        self.translate = translate
+        self.scale = scale
+        self.brightness = brightness
+        self.hue = hue
+        self.flip = flip
+        self.dropout = dropout
+        self.generator = None
+        if seed is not None:
+            self.generator = torch.Generator()
+            self.generator.manual_seed(seed)
+
+    def _uniform(self, value_range: Tuple[float, float], size: int) -> torch.Tensor:
+        import torch
+
+        low, high = value_range
+        return low + (high - low) * torch.rand(size, generator=self.generator)
+
+    def __call__(
+            self,
+            imgs: torch.Tensor,
+            bb_targets: Optional[torch.Tensor] = None,
+            mask_targets: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor, Optional[torch.Tensor], Optional[torch.Tensor]]:
+        """Augments a batch.
+
+        :param imgs: Images (B, 3, H, W), either float in [0, 1] or uint8
+        :type imgs: torch.Tensor
+        :param bb_targets: Boxes (N, 6) with 'sample index, class, x, y, w, h' relative to the image size, defaults to None
+        :type bb_targets: Optional[torch.Tensor], optional
+        :param mask_targets: Class id of each pixel (B, H, W), defaults to None
+        :type mask_targets: Optional[torch.Tensor], optional
+        :return: Augmented float images in [0, 1], the boxes without the ones that left the image and the masks
+        :rtype: Tuple[torch.Tensor, Optional[torch.Tensor], Optional[torch.Tensor]]
+        """
+        import torch
+
+        batch_size, device = imgs.size(0), imgs.device
+        imgs = imgs.float() / 255 if imgs.dtype == torch.uint8 else imgs.float()
+
+        # The parameters are drawn on the CPU, so they only depend on the seed and not on the device
+        dropout = self._uniform(self.dropout, batch_size).to(device)
+        sharpen = self._uniform(self.sharpen, batch_size).to(device)
+        lightness = self._uniform((0.75, 2.0), batch_size).to(device)  # Default lightness of imgaug's Sharpen
+        angle = self._uniform(self.rotate, batch_size) * math.pi / 180
+        translation = self._uniform(self.translate, (batch_size, 2))
+        scale = self._uniform(self.scale, batch_size)
+        flip = torch.rand(batch_size, generator=self.generator) < self.flip
+        brightness = self._uniform(self.brightness, batch_size).to(device)
+        hue = self._uniform(self.hue, batch_size) * 2 * math.pi / 255
+
+        if self.dropout[1] > 0:
+            keep = torch.rand((batch_size, 1) + imgs.shape[2:], device=device) >= dropout.view(-1, 1, 1, 1)
+            imgs = imgs * keep
+        if self.sharpen[1] > 0:
+            imgs = self._sharpen(imgs, sharpen, lightness)
+
+        matrix = self._affine_matrix(angle, translation, scale, flip, imgs.shape[2:])
+        imgs, mask_targets = self._warp(imgs, mask_targets, matrix.to(device))
+        if bb_targets is not None and len(bb_targets):
+            bb_targets = self._transform_boxes(bb_targets, matrix.to(bb_targets.device))
+
+        imgs = imgs + (brightness / 255).view(-1, 1, 1, 1)
+        imgs = self._rotate_hue(imgs, hue.to(device))
+        return imgs.clamp_(0, 1), bb_targets, mask_targets
+
+    @staticmethod
+    def _sharpen(imgs: torch.Tensor, alpha: torch.Tensor, lightness: torch.Tensor) -> torch.Tensor:
+        import torch.nn.functional as F
+
+        # The kernel of imgaug's Sharpen is (1 - alpha) * identity + alpha * [[-1, -1, -1], [-1, 8 + L, -1], [-1, -1, -1]],
+        # whose sharpened part is (9 + L) * pixel - (sum of the 3x3 neighborhood)
+        neighborhood = F.avg_pool2d(F.pad(imgs, (1, 1, 1, 1), mode="reflect"), 3, stride=1) * 9
+        sharpened = (9 + lightness).view(-1, 1, 1, 1) * imgs - neighborhood
+        alpha = alpha.view(-1, 1, 1, 1)
+        return (1 - alpha) * imgs + alpha * sharpened
+
+    @staticmethod
+    def _affine_matrix(angle, translation, scale, flip, size) -> torch.Tensor:
+        import torch
+
+        # Forward transform (B, 2, 3) of the normalized coordinates [-1, 1] with the center of the image as origin.
+        # The rotation is applied in pixel units, so it keeps the angles of non-square images.
+        height, width = size
+        aspect = height / width
+        cos, sin = torch.cos(angle) * scale, torch.sin(angle) * scale
+        mirror = torch.where(flip, -1.0, 1.0)
+        matrix = torch.zeros(len(angle), 2, 3)
+        matrix[:, 0, 0] = cos * mirror
+        matrix[:, 0, 1] = -sin * aspect
+        matrix[:, 1, 0] = sin / aspect * mirror
+        matrix[:, 1, 1] = cos
+        matrix[:, :, 2] = translation * 2
+        return matrix
+
+    @staticmethod
+    def _warp(imgs: torch.Tensor, mask_targets: Optional[torch.Tensor], matrix: torch.Tensor):
+        import torch
+        import torch.nn.functional as F
+
+        # grid_sample maps the output to the input coordinates, so it needs the inverse transform
+        linear, offset = matrix[:, :, :2], matrix[:, :, 2:]
+        inverse = torch.linalg.inv(linear)
+        theta = torch.cat((inverse, -inverse @ offset), dim=2)
+        grid = F.affine_grid(theta, list(imgs.shape), align_corners=False)
+        imgs = F.grid_sample(imgs, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+        if mask_targets is not None:
+            masks = F.grid_sample(mask_targets.unsqueeze(1).float(), grid, mode="nearest", padding_mode="zeros", align_corners=False)
+            mask_targets = masks.squeeze(1).to(mask_targets.dtype)
+        return imgs, mask_targets
+
+    @staticmethod
+    def _transform_boxes(bb_targets: torch.Tensor, matrix: torch.Tensor) -> torch.Tensor:
+        import torch
+
+        # Transforms the 4 corners of each box and takes their enclosing box, like imgaug
+        x, y, w, h = bb_targets[:, 2:].unbind(1)
+        corners_x = torch.stack((x - w / 2, x + w / 2, x + w / 2, x - w / 2), dim=1) * 2 - 1
+        corners_y = torch.stack((y - h / 2, y - h / 2, y + h / 2, y + h / 2), dim=1) * 2 - 1
+        box_matrix = matrix[bb_targets[:, 0].long()]
+        new_x = box_matrix[:, 0, 0:1] * corners_x + box_matrix[:, 0, 1:2] * corners_y + box_matrix[:, 0, 2:3]
+        new_y = box_matrix[:, 1, 0:1] * corners_x + box_matrix[:, 1, 1:2] * corners_y + box_matrix[:, 1, 2:3]
+        x1, x2 = (new_x.min(dim=1).values + 1) / 2, (new_x.max(dim=1).values + 1) / 2
+        y1, y2 = (new_y.min(dim=1).values + 1) / 2, (new_y.max(dim=1).values + 1) / 2
+
+        # Removes the boxes outside of the image and clips the others
+        inside = (x1.clamp(min=0) <= x2.clamp(max=1)) & (y1.clamp(min=0) <= y2.clamp(max=1))
+        x1, x2, y1, y2 = x1.clamp(0, 1), x2.clamp(0, 1), y1.clamp(0, 1), y2.clamp(0, 1)
+        boxes = torch.stack((bb_targets[:, 0], bb_targets[:, 1], (x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1), dim=1)
+        return boxes[inside]
+
+    @staticmethod
+    def _rotate_hue(imgs: torch.Tensor, angle: torch.Tensor) -> torch.Tensor:
+        import torch
+
+        rgb_to_yiq = torch.tensor(_RGB_TO_YIQ, dtype=imgs.dtype, device=imgs.device)
+        rotation = torch.zeros(len(angle), 3, 3, dtype=imgs.dtype, device=imgs.device)
+        rotation[:, 0, 0] = 1
+        rotation[:, 1, 1] = torch.cos(angle)
+        rotation[:, 1, 2] = -torch.sin(angle)
+        rotation[:, 2, 1] = torch.sin(angle)
+        rotation[:, 2, 2] = torch.cos(angle)
+        # One 3x3 color matrix per image
+        matrix = torch.linalg.inv(rgb_to_yiq) @ rotation @ rgb_to_yiq
+        return torch.einsum("bij,bjhw->bihw", matrix, imgs)
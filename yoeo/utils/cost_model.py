@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from yoeo.utils.parse_config import parse_model_config
+
+# Activations and weights are stored as float32, the segmentation output of the inference as uint8
+FLOAT_BYTES = 4
+SEG_OUTPUT_BYTES = 1
+
+
+@dataclass
+class LayerCost:
+    index: int
+    type: str
+    output_shape: Tuple[int, ...]
+    params: int
+    macs: int
+    activation_bytes: int
+    live_bytes: int = 0  # Bytes of all activations that are still needed after this layer
+
+
+@dataclass
+class ModelCost:
+    model: str
+    img_size: int
+    layers: List[LayerCost] = field(default_factory=list)
+
+    @property
+    def params(self) -> int:
+        return sum(layer.params for layer in self.layers)
+
+    @property
+    def macs(self) -> int:
+        return sum(layer.macs for layer in self.layers)
+
+    @property
+    def activation_bytes(self) -> int:
+        """Memory of all layer outputs, which `Darknet.forward` keeps until the end of the forward pass."""
+        return sum(layer.activation_bytes for layer in self.layers)
+
+    @property
+    def peak_live_bytes(self) -> int:
+        """Peak memory of the activations if every output is freed after its last use."""
+        return max((layer.live_bytes for layer in self.layers), default=0)
+
+    @property
+    def param_bytes(self) -> int:
+        return self.params * FLOAT_BYTES
+
+    def to_dict(self, layers: bool = True) -> Dict:
+        result = {
+            "model": self.model,
+            "img_size": self.img_size,
+            "params": self.params,
+            "macs": self.macs,
+            "param_bytes": self.param_bytes,
+            "activation_bytes": self.activation_bytes,
+            "peak_live_bytes": self.peak_live_bytes,
+            "peak_bytes": self.param_bytes + self.activation_bytes,
+        }
+        if layers:
+            result["layers"] = [asdict(layer) for layer in self.layers]
+        return result
+
+
+def _conv_output_size(size: int, kernel_size: int, stride: int, padding: int) -> int:
+    return (size + 2 * padding - kernel_size) // stride + 1
+
+
+def _route_inputs(module_def: Dict, index: int) -> List[int]:
+    # Negative indices are relative to the current layer like the list indexing in `Darknet.forward`
+    return [int(x) if int(x) >= 0 else index + int(x) for x in module_def["layers"].split(",")]
+
+
+def estimate_model_cost(model_path: str, img_size: Optional[int] = None) -> ModelCost:
+    """Infers the output shape, parameters, multiply-accumulate operations (MACs) and activation memory
+    of each layer of a model definition for one image, without building the model.
+
+    :param model_path: Path to model definition file (.cfg)
+    :type model_path: str
+    :param img_size: Size of each image dimension, defaults to None (width of the [net] block)
+    :type img_size: Optional[int]
+    :return: Per layer costs of the model
+    :rtype: ModelCost
+    """
+    module_defs = parse_model_config(model_path)
+    hyperparams = module_defs.pop(0)
+    img_size = img_size or int(hyperparams["width"])
+
+    cost = ModelCost(model=model_path, img_size=img_size)
+    shapes: List[Tuple[int, ...]] = []  # (channels, height, width) of each layer output
+    last_use: Dict[int, int] = {}  # Index of the last layer that reads the output of a layer
+    shape = (int(hyperparams["channels"]), img_size, img_size)
+
+    for i, module_def in enumerate(module_defs):
+        layer_type = module_def["type"]
+        params = macs = 0
+        if len(shape) == 3:  # The outputs of yolo and seg layers are only read by routes
+            channels, height, width = shape
+
+        if layer_type == "convolutional":
+            filters = int(module_def["filters"])
+            kernel_size = int(module_def["size"])
+            stride = int(module_def["stride"])
+            padding = (kernel_size - 1) // 2
+            height = _conv_output_size(height, kernel_size, stride, padding)
+            width = _conv_output_size(width, kernel_size, stride, padding)
+            params = channels * kernel_size * kernel_size * filters
+            # Batch normalization has a weight and a bias per filter, otherwise the convolution has a bias
+            params += 2 * filters if int(module_def["batch_normalize"]) else filters
+            macs = channels * kernel_size * kernel_size * filters * height * width
+            shape = (filters, height, width)
+
+        elif layer_type == "maxpool":
+            kernel_size = int(module_def["size"])
+            stride = int(module_def["stride"])
+            padding = (kernel_size - 1) // 2
+            if kernel_size == 2 and stride == 1:
+                # Matches the zero padding of `create_modules`, which keeps the size
+                height, width = height + 1, width + 1
+            shape = (channels,
+                     _conv_output_size(height, kernel_size, stride, padding),
+                     _conv_output_size(width, kernel_size, stride, padding))
+
+        elif layer_type == "upsample":
+            stride = int(module_def["stride"])
+            shape = (channels, height * stride, width * stride)
+
+        elif layer_type == "route":
+            inputs = _route_inputs(module_def, i)
+            for layer_i in inputs:
+                last_use[layer_i] = i
+            channels = sum(shapes[layer_i][0] for layer_i in inputs) // int(module_def.get("groups", 1))
+            shape = (channels,) + shapes[inputs[0]][1:]
+
+        elif layer_type == "shortcut":
+            layer_i = int(module_def["from"])
+            last_use[i + layer_i if layer_i < 0 else layer_i] = i
+
+        elif layer_type == "yolo":
+            num_anchors = len(module_def["mask"].split(","))
+            shape = (num_anchors * height * width, int(module_def["classes"]) + 5)
+
+        elif layer_type == "seg":
+            shape = (height, width)
+
+        if i > 0 and layer_type != "route":
+            last_use[i - 1] = max(last_use.get(i - 1, i), i)
+        shapes.append(shape)
+
+        elements = 1
+        for dim in shape:
+            elements *= dim
+        activation_bytes = elements * (SEG_OUTPUT_BYTES if layer_type == "seg" else FLOAT_BYTES)
+        cost.layers.append(LayerCost(i, layer_type, shape, params, macs, activation_bytes))
+
+    # The outputs of the yolo and seg layers are concatenated at the end, so they stay alive
+    for layer in cost.layers:
+        if layer.type in ("yolo", "seg"):
+            last_use[layer.index] = len(cost.layers)
+
+    for layer in cost.layers:
+        layer.live_bytes = sum(
+            other.activation_bytes for other in cost.layers[:layer.index + 1]
+            if last_use.get(other.index, other.index) >= layer.index)
+    return cost
@@ -1,15 +1,19 @@
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 import torch.nn.functional as F
 import torch
 import glob
-import random
+import itertools
 import os
 import warnings
 import numpy as np
-from io import StringIO
 from PIL import Image
 from PIL import ImageFile
 
+from yoeo.utils.label_index import LabelIndex, get_label_files
+from yoeo.utils.letterbox import letterbox, letterbox_shape, letterbox_shapes, read_image_sizes
+from yoeo.utils.segmentation_masks import get_mask_files, read_mask
+from yoeo.utils.transforms import rectangular_transforms
+
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 
@@ -27,17 +31,29 @@ def pad_to_square(img, pad_value):
 
 
 def resize(image, size):
+    if tuple(image.shape[-2:]) == (size, size):
+        return image
     image = F.interpolate(image.unsqueeze(0), size=size, mode="nearest").squeeze(0)
     return image
 
 
 
 class ImageFolder(Dataset):
-    def __init__(self, folder_path, transform=None):
+    def __init__(self, folder_path, transform=None, rect=False):
         self.files = sorted(glob.glob("%s/*.*" % folder_path))
-        self.transform = transform
+        # With `rect`, the images are letterboxed to the shape of their batch, see `AspectRatioBatchSampler`
+        self.rect = rect
+        self.transform = rectangular_transforms(transform) if rect and transform else transform
+
+    def image_sizes(self):
+        """Returns the height and width (N, 2) of each image, read from the image headers."""
+        return read_image_sizes(self.files)
 
     def __getitem__(self, index):
+        # An `AspectRatioBatchSampler` passes the letterbox shape of the batch with the index
+        shape = None
+        if isinstance(index, tuple):
+            index, shape = index
 
         img_path = self.files[index % len(self.files)]
         img = np.array(
@@ -46,11 +62,13 @@ class ImageFolder(Dataset):
 
         # Label Placeholder
         boxes = np.zeros((1, 5))
-        segmaps = np.zeros_like(img)
+        segmaps = np.zeros(img.shape[:2], dtype=np.uint8)
 
         # Apply transforms
         if self.transform:
-            img, _, _ = self.transform((img, boxes, segmaps))
+            img, bb_targets, _ = self.transform((img, boxes, segmaps))
+            if self.rect and shape is not None:
+                img, _, _ = letterbox(img, bb_targets, None, shape)
 
         return img_path, img
 
@@ -58,30 +76,45 @@ class ImageFolder(Dataset):
         return len(self.files)
 
 
+class PathArray(object):
+    """
+    Immutable sequence of paths, stored as one byte buffer with the offset of each path.
+
+    A list of strings consists of one Python object per path, whose reference counts are updated on each access.
+    This writes to the memory pages of the objects, so each data loader worker gradually copies the pages it
+    inherited from the main process. The two arrays of this sequence are never written, so they stay shared.
+    """
+
+    def __init__(self, paths):
+        encoded = [os.fsencode(path) for path in paths]
+        self._offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(path) for path in encoded], out=self._offsets[1:])
+        self._data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Path index {index} out of range")
+        return os.fsdecode(self._data[self._offsets[index]:self._offsets[index + 1]].tobytes())
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+
 class ListDataset(Dataset):
-    def __init__(self, list_path, is_segment=True, is_detect=True, img_size=416, multiscale=True, transform=None):
+    def __init__(self, list_path, is_segment=True, is_detect=True, img_size=416, multiscale=True, transform=None,
+                 cache_images=False, label_index=True, rect=False):
         with open(list_path, "r") as file:
-            self.img_files = file.readlines()
-
-        self.label_files = []
-        for path in self.img_files:
-            image_dir = os.path.dirname(path)
-            label_dir = "labels".join(image_dir.rsplit("images", 1))
-            assert label_dir != image_dir, \
-                f"Image path must contain a folder named 'images'! \n'{image_dir}'"
-            label_file = os.path.join(label_dir, os.path.basename(path))
-            label_file = os.path.splitext(label_file)[0] + '.txt'
-            self.label_files.append(label_file)
-
-        self.mask_files = []
-        for path in self.img_files:
-            image_dir = os.path.dirname(path)
-            mask_dir = "yoeo_segmentations".join(image_dir.rsplit("images", 1))
-            assert mask_dir != image_dir, \
-                f"Image path must contain a folder named 'images'! \n'{image_dir}'"
-            mask_file = os.path.join(mask_dir, os.path.basename(path))
-            mask_file = os.path.splitext(mask_file)[0] + '.png'
-            self.mask_files.append(mask_file)
+            img_files = [path.rstrip() for path in file.readlines()]
+
+        # The paths are stored in arrays instead of lists, so the memory of the workers is not copied on access
+        self.img_files = PathArray(img_files)
+        self.label_files = PathArray(get_label_files(img_files))
+        self.mask_files = PathArray(get_mask_files(img_files))
 
         self.img_size = img_size
         self.max_objects = 100
@@ -89,71 +122,143 @@ class ListDataset(Dataset):
         self.min_size = self.img_size - 3 * 32
         self.max_size = self.img_size + 3 * 32
         self.batch_count = 0
-        self.transform = transform
+        # With `rect`, the samples are letterboxed to the (rectangular) shape of their batch instead of padded to a square
+        self.rect = rect
+        self.transform = rectangular_transforms(transform) if rect and transform else transform
         self.is_segment=is_segment
         self.is_detect=is_detect
 
-    def __getitem__(self, index):
+        # Decoded images and masks in a memory-mapped file, which is created on first use
+        self.image_cache = None
+        if cache_images:
+            from yoeo.utils.image_cache import ImageCache
+            self.image_cache = ImageCache.open(self.img_files, self.mask_files if is_segment else None)
+
+        # Boxes of all samples in one array, which is compiled once and saved next to the list file
+        self.label_index = None
+        if label_index and is_detect:
+            self.label_index = LabelIndex.open(list_path, self.label_files)
+
+        # Index and data of the last decoded sample of this process, see `load_sample`
+        self._last_sample = None
+
+    def image_sizes(self):
+        """Returns the height and width (N, 2) of each image, from the image cache or read from the image headers.
+
+        :return: Height and width of each image, (0, 0) for images that could not be read
+        :rtype: np.ndarray
+        """
+        if self.image_cache is not None:
+            return self.image_cache.index[:, 1:3].clip(min=0)
+        return read_image_sizes(self.img_files)
+
+    def load_image(self, index):
+        """Decodes the image of a sample.
+
+        :param index: Index of the sample
+        :type index: int
+        :return: Path of the image and the RGB image as uint8 array (H, W, 3)
+        :rtype: Tuple[str, np.ndarray]
+        """
+        img_path = self.img_files[index % len(self.img_files)].rstrip()
+        if self.image_cache is not None:
+            return img_path, self.image_cache.image(index % len(self.img_files))
+        return img_path, np.array(Image.open(img_path).convert('RGB'), dtype=np.uint8)
+
+    def load_boxes(self, index):
+        """Parses the bounding box labels of a sample.
+
+        :param index: Index of the sample
+        :type index: int
+        :return: Labels (N, 5) with 'class x_center y_center width height'
+        :rtype: np.ndarray
+        """
+        if not self.is_detect:
+            return np.zeros((2, 5))
+
+        if self.label_index is not None:
+            return self.label_index[index % len(self.img_files)]
+        label_path = self.label_files[index % len(self.img_files)].rstrip()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return np.loadtxt(label_path).reshape(-1, 5)
+
+    def load_mask(self, index, img):
+        """Decodes the segmentation mask of a sample.
+
+        :param index: Index of the sample
+        :type index: int
+        :param img: Image of the sample, which determines the shape of the empty mask without segmentation
+        :type img: np.ndarray
+        :return: Mask with the class id of each pixel (H, W)
+        :rtype: np.ndarray
+        """
+        if not self.is_segment:
+            return np.zeros(img.shape[:2], dtype=np.uint8)
+
+        if self.image_cache is not None:
+            return self.image_cache.mask(index % len(self.img_files))
+        mask_path = self.mask_files[index % len(self.img_files)].rstrip()
+        return read_mask(mask_path)
+
+    def load_sample(self, index):
+        """Decodes the image, labels and mask of a sample.
+
+        The last decoded sample is kept, so the consecutive copies of an index, which a batch sampler
+        with `repeats` yields, are only decoded once and then augmented independently.
+
+        :param index: Index of the sample
+        :type index: int
+        :return: Path of the image, image, labels and mask or None if a file could not be read
+        :rtype: Optional[Tuple[str, np.ndarray, np.ndarray, np.ndarray]]
+        """
+        index = index % len(self.img_files)
+        if self._last_sample is not None and self._last_sample[0] == index:
+            return self._last_sample[1]
 
         # ---------
         #  Image
         # ---------
         try:
-            img_path = self.img_files[index % len(self.img_files)].rstrip()
-
-            img = np.array(Image.open(img_path).convert('RGB'), dtype=np.uint8)
+            img_path, img = self.load_image(index)
         except Exception:
-            print(f"Could not read image '{img_path}'.")
+            print(f"Could not read image '{self.img_files[index % len(self.img_files)].rstrip()}'.")
             return
 
         # ---------
         #  Label
         # ---------
-        if self.is_detect:
-            #try:
-            label_path = self.label_files[index % len(self.img_files)].rstrip()
-            # ------------------
-            #  Modified version
-            # ------------------
-            #boxlist = []
-            #with open(label_path,"r") as f:
-            #    for line in f:
-            #        sl = line.split(" ")
-            #        cl = float(sl[0])
-            #        cx = (float(sl[1])+float(sl[3]))/2
-            #        cy = (float(sl[2])+float(sl[6]))/2
-            #        w = float(sl[3])-float(sl[1])
-            #        h = float(sl[6])-float(sl[2])
-            #        boxlist.append([cl,cx,cy,w,h])
-            #boxes=np.array(boxlist).reshape(-1, 5)
-
-            # Original
-            try:
-                with warnings.catch_warnings():
-                    warnings.simplefilter("ignore")
-                    boxes = np.loadtxt(label_path).reshape(-1, 5)
-            except Exception:
-                print(f"Could not read label '{label_path}'.")
-                return
-        else:
-            boxes = np.loadtxt(StringIO("0 0 0 0 0\n0 0 0 0 0"))
+        try:
+            boxes = self.load_boxes(index)
+        except Exception:
+            print(f"Could not read label '{self.label_files[index % len(self.img_files)].rstrip()}'.")
+            return
 
         # ---------
         #  Segmentation Mask
         # ---------
-        if self.is_segment:
-            try:
-                mask_path = self.mask_files[index % len(self.img_files)].rstrip()
-                # Load segmentation mask as numpy array
-                mask = np.array(Image.open(mask_path).convert('RGB'))
-                #max = np.max(mask)
-                #print(f"Loading {mask_path} Max: {max}")
-            except FileNotFoundError as e:
-                print(f"Could not load mask '{mask_path}'.")
-                return
-        else:
-            mask = np.zeros(img.shape,dtype=np.uint8)
+        try:
+            mask = self.load_mask(index, img)
+        except FileNotFoundError:
+            print(f"Could not load mask '{self.mask_files[index % len(self.img_files)].rstrip()}'.")
+            return
 
+        self._last_sample = (index, (img_path, img, boxes, mask))
+        return img_path, img, boxes, mask
+
+    def __getitem__(self, index):
+        # A `MultiscaleBatchSampler` passes the image size of the batch with the index,
+        # an `AspectRatioBatchSampler` the letterbox shape
+        img_size = self.img_size
+        if isinstance(index, tuple):
+            index, img_size = index
+
+        sample = self.load_sample(index)
+        if sample is None:
+            return
+        # The transforms modify the labels in place, so a reused sample gets a copy
+        img_path, img, boxes, mask = sample
+        boxes = boxes.copy()
 
         # -----------
         #  Transform
@@ -168,6 +273,16 @@ class ListDataset(Dataset):
                 raise e
                 return
 
+        # ---------
+        #  Resize
+        # ---------
+        if self.rect:
+            shape = img_size if isinstance(img_size, tuple) else (img_size, img_size)
+            img, bb_targets, mask_targets = letterbox(img, bb_targets, mask_targets, shape)
+        else:
+            img = resize(img, img_size)
+            mask_targets = resize(mask_targets, img_size)
+
         return img_path, img, bb_targets, mask_targets
 
     def collate_fn(self, batch):
@@ -178,23 +293,155 @@ class ListDataset(Dataset):
 
         paths, imgs, bb_targets, mask_targets = list(zip(*batch))
 
-        # Selects new image size every tenth batch
-        if self.multiscale and self.batch_count % 10 == 0:
-            self.img_size = random.choice(
-                range(self.min_size, self.max_size + 1, 32))
-
-        # Resize images to input shape
-        imgs = torch.stack([resize(img, self.img_size) for img in imgs])
+        # The workers already resized the images to the size of the batch
+        imgs = torch.stack(imgs)
 
         # Add sample index to targets
         for i, boxes in enumerate(bb_targets):
             boxes[:, 0] = i
         bb_targets = torch.cat(bb_targets, 0)
 
-        # Stack masks and drop the 2 duplicated channels
-        mask_targets = torch.stack([resize(mask, self.img_size)[0] for mask in mask_targets]).long()
+        # Stack the single-channel masks, uint8 batches keep uint8 masks until `normalize_batch`
+        mask_targets = torch.stack([mask[0] for mask in mask_targets])
+        if imgs.dtype != torch.uint8:
+            mask_targets = mask_targets.long()
 
         return paths, imgs, bb_targets, mask_targets
 
     def __len__(self):
         return len(self.img_files)
+
+
+class MultiscaleBatchSampler(Sampler):
+    """
+    Groups the indices of a sampler into batches and selects the image size of each batch.
+
+    Each index is yielded as '(index, image size)', so the data loader workers resize the samples to the size
+    of their batch. With `multiscale`, a new size between `min_size` and `max_size` (a multiple of 32 apart) is drawn
+    every `interval` batches. The sizes are drawn in the main process from a seeded generator, so they are
+    deterministic and the same in all workers.
+
+    :param sampler: Sampler of the dataset indices
+    :type sampler: Sampler
+    :param batch_size: Size of each batch
+    :type batch_size: int
+    :param img_size: Image size without multiscale and the size of the first batches, defaults to 416
+    :type img_size: int, optional
+    :param multiscale: Changes the image size every `interval` batches, defaults to False
+    :type multiscale: bool, optional
+    :param min_size: Smallest image size, defaults to None (img_size - 3 * 32)
+    :type min_size: Optional[int], optional
+    :param max_size: Largest image size, defaults to None (img_size + 3 * 32)
+    :type max_size: Optional[int], optional
+    :param interval: Number of batches with the same size, defaults to 10
+    :type interval: int, optional
+    :param drop_last: Drops the last batch if it is incomplete, defaults to False
+    :type drop_last: bool, optional
+    :param seed: Seed of the image sizes, defaults to None (drawn from the global PyTorch random generator)
+    :type seed: Optional[int], optional
+    :param repeats: Number of consecutive copies of each index, which the dataset decodes once and augments independently.
+        Only the first 1 / repeats of the indices of the sampler are used, so an epoch keeps its number of batches
+        but sees fewer distinct images. Defaults to 1
+    :type repeats: int, optional
+    """
+
+    def __init__(self, sampler, batch_size, img_size=416, multiscale=False, min_size=None, max_size=None,
+                 interval=10, drop_last=False, seed=None, repeats=1):
+        if repeats < 1:
+            raise ValueError(f"repeats must be at least 1, got {repeats}")
+        self.sampler = sampler
+        self.repeats = repeats
+        self.batch_size = batch_size
+        self.img_size = img_size
+        self.multiscale = multiscale
+        self.min_size = img_size - 3 * 32 if min_size is None else min_size
+        self.max_size = img_size + 3 * 32 if max_size is None else max_size
+        self.interval = interval
+        self.drop_last = drop_last
+        self.batch_count = 0
+        if seed is None:
+            seed = int(torch.empty((), dtype=torch.int64).random_().item())
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed)
+
+    def _next_size(self):
+        # Selects new image size every `interval` batches, the count continues over the epochs
+        self.batch_count += 1
+        if self.multiscale and self.batch_count % self.interval == 0:
+            sizes = range(self.min_size, self.max_size + 1, 32)
+            self.img_size = sizes[int(torch.randint(len(sizes), (1,), generator=self.generator))]
+        return self.img_size
+
+    def _num_indices(self):
+        # Number of distinct indices of an epoch
+        return (len(self.sampler) + self.repeats - 1) // self.repeats
+
+    def _indices(self):
+        # The copies of an index are consecutive, so they are usually in the same batch and worker
+        for index in itertools.islice(self.sampler, self._num_indices()):
+            for _ in range(self.repeats):
+                yield index
+
+    def __iter__(self):
+        batch = []
+        for index in self._indices():
+            batch.append(index)
+            if len(batch) == self.batch_size:
+                img_size = self._next_size()
+                yield [(index, img_size) for index in batch]
+                batch = []
+        if batch and not self.drop_last:
+            img_size = self._next_size()
+            yield [(index, img_size) for index in batch]
+
+    def __len__(self):
+        num_samples = self._num_indices() * self.repeats
+        if self.drop_last:
+            return num_samples // self.batch_size
+        return (num_samples + self.batch_size - 1) // self.batch_size
+
+
+class AspectRatioBatchSampler(MultiscaleBatchSampler):
+    """
+    Groups images of similar aspect ratio into batches and selects the rectangular letterbox shape of each batch.
+
+    The indices of the sampler are sorted by the aspect ratio of the letterbox shape of their image at `img_size`,
+    so images, whose shapes are the same, stay in the order of the sampler and are mixed in each epoch.
+    Each index is yielded as '(index, (height, width))', where the shape is the smallest one with sides that are
+    multiples of 32, which contains all images of the batch letterboxed to a longer side of the (multiscale) image size.
+    Datasets created with `rect=True` letterbox the samples to this shape instead of padding them to a square.
+
+    :param sampler: Sampler of the dataset indices
+    :type sampler: Sampler
+    :param img_sizes: Height and width (N, 2) of each image of the dataset, see `ListDataset.image_sizes`
+    :type img_sizes: np.ndarray
+    :param batch_size: Size of each batch
+    :type batch_size: int
+    :param shuffle: Shuffles the order of the batches, defaults to False (batches in the order of the aspect ratio)
+    :type shuffle: bool, optional
+
+    The other parameters are the ones of `MultiscaleBatchSampler`.
+    """
+
+    def __init__(self, sampler, img_sizes, batch_size, shuffle=False, **kwargs):
+        super().__init__(sampler, batch_size, **kwargs)
+        self.img_sizes = np.asarray(img_sizes).reshape(-1, 2)
+        self.shuffle = shuffle
+
+        # Aspect ratio of the letterbox shape of each image, so images with the same shape are equal in the sort
+        shapes = letterbox_shapes(self.img_sizes, self.img_size)
+        self.aspect_ratios = shapes[:, 0] / shapes[:, 1]
+
+    def __iter__(self):
+        indices = np.fromiter(itertools.islice(self.sampler, self._num_indices()), dtype=np.int64)
+        indices = np.repeat(indices[np.argsort(self.aspect_ratios[indices], kind="stable")], self.repeats)
+        batches = [indices[start:start + self.batch_size] for start in range(0, len(indices), self.batch_size)]
+        if batches and self.drop_last and len(batches[-1]) < self.batch_size:
+            batches.pop()
+        if self.shuffle:
+            order = torch.randperm(len(batches), generator=self.generator).tolist()
+            batches = [batches[i] for i in order]
+
+        for batch in batches:
+            shape = letterbox_shape(self.img_sizes[batch], self._next_size())
+            yield [(int(index), shape) for index in batch]
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from yoeo.utils.segmentation_masks import read_mask
+
+# Decoded images of a dataset, shared by all data loader workers and runs of this machine
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("YOEO_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "yoeo")),
+    "images")
+
+# Bump this if the layout of the cache entries changes
+CACHE_FORMAT_VERSION = 2
+
+# Entry layout:
+#   data.bin   decoded uint8 arrays of all images (H, W, 3) and masks (H, W), each starting at an ALIGNMENT aligned offset
+#   index.npy  int64 array (N, 8) with 'image offset, height, width, channels, mask offset, height, width, 1'
+#              of each sample, an offset of -1 marks an image or mask that could not be decoded
+#   meta.json  format version and number of samples, written last, so an entry with a meta.json is complete
+_DATA_FILE = "data.bin"
+_INDEX_FILE = "index.npy"
+_META_FILE = "meta.json"
+ALIGNMENT = 64
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _decode(path: Optional[str]) -> Optional[np.ndarray]:
+    from PIL import Image
+
+    if path is None:
+        return None
+    try:
+        # Same decoding as `ListDataset`
+        return np.array(Image.open(path).convert('RGB'), dtype=np.uint8)
+    except Exception:
+        return None
+
+
+def _decode_mask(path: Optional[str]) -> Optional[np.ndarray]:
+    if path is None:
+        return None
+    try:
+        return read_mask(path)
+    except Exception:
+        return None
+
+
+def get_cache_key(img_files: Sequence[str], mask_files: Optional[Sequence[str]] = None) -> str:
+    """Returns a key of the images and masks of a dataset, which changes if a file is replaced or modified.
+
+    :param img_files: Paths of the images
+    :type img_files: Sequence[str]
+    :param mask_files: Paths of the masks, defaults to None (no masks)
+    :type mask_files: Optional[Sequence[str]], optional
+    :return: Cache key
+    :rtype: str
+    """
+    sha = hashlib.sha256(f"{CACHE_FORMAT_VERSION}".encode())
+    for path in list(img_files) + list(mask_files or []):
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+            sha.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+        except OSError:
+            sha.update(f"{path}:missing\n".encode())
+    return sha.hexdigest()
+
+
+def _build_entry(img_files: Sequence[str], mask_files: Optional[Sequence[str]], entry_dir: str, n_threads: int) -> None:
+    num_samples = len(img_files)
+    index = np.full((num_samples, 8), -1, dtype=np.int64)
+
+    def decode_sample(i):
+        return _decode(img_files[i]), _decode_mask(mask_files[i]) if mask_files is not None else None
+
+    # Write the entry to a temporary directory first, so concurrent or aborted runs never leave a partial entry
+    os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir))
+    try:
+        import tqdm
+
+        n_threads = max(1, n_threads)
+        chunk_size = 4 * n_threads
+        with open(os.path.join(tmp_dir, _DATA_FILE), "wb") as f, ThreadPoolExecutor(n_threads) as pool, \
+                tqdm.tqdm(total=num_samples, desc="Caching decoded images") as progress:
+            # PIL releases the GIL while decoding, so the images are decoded in parallel threads.
+            # Only a chunk is decoded ahead of the writing to bound the memory.
+            for start in range(0, num_samples, chunk_size):
+                indices = range(start, min(start + chunk_size, num_samples))
+                for i, arrays in zip(indices, pool.map(decode_sample, indices)):
+                    for column, array in zip((0, 4), arrays):
+                        if array is None:
+                            continue
+                        f.write(b"\0" * (_align(f.tell()) - f.tell()))
+                        index[i, column] = f.tell()
+                        index[i, column + 1:column + 4] = array.shape + (1,) * (3 - array.ndim)
+                        f.write(np.ascontiguousarray(array).tobytes())
+                    progress.update()
+        np.save(os.path.join(tmp_dir, _INDEX_FILE), index)
+        with open(os.path.join(tmp_dir, _META_FILE), "w") as f:
+            json.dump({"version": CACHE_FORMAT_VERSION, "samples": num_samples, "masks": mask_files is not None}, f)
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another process created the entry in the meantime
+        if not os.path.isfile(os.path.join(entry_dir, _META_FILE)):
+            raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class ImageCache(object):
+    """
+    Decoded images and masks of a dataset in a memory-mapped file.
+    The arrays are views into a private (copy-on-write) mapping of the file,
+    so all data loader workers and concurrent runs share the decoded data through the page cache.
+    """
+
+    def __init__(self, entry_dir: str):
+        self.entry_dir = entry_dir
+        self.index = np.load(os.path.join(entry_dir, _INDEX_FILE))
+        self._data = None
+
+    @classmethod
+    def open(cls, img_files: Sequence[str], mask_files: Optional[Sequence[str]] = None,
+             cache_dir: str = DEFAULT_CACHE_DIR, n_threads: int = 8) -> ImageCache:
+        """Opens the cache entry of a dataset and decodes all images and masks once if it does not exist.
+
+        :param img_files: Paths of the images
+        :type img_files: Sequence[str]
+        :param mask_files: Paths of the masks, defaults to None (no masks)
+        :type mask_files: Optional[Sequence[str]], optional
+        :param cache_dir: Directory of the cache, defaults to DEFAULT_CACHE_DIR
+        :type cache_dir: str, optional
+        :param n_threads: Number of threads decoding the images when the entry is created, defaults to 8
+        :type n_threads: int, optional
+        :return: Cache of the dataset
+        :rtype: ImageCache
+        """
+        img_files = [path.rstrip() for path in img_files]
+        mask_files = [path.rstrip() for path in mask_files] if mask_files is not None else None
+        entry_dir = os.path.join(cache_dir, get_cache_key(img_files, mask_files))
+        if not os.path.isfile(os.path.join(entry_dir, _META_FILE)):
+            _build_entry(img_files, mask_files, entry_dir, n_threads)
+        return cls(entry_dir)
+
+    @property
+    def data(self) -> np.ndarray:
+        # Mapped on first access, so each worker process maps the file itself instead of receiving a copy
+        if self._data is None:
+            path = os.path.join(self.entry_dir, _DATA_FILE)
+            self._data = np.memmap(path, dtype=np.uint8, mode="c").view(np.ndarray) if os.path.getsize(path) else np.zeros(0, np.uint8)
+        return self._data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _array(self, offset: int, shape: List[int]) -> np.ndarray:
+        offset, shape = int(offset), [int(dim) for dim in shape]
+        return self.data[offset:offset + int(np.prod(shape))].reshape(shape)
+
+    def image(self, index: int) -> np.ndarray:
+        """Returns the decoded image (H, W, 3) of a sample or raises an OSError if it could not be decoded."""
+        offset, *shape = self.index[index, :4]
+        if offset < 0:
+            raise OSError(f"Image {index} could not be decoded when the cache was created")
+        return self._array(offset, shape)
+
+    def mask(self, index: int) -> np.ndarray:
+        """Returns the decoded mask (H, W) of a sample or raises a FileNotFoundError if it could not be decoded."""
+        offset, *shape = self.index[index, 4:]
+        if offset < 0:
+            raise FileNotFoundError(f"Mask {index} could not be decoded when the cache was created")
+        return self._array(offset, shape[:2])
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import os
+import hashlib
+import tempfile
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# Label indices of the list files, shared by all runs of this machine like the image cache
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("YOEO_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "yoeo")),
+    "labels")
+
+# Bump this if the layout of the index changes
+LABEL_INDEX_VERSION = 1
+
+
+def get_label_index_path(list_path: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """Returns the path of the label index of a list file in the cache, e.g. 'train-<hash>.npz' for 'train.txt'.
+
+    The hash of the absolute path of the list file tells apart list files with the same name.
+
+    :param list_path: Path of the list file of the dataset
+    :type list_path: str
+    :param cache_dir: Directory of the label indices, defaults to DEFAULT_CACHE_DIR
+    :type cache_dir: str, optional
+    :return: Path of the label index
+    :rtype: str
+    """
+    name = os.path.splitext(os.path.basename(list_path))[0]
+    digest = hashlib.sha256(os.path.abspath(list_path).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{name}-{digest}.npz")
+
+
+def get_label_files(img_files: Sequence[str]) -> List[str]:
+    """Returns the label file of each image, e.g. 'data/labels/1.txt' for 'data/images/1.jpg'.
+
+    :param img_files: Paths of the images
+    :type img_files: Sequence[str]
+    :return: Paths of the label files
+    :rtype: List[str]
+    """
+    label_files = []
+    for path in img_files:
+        image_dir = os.path.dirname(path)
+        label_dir = "labels".join(image_dir.rsplit("images", 1))
+        assert label_dir != image_dir, \
+            f"Image path must contain a folder named 'images'! \n'{image_dir}'"
+        label_file = os.path.join(label_dir, os.path.basename(path))
+        label_file = os.path.splitext(label_file)[0] + '.txt'
+        label_files.append(label_file)
+    return label_files
+
+
+def get_label_key(label_files: Sequence[str]) -> str:
+    """Returns a key of the label files, which changes if a file is added, removed or modified.
+
+    :param label_files: Paths of the label files
+    :type label_files: Sequence[str]
+    :return: Key of the label files
+    :rtype: str
+    """
+    sha = hashlib.sha256(f"{LABEL_INDEX_VERSION}".encode())
+    for path in label_files:
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+            sha.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+        except OSError:
+            sha.update(f"{path}:missing\n".encode())
+    return sha.hexdigest()
+
+
+def _parse_label_file(path: str) -> np.ndarray:
+    # Equivalent to `np.loadtxt(path).reshape(-1, 5)` for the whitespace separated YOLO labels, but much faster
+    with open(path, "r") as f:
+        values = np.array(f.read().split(), dtype=np.float64)
+    if values.size % 5 != 0:
+        raise ValueError(f"{values.size} values are not a multiple of 5")
+    boxes = values.reshape(-1, 5)
+    if not np.isfinite(boxes).all():
+        raise ValueError("Labels contain non-finite values")
+    if (boxes[:, 0] < 0).any() or (boxes[:, 0] != np.round(boxes[:, 0])).any():
+        raise ValueError("Class ids must be non-negative integers")
+    return boxes
+
+
+class LabelIndex(object):
+    """
+    Bounding box labels of all samples of a dataset in one array.
+
+    The boxes (class, x center, y center, width, height) of sample i are `boxes[offsets[i]:offsets[i + 1]]`.
+    Samples, whose label file is missing or invalid, are marked in `valid`.
+
+    :param boxes: Boxes of all samples (M, 5)
+    :type boxes: np.ndarray
+    :param offsets: Offset of the first box of each sample and the total number of boxes (N + 1)
+    :type offsets: np.ndarray
+    :param valid: True for each sample with a readable and valid label file (N)
+    :type valid: np.ndarray
+    :param key: Key of the label files, see `get_label_key`
+    :type key: str
+    """
+
+    def __init__(self, boxes: np.ndarray, offsets: np.ndarray, valid: np.ndarray, key: str):
+        self.boxes = boxes
+        self.offsets = offsets
+        self.valid = valid
+        self.key = key
+
+    @classmethod
+    def compile(cls, label_files: Sequence[str], verbose: bool = False) -> LabelIndex:
+        """Parses and validates all label files.
+
+        :param label_files: Paths of the label files
+        :type label_files: Sequence[str]
+        :param verbose: Prints each invalid label file, defaults to False
+        :type verbose: bool, optional
+        :return: Index of the labels
+        :rtype: LabelIndex
+        """
+        label_files = [path.rstrip() for path in label_files]
+        key = get_label_key(label_files)
+        all_boxes: List[np.ndarray] = []
+        counts = np.zeros(len(label_files), dtype=np.int64)
+        valid = np.zeros(len(label_files), dtype=bool)
+        for i, path in enumerate(label_files):
+            try:
+                boxes = _parse_label_file(path)
+            except (OSError, ValueError) as e:
+                if verbose:
+                    print(f"Invalid label file '{path}': {e}")
+                continue
+            all_boxes.append(boxes)
+            counts[i] = len(boxes)
+            valid[i] = True
+
+        offsets = np.zeros(len(label_files) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        boxes = np.concatenate(all_boxes).astype(np.float32) if all_boxes else np.zeros((0, 5), dtype=np.float32)
+        return cls(boxes, offsets, valid, key)
+
+    @classmethod
+    def load(cls, path: str) -> LabelIndex:
+        """Loads a label index written by `save`."""
+        with np.load(path) as data:
+            if int(data["version"]) != LABEL_INDEX_VERSION:
+                raise ValueError(f"Label index '{path}' has version {int(data['version'])}, expected {LABEL_INDEX_VERSION}")
+            return cls(data["boxes"], data["offsets"], data["valid"], str(data["key"]))
+
+    def save(self, path: str) -> None:
+        """Writes the index to a temporary file first and renames it, so readers never see a partial index."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".npz", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, boxes=self.boxes, offsets=self.offsets, valid=self.valid, key=self.key,
+                         version=LABEL_INDEX_VERSION)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def open(cls, list_path: str, label_files: Sequence[str], cache_dir: str = DEFAULT_CACHE_DIR) -> LabelIndex:
+        """Loads the index of the list file from the cache or compiles it, if it does not exist or the label files changed.
+
+        A compiled index is saved to the cache for the following runs, if the directory is writable.
+
+        :param list_path: Path of the list file of the dataset
+        :type list_path: str
+        :param label_files: Paths of the label files
+        :type label_files: Sequence[str]
+        :param cache_dir: Directory of the label indices, defaults to DEFAULT_CACHE_DIR
+        :type cache_dir: str, optional
+        :return: Index of the labels
+        :rtype: LabelIndex
+        """
+        label_files = [path.rstrip() for path in label_files]
+        path = get_label_index_path(list_path, cache_dir)
+        if os.path.isfile(path):
+            try:
+                index = cls.load(path)
+                if index.key == get_label_key(label_files) and len(index) == len(label_files):
+                    return index
+            except (OSError, ValueError, KeyError):
+                pass
+
+        index = cls.compile(label_files)
+        try:
+            index.save(path)
+        except OSError as e:
+            print(f"WARNING: Could not save the label index '{path}': {e}")
+        return index
+
+    def __len__(self) -> int:
+        return len(self.valid)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        """Returns a copy of the boxes (N, 5) of a sample as float64 or raises a ValueError if its label file is invalid."""
+        if not self.valid[index]:
+            raise ValueError(f"Label file of sample {index} is missing or invalid")
+        return self.boxes[self.offsets[index]:self.offsets[index + 1]].astype(np.float64)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of samples, boxes, invalid label files and boxes outside of the image."""
+        centers, sizes = self.boxes[:, 1:3], self.boxes[:, 3:5]
+        outside = ((centers - sizes / 2 < 0) | (centers + sizes / 2 > 1)).any(axis=1) | (sizes <= 0).any(axis=1)
+        return {
+            "samples": len(self),
+            "boxes": len(self.boxes),
+            "invalid_label_files": int((~self.valid).sum()),
+            "boxes_outside_image": int(outside.sum()),
+        }
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import copy
+import json
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, TYPE_CHECKING
+
+import numpy as np
+from terminaltables import AsciiTable
+
+# PyTorch is only imported when the data loader is instrumented or CUDA has to be synchronized
+if TYPE_CHECKING:
+    from torch.utils.data import DataLoader, Dataset
+
+PERCENTILES = (50, 90, 99)
+
+# Batch of an instrumented data loader together with the stage times measured in the worker
+TimedBatch = namedtuple("TimedBatch", ["batch", "stage_times"])
+
+
+class _TimedTransform:
+    """Measures the duration of the last transform call, which is the preprocessing of a sample."""
+
+    def __init__(self, transform):
+        self.transform = transform
+        self.last_duration = 0.0
+
+    def __call__(self, data):
+        start = time.perf_counter()
+        data = self.transform(data)
+        self.last_duration = time.perf_counter() - start
+        return data
+
+
+class _TimedDataset:
+    """Splits the loading of each sample into decoding (everything except the transform) and preprocessing."""
+
+    def __init__(self, dataset: Dataset):
+        self.dataset = copy.copy(dataset)
+        self.timed_transform = None
+        if getattr(dataset, "transform", None) is not None:
+            self.timed_transform = _TimedTransform(dataset.transform)
+            self.dataset.transform = self.timed_transform
+
+    def __getitem__(self, index):
+        start = time.perf_counter()
+        item = self.dataset[index]
+        duration = time.perf_counter() - start
+        preprocess = self.timed_transform.last_duration if self.timed_transform is not None else 0.0
+        return item, {"decode": duration - preprocess, "preprocess": preprocess}
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+class _TimedCollate:
+    """Sums the stage times of the samples of a batch, the collation is counted as preprocessing."""
+
+    def __init__(self, collate_fn):
+        self.collate_fn = collate_fn
+
+    def __call__(self, samples):
+        stage_times = {"decode": 0.0, "preprocess": 0.0}
+        for _, sample_times in samples:
+            for name, seconds in sample_times.items():
+                stage_times[name] += seconds
+        start = time.perf_counter()
+        batch = self.collate_fn([item for item, _ in samples])
+        stage_times["preprocess"] += time.perf_counter() - start
+        return TimedBatch(batch, stage_times)
+
+
+def _instrument_data_loader(dataloader: DataLoader) -> DataLoader:
+    """Rebuilds a data loader with the same settings, whose batches also carry the stage times of their samples."""
+    from torch.utils.data import DataLoader
+
+    return DataLoader(
+        _TimedDataset(dataloader.dataset),
+        batch_sampler=dataloader.batch_sampler,
+        num_workers=dataloader.num_workers,
+        collate_fn=_TimedCollate(dataloader.collate_fn),
+        pin_memory=dataloader.pin_memory,
+        timeout=dataloader.timeout,
+        worker_init_fn=dataloader.worker_init_fn,
+        multiprocessing_context=dataloader.multiprocessing_context,
+        generator=dataloader.generator,
+        prefetch_factor=dataloader.prefetch_factor,
+        persistent_workers=dataloader.persistent_workers)
+
+
+class LatencyRecorder:
+    """Records the duration of the stages of each processed frame (a batch or a single image)
+    and reports the percentiles of each stage.
+
+    Usage::
+
+        recorder = LatencyRecorder()
+        for batch in recorder.iterate(dataloader):
+            with recorder.stage("forward"):
+                model(batch[1])
+        print(recorder.table())
+
+    A disabled recorder only passes the data through, so the instrumented code paths can use it unconditionally.
+
+    :param enabled: If False, nothing is recorded, defaults to True
+    :type enabled: bool, optional
+    :param synchronize: If True, CUDA is synchronized at the end of each stage, so asynchronous kernels
+        are attributed to the stage that launched them, defaults to False
+    :type synchronize: bool, optional
+    """
+
+    def __init__(self, enabled: bool = True, synchronize: bool = False):
+        self.enabled = enabled
+        self.synchronize = synchronize
+        self.stage_times: Dict[str, List[float]] = {}
+        self.frames: List[Dict] = []
+        self._frame: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        """Adds a measured duration to a stage of the current frame."""
+        if not self.enabled:
+            return
+        self.stage_times.setdefault(name, []).append(seconds)
+        self._frame[name] = self._frame.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Measures the wall time of the enclosed block as a stage of the current frame."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.synchronize:
+                import torch
+                torch.cuda.synchronize()
+            self.add(name, time.perf_counter() - start)
+
+    def end_frame(self, total: Optional[float] = None, **info) -> None:
+        """Stores the stages recorded since the last call as one frame.
+
+        :param total: End-to-end seconds of the frame, recorded as the 'total' stage, defaults to None
+        :type total: Optional[float]
+        :param info: Additional fields stored with the frame record (e.g. the image path)
+        """
+        if not self.enabled:
+            return
+        if total is not None:
+            self.add("total", total)
+        frame = {"frame": len(self.frames), **info}
+        frame.update({f"{name}_ms": seconds * 1000 for name, seconds in self._frame.items()})
+        self.frames.append(frame)
+        self._frame = {}
+
+    def iterate(self, dataloader: Iterable) -> Iterator:
+        """Yields the batches of a data loader and records a frame for each of them.
+
+        The time the loop waits for a batch is recorded as 'data_wait'. For a `DataLoader`,
+        the 'decode' and 'preprocess' times of the samples (summed over the batch) are measured in the workers.
+        The 'total' time of a frame spans from the request of the batch to the end of its processing in the loop body.
+
+        :param dataloader: Data loader or any other iterable of batches
+        :type dataloader: Iterable
+        """
+        if not self.enabled:
+            yield from dataloader
+            return
+
+        from torch.utils.data import DataLoader
+        if isinstance(dataloader, DataLoader):
+            dataloader = _instrument_data_loader(dataloader)
+
+        iterator = iter(dataloader)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self.add("data_wait", time.perf_counter() - start)
+            if isinstance(batch, TimedBatch):
+                for name, seconds in batch.stage_times.items():
+                    self.add(name, seconds)
+                batch = batch.batch
+
+            yield batch
+
+            info = {}
+            if isinstance(batch, (list, tuple)) and batch and hasattr(batch[0], "__len__"):
+                info["images"] = len(batch[0])
+            self.end_frame(total=time.perf_counter() - start, **info)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Returns count, mean, percentiles and maximum of each stage in milliseconds.
+
+        :return: Statistics for each stage
+        :rtype: Dict[str, Dict[str, float]]
+        """
+        summary = {}
+        for name, seconds in self.stage_times.items():
+            milliseconds = np.asarray(seconds) * 1000
+            stats = {"count": len(milliseconds), "mean_ms": float(milliseconds.mean())}
+            for percentile in PERCENTILES:
+                stats[f"p{percentile}_ms"] = float(np.percentile(milliseconds, percentile))
+            stats["max_ms"] = float(milliseconds.max())
+            summary[name] = stats
+        return summary
+
+    def table(self) -> str:
+        """Returns the statistics of each stage as a table."""
+        rows = [["Stage", "Count", "Mean (ms)"] + [f"p{percentile} (ms)" for percentile in PERCENTILES] + ["Max (ms)"]]
+        for name, stats in self.summary().items():
+            rows.append([name, stats["count"]] + [f"{stats[key]:.2f}" for key in list(stats)[1:]])
+        return AsciiTable(rows).table
+
+    def save_frames(self, path: str) -> None:
+        """Writes one json line with the stage times of each recorded frame.
+
+        :param path: Path to the output file
+        :type path: str
+        """
+        with open(path, "w") as f:
+            for frame in self.frames:
+                f.write(json.dumps(frame) + "\n")
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import json
+import time
+import statistics
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from terminaltables import AsciiTable
+
+# PyTorch is only needed while the model runs, the results can be handled without it
+if TYPE_CHECKING:
+    import torch
+    import torch.nn as nn
+    from yoeo.models import Darknet
+
+SORT_KEYS = ("time", "memory", "params", "flops", "index")
+
+
+@dataclass
+class LayerStats:
+    index: int
+    type: str
+    output_shape: Tuple[int, ...]
+    activation_bytes: int
+    params: int
+    flops: int
+    times: List[float] = field(default_factory=list)
+
+    @property
+    def mean_ms(self) -> float:
+        return statistics.mean(self.times) * 1000
+
+    @property
+    def median_ms(self) -> float:
+        return statistics.median(self.times) * 1000
+
+    def to_dict(self) -> Dict:
+        return {
+            "index": self.index,
+            "type": self.type,
+            "output_shape": list(self.output_shape),
+            "activation_bytes": self.activation_bytes,
+            "params": self.params,
+            "flops": self.flops,
+            "mean_ms": self.mean_ms,
+            "median_ms": self.median_ms,
+            "runs": len(self.times),
+        }
+
+
+def _count_flops(module_def: Dict, module: nn.Sequential, input_shape: Tuple[int, ...], output: torch.Tensor) -> int:
+    """Estimates the floating point operations of a layer for one image.
+    A multiply-accumulate counts as two operations, elementwise operations as one per output element."""
+    batch_size = output.shape[0]
+    elements = output.numel() // batch_size
+    layer_type = module_def["type"]
+
+    if layer_type == "convolutional":
+        conv = module[0]
+        macs = elements * conv.in_channels // conv.groups * conv.kernel_size[0] * conv.kernel_size[1]
+        # Batch normalization and activation are counted with two operations per element each
+        return 2 * macs + 2 * elements * (len(module) - 1)
+    if layer_type == "maxpool":
+        kernel_size = int(module_def["size"])
+        return elements * kernel_size * kernel_size
+    if layer_type in ("upsample", "shortcut"):
+        return elements
+    if layer_type == "seg":
+        # Argmax over the class channels
+        return elements * input_shape[1]
+    if layer_type == "yolo":
+        # Sigmoid, grid offset and exponential for each prediction
+        return 2 * elements
+    # Routes only copy memory
+    return 0
+
+
+class LayerProfiler:
+    """Records wall time, output shape, activation memory, parameters and FLOPs of each layer of a `Darknet` model.
+
+    Usage::
+
+        with LayerProfiler(model) as profiler:
+            for _ in range(10):
+                model(images)
+        print(profiler.table())
+    """
+
+    def __init__(self, model: Darknet):
+        self.model = model
+        self.layers: Dict[int, LayerStats] = {}
+        self.trace_events: List[Dict] = []
+        self._start = 0.0
+        self._input_shape: Tuple[int, ...] = ()
+        self._origin = time.perf_counter()
+
+    def __enter__(self) -> LayerProfiler:
+        self.model.layer_profiler = self
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.model.layer_profiler = None
+
+    @staticmethod
+    def _synchronize(x: torch.Tensor) -> None:
+        # CUDA kernels run asynchronously, so the layer is only done once the device is idle
+        if x.is_cuda:
+            import torch
+            torch.cuda.synchronize(x.device)
+
+    def start_layer(self, x: torch.Tensor) -> None:
+        self._synchronize(x)
+        self._input_shape = tuple(x.shape)
+        self._start = time.perf_counter()
+
+    def end_layer(self, index: int, module_def: Dict, module: nn.Sequential, x: torch.Tensor) -> None:
+        self._synchronize(x)
+        end = time.perf_counter()
+
+        stats = self.layers.get(index)
+        if stats is None:
+            batch_size = x.shape[0]
+            stats = LayerStats(
+                index=index,
+                type=module_def["type"],
+                output_shape=tuple(x.shape),
+                activation_bytes=x.numel() * x.element_size() // batch_size,
+                params=sum(p.numel() for p in module.parameters()),
+                flops=_count_flops(module_def, module, self._input_shape, x))
+            self.layers[index] = stats
+        stats.times.append(end - self._start)
+
+        self.trace_events.append({
+            "name": f"{index} {stats.type}",
+            "cat": stats.type,
+            "ph": "X",
+            "ts": (self._start - self._origin) * 1e6,
+            "dur": (end - self._start) * 1e6,
+            "pid": 0,
+            "tid": 0,
+            "args": {"output_shape": list(stats.output_shape)},
+        })
+
+    def sorted_layers(self, sort_by: str = "time") -> List[LayerStats]:
+        """Returns the recorded layers, most expensive first (or in network order for 'index')."""
+        assert sort_by in SORT_KEYS, f"Unknown sort key '{sort_by}', choose one of {SORT_KEYS}"
+        keys = {
+            "time": lambda layer: -layer.median_ms,
+            "memory": lambda layer: -layer.activation_bytes,
+            "params": lambda layer: -layer.params,
+            "flops": lambda layer: -layer.flops,
+            "index": lambda layer: layer.index,
+        }
+        return sorted(self.layers.values(), key=keys[sort_by])
+
+    def table(self, sort_by: str = "time", top: Optional[int] = None) -> str:
+        """Returns the per layer statistics as a table. Memory and FLOPs are given per image.
+
+        :param sort_by: One of 'time', 'memory', 'params', 'flops' or 'index', defaults to 'time'
+        :type sort_by: str, optional
+        :param top: Only include this many layers, defaults to None (all layers)
+        :type top: Optional[int]
+        :return: Formatted table
+        :rtype: str
+        """
+        total_ms = sum(layer.median_ms for layer in self.layers.values()) or float("nan")
+        rows = [["Index", "Type", "Output shape", "Median (ms)", "Time (%)", "Activation (KiB)", "Params", "GFLOPs"]]
+        for layer in self.sorted_layers(sort_by)[:top]:
+            rows.append([
+                layer.index,
+                layer.type,
+                "x".join(map(str, layer.output_shape[1:])),
+                f"{layer.median_ms:.3f}",
+                f"{100 * layer.median_ms / total_ms:.1f}",
+                f"{layer.activation_bytes / 1024:.1f}",
+                layer.params,
+                f"{layer.flops / 1e9:.3f}",
+            ])
+        rows.append([
+            "", "Total", "",
+            f"{total_ms:.3f}", "100.0",
+            f"{sum(layer.activation_bytes for layer in self.layers.values()) / 1024:.1f}",
+            sum(layer.params for layer in self.layers.values()),
+            f"{sum(layer.flops for layer in self.layers.values()) / 1e9:.3f}",
+        ])
+        return AsciiTable(rows).table
+
+    def save_trace(self, path: str) -> None:
+        """Writes all recorded layer runs in the Chrome trace format (open it in chrome://tracing or Perfetto)
+        together with the per layer summary under the 'layers' key.
+
+        :param path: Path to the json file
+        :type path: str
+        """
+        with open(path, "w") as f:
+            json.dump({
+                "traceEvents": self.trace_events,
+                "displayTimeUnit": "ms",
+                "layers": [layer.to_dict() for layer in self.sorted_layers("index")],
+            }, f)
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+# PyTorch is only imported by the functions that transform tensors
+if TYPE_CHECKING:
+    import torch
+
+# Side lengths of the letterbox shapes are multiples of the largest stride of the network
+STRIDE = 32
+
+
+def _read_image_size(path: str) -> Tuple[int, int]:
+    from PIL import Image
+
+    try:
+        # Opening an image only parses its header, the pixels are decoded on first access
+        with Image.open(path) as image:
+            width, height = image.size
+        return height, width
+    except Exception:
+        return 0, 0
+
+
+def read_image_sizes(img_files: Sequence[str], n_threads: int = 8) -> np.ndarray:
+    """Reads the size of each image from its header without decoding it.
+
+    :param img_files: Paths of the images
+    :type img_files: Sequence[str]
+    :param n_threads: Number of threads reading the headers, defaults to 8
+    :type n_threads: int, optional
+    :return: Height and width (N, 2) of each image, (0, 0) for images that could not be read
+    :rtype: np.ndarray
+    """
+    sizes = np.zeros((len(img_files), 2), dtype=np.int64)
+    with ThreadPoolExecutor(max(1, n_threads)) as pool:
+        for i, size in enumerate(pool.map(_read_image_size, img_files, chunksize=64)):
+            sizes[i] = size
+    return sizes
+
+
+def letterbox_shapes(img_sizes: np.ndarray, img_size: int, stride: int = STRIDE) -> np.ndarray:
+    """Returns the smallest shape of each image letterboxed to a longer side of `img_size`.
+
+    Each side is a multiple of `stride`. Images with an unknown size (0, 0) are treated as square.
+
+    :param img_sizes: Height and width (N, 2) of the images
+    :type img_sizes: np.ndarray
+    :param img_size: Length of the longer side of the shapes
+    :type img_size: int
+    :param stride: Each side is a multiple of it, defaults to STRIDE
+    :type stride: int, optional
+    :return: Height and width (N, 2) of each shape
+    :rtype: np.ndarray
+    """
+    img_sizes = np.array(img_sizes, dtype=np.float64).reshape(-1, 2)
+    img_sizes[(img_sizes <= 0).any(axis=1)] = 1
+    sides = np.ceil(img_size * img_sizes / img_sizes.max(axis=1, keepdims=True) / stride) * stride
+    return np.minimum(sides, img_size).astype(np.int64)
+
+
+def letterbox_shape(img_sizes: np.ndarray, img_size: int, stride: int = STRIDE) -> Tuple[int, int]:
+    """Returns the smallest shape, which contains all images letterboxed to a longer side of `img_size`.
+
+    :param img_sizes: Height and width (N, 2) of the images
+    :type img_sizes: np.ndarray
+    :param img_size: Length of the longer side of the shape
+    :type img_size: int
+    :param stride: Each side is a multiple of it, defaults to STRIDE
+    :type stride: int, optional
+    :return: Height and width of the shape
+    :rtype: Tuple[int, int]
+    """
+    shapes = letterbox_shapes(img_sizes, img_size, stride)
+    if not len(shapes):
+        return img_size, img_size
+    height, width = shapes.max(axis=0)
+    return int(height), int(width)
+
+
+def letterbox_region(original_size: Tuple[int, int], shape: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    """Returns where an image is placed in a letterbox shape.
+
+    The image is scaled to fit the shape with its aspect ratio and centered,
+    an odd padding puts the extra pixel at the bottom or right like `PadSquare`.
+
+    :param original_size: Height and width of the image
+    :type original_size: Tuple[int, int]
+    :param shape: Height and width of the letterbox
+    :type shape: Tuple[int, int]
+    :return: Top, left, height and width of the scaled image in the letterbox
+    :rtype: Tuple[int, int, int, int]
+    """
+    original_height, original_width = original_size
+    shape_height, shape_width = shape
+    scale = min(shape_height / original_height, shape_width / original_width)
+    height = min(shape_height, max(1, round(original_height * scale)))
+    width = min(shape_width, max(1, round(original_width * scale)))
+    return (shape_height - height) // 2, (shape_width - width) // 2, height, width
+
+
+def letterbox(img: torch.Tensor, bb_targets: torch.Tensor, mask: Optional[torch.Tensor],
+              shape: Tuple[int, int]) -> Tuple[torch.Tensor, torch.Tensor, Optional[torch.Tensor]]:
+    """Scales a sample to fit a shape with its aspect ratio and pads it with zeros to the shape.
+
+    :param img: Image (C, H, W)
+    :type img: torch.Tensor
+    :param bb_targets: Boxes (N, 6) with 'sample index, class, x, y, w, h' relative to the image
+    :type bb_targets: torch.Tensor
+    :param mask: Mask (1, H, W), defaults to None
+    :type mask: Optional[torch.Tensor]
+    :param shape: Height and width of the letterbox
+    :type shape: Tuple[int, int]
+    :return: Image, boxes relative to the letterbox and mask
+    :rtype: Tuple[torch.Tensor, torch.Tensor, Optional[torch.Tensor]]
+    """
+    import torch.nn.functional as F
+
+    shape_height, shape_width = shape
+    top, left, height, width = letterbox_region(tuple(img.shape[-2:]), shape)
+    padding = (left, shape_width - width - left, top, shape_height - height - top)
+
+    def fit(tensor):
+        if tuple(tensor.shape[-2:]) != (height, width):
+            tensor = F.interpolate(tensor.unsqueeze(0), size=(height, width), mode="nearest").squeeze(0)
+        return F.pad(tensor, padding, "constant", value=0)
+
+    img = fit(img)
+    mask = fit(mask) if mask is not None else None
+    bb_targets = bb_targets.clone()
+    bb_targets[:, 2] = (bb_targets[:, 2] * width + left) / shape_width
+    bb_targets[:, 3] = (bb_targets[:, 3] * height + top) / shape_height
+    bb_targets[:, 4] *= width / shape_width
+    bb_targets[:, 5] *= height / shape_height
+    return img, bb_targets, mask
+
+
+def rescale_boxes_letterbox(boxes: torch.Tensor, shape: Tuple[int, int], original_size: Tuple[int, int]) -> torch.Tensor:
+    """Rescales detections on a letterboxed image to the original image, the counterpart of `utils.rescale_boxes`.
+
+    :param boxes: Detections (N, 6) with 'x1, y1, x2, y2, confidence, class' in pixels of the letterbox
+    :type boxes: torch.Tensor
+    :param shape: Height and width of the letterbox
+    :type shape: Tuple[int, int]
+    :param original_size: Height and width of the original image
+    :type original_size: Tuple[int, int]
+    :return: Detections in pixels of the original image
+    :rtype: torch.Tensor
+    """
+    top, left, height, width = letterbox_region(original_size, shape)
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - left) * (original_size[1] / width)
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - top) * (original_size[0] / height)
+    return boxes
+
@@ -1,22 +1,205 @@
 import os
+import csv
+import json
+import time
+import atexit
 import datetime
-from torch.utils.tensorboard import SummaryWriter
+import threading
+from collections import deque
+
+BACKENDS = ("tensorboard", "jsonl", "csv")
+
+
+class TensorBoardBackend(object):
+    def __init__(self, log_dir):
+        # TensorBoard takes long to import, so it is only loaded if a logger is actually used
+        from torch.utils.tensorboard import SummaryWriter
+        self.writer = SummaryWriter(log_dir)
+
+    def write(self, records):
+        for tag, value, step, wall_time in records:
+            self.writer.add_scalar(tag, value, step, walltime=wall_time)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+
+class JsonlBackend(object):
+    """Writes one json line per scalar to 'scalars.jsonl'."""
+
+    def __init__(self, log_dir):
+        self.file = open(os.path.join(log_dir, "scalars.jsonl"), "a")
+
+    def write(self, records):
+        self.file.writelines(
+            json.dumps({"tag": tag, "step": step, "value": value, "wall_time": wall_time}) + "\n"
+            for tag, value, step, wall_time in records)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CsvBackend(object):
+    """Writes one row per scalar to 'scalars.csv'."""
+
+    def __init__(self, log_dir):
+        path = os.path.join(log_dir, "scalars.csv")
+        write_header = not os.path.exists(path)
+        self.file = open(path, "a", newline="")
+        self.writer = csv.writer(self.file)
+        if write_header:
+            self.writer.writerow(["tag", "step", "value", "wall_time"])
+
+    def write(self, records):
+        self.writer.writerows([tag, step, value, wall_time] for tag, value, step, wall_time in records)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def _create_backend(name, log_dir):
+    if name == "tensorboard":
+        return TensorBoardBackend(log_dir)
+    if name == "jsonl":
+        return JsonlBackend(log_dir)
+    if name == "csv":
+        return CsvBackend(log_dir)
+    raise ValueError(f"Unknown log backend '{name}', choose from {BACKENDS}")
 
 
 class Logger(object):
-    def __init__(self, log_dir, log_hist=True):
-        """Create a summary writer logging to log_dir."""
+    def __init__(self, log_dir, log_hist=True, backends=("tensorboard",), flush_interval=5.0,
+                 aggregate_tags=(), aggregate_steps=10, max_buffer=100000):
+        """Create a logger, which buffers the scalars and writes them to log_dir in a background thread.
+
+        Logging a scalar only appends it to a buffer, so the training loop never waits for the backends or the disk.
+        Values can be tensors, they are converted in the background thread.
+
+        :param log_dir: Directory of the logs
+        :type log_dir: str
+        :param log_hist: Creates a new folder with the current time in log_dir for each logger, defaults to True
+        :type log_hist: bool, optional
+        :param backends: Names of the backends ('tensorboard', 'jsonl', 'csv'), defaults to ("tensorboard",)
+        :type backends: Sequence[str], optional
+        :param flush_interval: Seconds between two writes of the buffer, defaults to 5.0
+        :type flush_interval: float, optional
+        :param aggregate_tags: Tags (or tag prefixes) of high frequency scalars, which are logged as '<tag>/mean',
+            '<tag>/min' and '<tag>/max' of each window of aggregate_steps steps instead of each value, defaults to ()
+        :type aggregate_tags: Sequence[str], optional
+        :param aggregate_steps: Number of steps of an aggregation window, defaults to 10
+        :type aggregate_steps: int, optional
+        :param max_buffer: Maximum number of buffered scalars, the oldest are dropped if the backends fall behind, defaults to 100000
+        :type max_buffer: int, optional
+        """
         if log_hist:    # Check a new folder for each log should be dreated
             log_dir = os.path.join(
                 log_dir,
                 datetime.datetime.now().strftime("%Y_%m_%d__%H_%M_%S"))
-        self.writer = SummaryWriter(log_dir)
+        os.makedirs(log_dir, exist_ok=True)
+        self.log_dir = log_dir
+        self.backends = [_create_backend(name, log_dir) for name in backends]
+        self.flush_interval = flush_interval
+        self.aggregate_tags = tuple(aggregate_tags)
+        self.aggregate_steps = aggregate_steps
+        self.dropped = 0
+
+        self._buffer = deque(maxlen=max_buffer)
+        self._windows = {}  # Values of the current aggregation window of each tag
+        self._lock = threading.Lock()  # Serializes the writes of the background thread and flush()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="yoeo-logger", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
 
     def scalar_summary(self, tag, value, step):
         """Log a scalar variable."""
-        self.writer.add_scalar(tag, value, step)
+        if hasattr(value, "detach"):  # Tensors must not keep their autograd graph alive until they are written
+            value = value.detach()
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append((tag, value, step, time.time()))
 
     def list_of_scalars_summary(self, tag_value_pairs, step):
         """Log scalar variables."""
         for tag, value in tag_value_pairs:
-            self.writer.add_scalar(tag, value, step)
+            self.scalar_summary(tag, value, step)
+
+    def flush(self):
+        """Writes all buffered scalars to the backends and waits until they are written."""
+        with self._lock:
+            self._write(self._drain())
+            for backend in self.backends:
+                backend.flush()
+
+    def close(self):
+        """Writes the remaining scalars including the open aggregation windows and closes the backends."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        with self._lock:
+            records = self._drain()
+            for tag in list(self._windows):
+                records.extend(self._close_window(tag))
+            self._write(records)
+            for backend in self.backends:
+                backend.close()
+        atexit.unregister(self.close)
+        if self.dropped:
+            print(f"WARNING: {self.dropped} scalars were dropped, because the log backends could not keep up")
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                # A failing backend must not stop the training
+                print(f"WARNING: Could not write logs to '{self.log_dir}': {e}")
+
+    def _drain(self):
+        records = []
+        while self._buffer:
+            tag, value, step, wall_time = self._buffer.popleft()
+            records.extend(self._aggregate(tag, float(value), step, wall_time))
+        return records
+
+    def _aggregate(self, tag, value, step, wall_time):
+        if not tag.startswith(self.aggregate_tags) or not self.aggregate_tags:
+            return [(tag, value, step, wall_time)]
+
+        records = []
+        window = step // self.aggregate_steps
+        if tag in self._windows and self._windows[tag]["window"] != window:
+            records = self._close_window(tag)
+        state = self._windows.setdefault(tag, {"window": window, "values": []})
+        state["values"].append(value)
+        state["step"], state["wall_time"] = step, wall_time
+        return records
+
+    def _close_window(self, tag):
+        state = self._windows.pop(tag)
+        values = state["values"]
+        step, wall_time = state["step"], state["wall_time"]
+        return [
+            (f"{tag}/mean", sum(values) / len(values), step, wall_time),
+            (f"{tag}/min", min(values), step, wall_time),
+            (f"{tag}/max", max(values), step, wall_time),
+        ]
+
+    def _write(self, records):
+        if not records:
+            return
+        for backend in self.backends:
+            backend.write(records)
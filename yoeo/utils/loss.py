@@ -161,7 +161,8 @@ def yolo_loss(combined_predictions, targets, model):
     # Merge losses
     loss = lbox + lobj + lcls
 
-    return loss, to_cpu(torch.cat((lbox, lobj, lcls, loss)))
+    # The loss components stay on the device, so the training loop does not synchronize each step
+    return loss, torch.cat((lbox, lobj, lcls, loss)).detach()
 
 def unet_loss(combined_predictions, seg_targets, model):
     yolo_predictions, seg_predictions = combined_predictions
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import json
+import struct
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import torch
+
+# File layout:
+#   8 bytes  magic
+#   8 bytes  little endian length of the json header
+#   n bytes  json header {"seen": int, "tensors": {name: {"dtype": str, "shape": list, "offset": int}}}
+#   ...      raw tensor data, starting at the next ALIGNMENT aligned position after the header.
+#            The offsets of the tensors are relative to the start of the data and ALIGNMENT aligned as well.
+MMAP_WEIGHTS_MAGIC = b"YOEOMMAP"
+MMAP_WEIGHTS_EXTENSION = ".mmw"
+ALIGNMENT = 64
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_mmap_weights(state_dict: Dict[str, torch.Tensor], path: str, seen: int = 0) -> None:
+    """
+    Writes a state dict in the memory-mappable weight format.
+
+    :param state_dict: State dict of the model
+    :type state_dict: Dict[str, torch.Tensor]
+    :param path: Path of the new weights file (.mmw)
+    :type path: str
+    :param seen: Number of images seen during training, defaults to 0
+    :type seen: int, optional
+    """
+    arrays = {name: tensor.detach().cpu().contiguous().numpy() for name, tensor in state_dict.items()}
+
+    tensors, data_size = {}, 0
+    for name, array in arrays.items():
+        data_size = _align(data_size)
+        tensors[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": data_size}
+        data_size += array.nbytes
+    header = json.dumps({"seen": int(seen), "tensors": tensors}).encode("utf-8")
+
+    with open(path, "wb") as f:
+        f.write(MMAP_WEIGHTS_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        data_start = _align(f.tell())
+        for name, array in arrays.items():
+            f.write(b"\0" * (data_start + tensors[name]["offset"] - f.tell()))
+            f.write(array.tobytes())
+
+
+class MmapWeights(object):
+    """
+    Read access to a memory-mapped weights file (.mmw).
+    The tensors are views into a private (copy-on-write) mapping of the file,
+    so untouched pages are shared through the page cache between all processes that load the same file.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            magic = f.read(len(MMAP_WEIGHTS_MAGIC))
+            assert magic == MMAP_WEIGHTS_MAGIC, f"'{path}' is not a memory-mapped weights file"
+            header_size, = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_size).decode("utf-8"))
+            self._data_start = _align(f.tell())
+
+        self.path = path
+        self.seen = header["seen"]
+        self._tensors = header["tensors"]
+        self._mmap = np.memmap(path, dtype=np.uint8, mode="c")
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tensors
+
+    def __len__(self) -> int:
+        return len(self._tensors)
+
+    def keys(self) -> Iterator[str]:
+        return iter(self._tensors)
+
+    def __getitem__(self, name: str) -> torch.Tensor:
+        info = self._tensors[name]
+        array = np.ndarray(
+            shape=info["shape"],
+            dtype=np.dtype(info["dtype"]),
+            buffer=self._mmap,
+            offset=self._data_start + info["offset"])
+        return torch.from_numpy(array)
+
+
+def load_mmap_weights(model, path: str, cutoff: Optional[int] = None) -> Tuple[int, list]:
+    """
+    Loads a memory-mapped weights file into a Darknet model layer by layer.
+    On the CPU the parameters and buffers are replaced by views of the mapped file without copying,
+    only the pages that are actually touched are read from disk.
+
+    :param model: Model to load the weights into
+    :type model: models.Darknet
+    :param path: Path to the weights file (.mmw)
+    :type path: str
+    :param cutoff: Only layers with a lower index are loaded, defaults to None (all layers)
+    :type cutoff: Optional[int]
+    :return: Number of loaded tensors and names of the tensors that are missing, have a different shape
+             or belong to a layer at or past the cutoff
+    :rtype: Tuple[int, list]
+    """
+    weights = MmapWeights(path)
+    model.seen = weights.seen
+
+    num_loaded, skipped = 0, []
+    for i, module in enumerate(model.module_list):
+        tensors = list(module.named_parameters()) + list(module.named_buffers())
+        if cutoff is not None and i >= cutoff:
+            # Layers past the cutoff are reported like missing ones, so they are initialized like on the darknet path.
+            # The anchors of the yolo layers come from the model definition, they are kept and not reported
+            if any(True for _ in module.parameters()):
+                skipped += [f"module_list.{i}.{name}" for name, _ in tensors]
+            continue
+        for name, tensor in tensors:
+            key = f"module_list.{i}.{name}"
+            if key not in weights or tuple(weights[key].shape) != tuple(tensor.shape):
+                skipped.append(key)
+                continue
+            mapped = weights[key]
+            if mapped.dtype != tensor.dtype or mapped.device != tensor.device:
+                mapped = mapped.to(device=tensor.device, dtype=tensor.dtype)
+            tensor.data = mapped
+            num_loaded += 1
+
+    return num_loaded, skipped
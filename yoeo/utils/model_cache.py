@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from typing import Dict, Optional
+
+import torch
+import torch.nn as nn
+
+# The cache holds compiled models of this machine, so it lives in the user's cache directory unless overwritten
+DEFAULT_CACHE_DIR = os.environ.get(
+    "YOEO_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "yoeo"))
+
+# Bump this if the layout of the cache entries changes
+CACHE_FORMAT_VERSION = 1
+
+_HASH_INDEX_FILE = "file_hashes.json"
+_MODEL_FILE = "model.pt"
+_META_FILE = "meta.json"
+
+
+class CachedModel(nn.Module):
+    """Compiled model from the cache that exposes the attributes of the `Darknet` model used for inference."""
+
+    def __init__(self, module: torch.jit.ScriptModule, meta: Dict):
+        super(CachedModel, self).__init__()
+        self.module = module
+        self.meta = meta
+        self.hyperparams = meta["hyperparams"]
+        self.num_seg_classes = meta["num_seg_classes"]
+
+    def forward(self, x):
+        return self.module(x)
+
+
+def _hash_file(path: str, cache_dir: str) -> str:
+    """Returns the sha256 of a file. The hashes are memorized by path, size and modification time,
+    so large weight files are only read once after they changed."""
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    index_path = os.path.join(cache_dir, _HASH_INDEX_FILE)
+    index = {}
+    if os.path.isfile(index_path):
+        try:
+            with open(index_path, "r") as f:
+                index = json.load(f)
+        except ValueError:
+            index = {}
+    if key in index:
+        return index[key]
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    index[key] = sha.hexdigest()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=cache_dir, delete=False) as f:
+        json.dump(index, f)
+    os.replace(f.name, index_path)
+    return index[key]
+
+
+def _source_hash() -> str:
+    """Hashes the model implementation, so changes to the layers invalidate the cache as well."""
+    from yoeo import models
+    with open(models.__file__, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_cache_key(model_path: str, weights_path: Optional[str], img_size: int, fuse: bool = True,
+                  cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """Returns the key of the cache entry for a model. It changes if any of the inputs,
+    the model implementation or the PyTorch version changes.
+
+    :param model_path: Path to model definition file (.cfg)
+    :type model_path: str
+    :param weights_path: Path to weights or checkpoint file (.weights, .pth or .mmw)
+    :type weights_path: Optional[str]
+    :param img_size: Size of each image dimension for yolo
+    :type img_size: int
+    :param fuse: If True, the batch normalization layers are folded into the convolutions, defaults to True
+    :type fuse: bool, optional
+    :param cache_dir: Directory of the cache, defaults to DEFAULT_CACHE_DIR
+    :type cache_dir: str, optional
+    :return: Hex digest identifying the cache entry
+    :rtype: str
+    """
+    inputs = {
+        "format": CACHE_FORMAT_VERSION,
+        "cfg": _hash_file(model_path, cache_dir),
+        "weights": _hash_file(weights_path, cache_dir) if weights_path else None,
+        "img_size": img_size,
+        "fuse": fuse,
+        "torch": torch.__version__,
+        "source": _source_hash(),
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _compile_model(model_path: str, weights_path: Optional[str], img_size: int, fuse: bool, entry_dir: str) -> None:
+    from yoeo.models import load_model
+
+    model = load_model(model_path, weights_path)
+    model.eval()
+    if fuse:
+        model.fuse()
+
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.rand(1, 3, img_size, img_size), check_trace=False)
+
+    meta = {
+        "model": os.path.abspath(model_path),
+        "weights": os.path.abspath(weights_path) if weights_path else None,
+        "img_size": img_size,
+        "fuse": fuse,
+        "torch": torch.__version__,
+        "hyperparams": model.hyperparams,
+        "num_seg_classes": model.num_seg_classes,
+    }
+
+    # Write the entry to a temporary directory first, so concurrent or aborted runs never leave a partial entry
+    os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir))
+    try:
+        torch.jit.save(traced, os.path.join(tmp_dir, _MODEL_FILE))
+        with open(os.path.join(tmp_dir, _META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another process created the entry in the meantime
+        if not os.path.isfile(os.path.join(entry_dir, _META_FILE)):
+            raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_cached_model(model_path: str, weights_path: Optional[str] = None, img_size: int = 416, device="cpu",
+                      fuse: bool = True, cache_dir: str = DEFAULT_CACHE_DIR) -> CachedModel:
+    """Loads the compiled inference model from the cache and compiles and stores it first if it is not cached yet.
+
+    The model is traced with TorchScript for a fixed image size, so it can only be used for inference
+    on images of this size. Entries are invalidated automatically if the model definition, the weights,
+    the image size, the options, the model implementation or the PyTorch version change.
+
+    :param model_path: Path to model definition file (.cfg)
+    :type model_path: str
+    :param weights_path: Path to weights or checkpoint file (.weights, .pth or .mmw), defaults to None (random weights)
+    :type weights_path: Optional[str]
+    :param img_size: Size of each image dimension for yolo, defaults to 416
+    :type img_size: int, optional
+    :param device: Device the model is loaded to, defaults to "cpu"
+    :type device: str or torch.device
+    :param fuse: If True, the batch normalization layers are folded into the convolutions, defaults to True
+    :type fuse: bool, optional
+    :param cache_dir: Directory of the cache, defaults to DEFAULT_CACHE_DIR
+    :type cache_dir: str, optional
+    :return: Returns the compiled model
+    :rtype: CachedModel
+    """
+    key = get_cache_key(model_path, weights_path, img_size, fuse, cache_dir)
+    entry_dir = os.path.join(cache_dir, "models", key)
+
+    if os.path.isfile(os.path.join(entry_dir, _META_FILE)):
+        print(f"Using cached model '{entry_dir}'")
+    else:
+        print(f"Compiling model into cache '{entry_dir}'")
+        _compile_model(model_path, weights_path, img_size, fuse, entry_dir)
+
+    with open(os.path.join(entry_dir, _META_FILE), "r") as f:
+        meta = json.load(f)
+    module = torch.jit.load(os.path.join(entry_dir, _MODEL_FILE), map_location=device)
+    return CachedModel(module, meta).eval()
+
+
+def clear_cache(cache_dir: str = DEFAULT_CACHE_DIR) -> None:
+    """Removes all cached models and file hashes.
+
+    :param cache_dir: Directory of the cache, defaults to DEFAULT_CACHE_DIR
+    :type cache_dir: str, optional
+    """
+    shutil.rmtree(os.path.join(cache_dir, "models"), ignore_errors=True)
+    index_path = os.path.join(cache_dir, _HASH_INDEX_FILE)
+    if os.path.isfile(index_path):
+        os.remove(index_path)
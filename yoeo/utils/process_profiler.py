@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import io
+import os
+import pstats
+import cProfile
+from typing import Iterable, Iterator, Optional, Tuple
+
+DEFAULT_WINDOW = "50:70"
+
+
+def parse_profile_window(window: str) -> Tuple[int, int]:
+    """Parses a window of steps like '50:70' (steps 50 to 69) or '100' (the first 100 steps).
+
+    :param window: Window of steps
+    :type window: str
+    :return: First step and the step after the window
+    :rtype: Tuple[int, int]
+    """
+    start, separator, end = window.partition(":")
+    if not separator:
+        start, end = "0", start
+    start, end = int(start), int(end)
+    if not 0 <= start < end:
+        raise ValueError(f"Invalid profile window '{window}', expected START:END with START < END")
+    return start, end
+
+
+class ProcessProfiler:
+    """Profiles a window of steps (batches) with the PyTorch profiler and cProfile.
+
+    When the window ends, the following files are written to the output directory:
+
+    - `torch_trace.json`: Chrome trace of the operators (open it in chrome://tracing or https://ui.perfetto.dev)
+    - `torch_ops.txt`: Operators with the highest self time
+    - `python.prof`: cProfile statistics (e.g. for snakeviz)
+    - `python_functions.txt`: Python functions with the highest cumulative time
+
+    Usage::
+
+        profiler = ProcessProfiler("profile", start=50, end=70)
+        for batch in profiler.iterate(dataloader):
+            model(batch)
+        profiler.close()
+
+    A disabled profiler only passes the data through, so the instrumented code paths can use it unconditionally.
+
+    :param output_dir: Directory of the profiling results, defaults to "profile"
+    :type output_dir: str, optional
+    :param start: First profiled step, defaults to 50
+    :type start: int, optional
+    :param end: Step after the last profiled step, defaults to 70
+    :type end: int, optional
+    :param enabled: If False, nothing is profiled, defaults to True
+    :type enabled: bool, optional
+    :param top: Number of operators and functions in the summaries, defaults to 25
+    :type top: int, optional
+    """
+
+    def __init__(self, output_dir: str = "profile", start: int = 50, end: int = 70, enabled: bool = True, top: int = 25):
+        self.output_dir = output_dir
+        self.start = start
+        self.end = end
+        self.enabled = enabled
+        self.top = top
+        self.step_num = 0
+        self.done = False
+        self._torch_profiler = None
+        self._python_profiler: Optional[cProfile.Profile] = None
+        self._use_cuda = False
+
+    @property
+    def active(self) -> bool:
+        return self._python_profiler is not None
+
+    def step(self) -> None:
+        """Marks the end of a step and starts or stops the profiling at the bounds of the window."""
+        if not self.enabled or self.done:
+            return
+        if self.active:
+            self._torch_profiler.step()
+        self.step_num += 1
+        if self.step_num == self.start:
+            self._start()
+        elif self.step_num == self.end:
+            self.close()
+
+    def iterate(self, dataloader: Iterable) -> Iterator:
+        """Yields the batches of a data loader and counts each iteration of the loop as a step."""
+        if not self.enabled:
+            yield from dataloader
+            return
+        if self.step_num == self.start == 0 and not self.active:
+            self._start()
+        for batch in dataloader:
+            yield batch
+            self.step()
+
+    def _start(self) -> None:
+        from torch.profiler import ProfilerActivity, profile
+        import torch
+
+        activities = [ProfilerActivity.CPU]
+        self._use_cuda = torch.cuda.is_available()
+        if self._use_cuda:
+            activities.append(ProfilerActivity.CUDA)
+        print(f"---- Profiling steps {self.start} to {self.end - 1} ----")
+        self._torch_profiler = profile(activities=activities, record_shapes=True)
+        self._torch_profiler.__enter__()
+        self._python_profiler = cProfile.Profile()
+        self._python_profiler.enable()
+
+    def close(self) -> None:
+        """Stops the profiling, if the window is still open (e.g. the run has less steps), and writes the results."""
+        if not self.active:
+            if self.enabled and not self.done:
+                print(f"---- Nothing profiled, the run ended after {self.step_num} steps before the profile window starts at step {self.start} ----")
+                self.done = True
+            return
+        self._python_profiler.disable()
+        self._torch_profiler.__exit__(None, None, None)
+        self.done = True
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._torch_profiler.export_chrome_trace(os.path.join(self.output_dir, "torch_trace.json"))
+        sort_by = "self_cuda_time_total" if self._use_cuda else "self_cpu_time_total"
+        operators = self._torch_profiler.key_averages().table(sort_by=sort_by, row_limit=self.top)
+        with open(os.path.join(self.output_dir, "torch_ops.txt"), "w") as f:
+            f.write(operators)
+
+        self._python_profiler.dump_stats(os.path.join(self.output_dir, "python.prof"))
+        stream = io.StringIO()
+        pstats.Stats(self._python_profiler, stream=stream).sort_stats("cumulative").print_stats(self.top)
+        functions = stream.getvalue()
+        with open(os.path.join(self.output_dir, "python_functions.txt"), "w") as f:
+            f.write(functions)
+
+        print(operators)
+        print(f"---- Profile of steps {self.start} to {self.step_num - 1} written to '{self.output_dir}' ----")
+        self._torch_profiler = None
+        self._python_profiler = None
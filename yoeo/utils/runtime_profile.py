@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import os
+import yaml
+
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+OBJECTIVES = ("latency", "throughput")
+
+# The profile is machine specific, so it lives in the user's config directory unless overwritten
+DEFAULT_RUNTIME_PROFILE = os.environ.get(
+    "YOEO_RUNTIME_PROFILE",
+    os.path.join(os.path.expanduser("~"), ".config", "yoeo", "runtime_profile.yaml"))
+
+
+@dataclass
+class RuntimeSettings:
+    num_threads: int
+    num_interop_threads: int
+    batch_size: int
+    n_cpu: int
+    latency_ms: float = float("nan")
+    images_per_second: float = float("nan")
+
+
+@dataclass
+class RuntimeProfile:
+    model: str
+    img_size: int
+    latency: Optional[RuntimeSettings] = None
+    throughput: Optional[RuntimeSettings] = None
+
+    @classmethod
+    def load_from(cls, path: str) -> RuntimeProfile:
+        with open(path, "r") as f:
+            content = yaml.safe_load(f)
+
+        return cls._parse_yaml_file(content)
+
+    @staticmethod
+    def _parse_yaml_file(content: Dict[Any, Any]) -> RuntimeProfile:
+        for objective in OBJECTIVES:
+            if content.get(objective) is not None:
+                content[objective] = RuntimeSettings(**content[objective])
+
+        return RuntimeProfile(**content)
+
+    def save_to(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(path, "w") as f:
+            yaml.safe_dump(asdict(self), f, sort_keys=False)
+
+    def get(self, objective: str) -> Optional[RuntimeSettings]:
+        assert objective in OBJECTIVES, f"Unknown objective '{objective}', choose one of {OBJECTIVES}"
+        return getattr(self, objective)
+
+
+def apply_thread_settings(num_threads: int, num_interop_threads: Optional[int] = None) -> None:
+    """
+    Configures the intra-op and inter-op thread pools of PyTorch.
+    The inter-op pool can only be sized before it is used for the first time,
+    so a failing attempt is reported and otherwise ignored.
+
+    :param num_threads: Number of intra-op threads
+    :type num_threads: int
+    :param num_interop_threads: Number of inter-op threads, defaults to None (unchanged)
+    :type num_interop_threads: Optional[int]
+    """
+    import torch
+
+    torch.set_num_threads(num_threads)
+
+    if num_interop_threads is not None and num_interop_threads != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            print(f"Could not set the number of inter-op threads to {num_interop_threads}, it was already in use.")
+
+
+def apply_runtime_profile(args, objective: str, default_batch_size: int, default_n_cpu: int) -> Optional[RuntimeSettings]:
+    """
+    Fills the `batch_size` and `n_cpu` command line arguments that were not given explicitly with the values
+    of the runtime profile created by `yoeo-autotune` and configures the PyTorch thread pools accordingly.
+    The profile is only applied if it was tuned for the same model and image size.
+    If no matching profile exists the given defaults are used.
+
+    :param args: Parsed command line arguments with `runtime_profile`, `model`, `img_size`, `batch_size` and `n_cpu` attributes
+    :type args: argparse.Namespace
+    :param objective: Objective the settings were tuned for ('latency' or 'throughput')
+    :type objective: str
+    :param default_batch_size: Batch size used if neither the argument nor a profile is given
+    :type default_batch_size: int
+    :param default_n_cpu: Number of data loader workers used if neither the argument nor a profile is given
+    :type default_n_cpu: int
+    :return: The applied runtime settings, None if no matching profile was found
+    :rtype: Optional[RuntimeSettings]
+    """
+    settings = None
+    if args.runtime_profile and os.path.isfile(args.runtime_profile):
+        profile = RuntimeProfile.load_from(args.runtime_profile)
+        if os.path.abspath(profile.model) != os.path.abspath(args.model) or profile.img_size != args.img_size:
+            print(f"WARNING: Runtime profile '{args.runtime_profile}' was tuned for '{profile.model}' with image size "
+                  f"{profile.img_size}, not for '{args.model}' with image size {args.img_size}. Using the defaults.")
+        else:
+            settings = profile.get(objective)
+
+    if settings is None:
+        args.batch_size = args.batch_size or default_batch_size
+        args.n_cpu = default_n_cpu if args.n_cpu is None else args.n_cpu
+        return None
+
+    print(f"Using {objective} runtime profile '{args.runtime_profile}': {settings}")
+    apply_thread_settings(settings.num_threads, settings.num_interop_threads)
+    args.batch_size = args.batch_size or settings.batch_size
+    args.n_cpu = settings.n_cpu if args.n_cpu is None else args.n_cpu
+    return settings
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import os
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# Single-channel modes, whose pixel values (or palette indices) are the class ids
+SINGLE_CHANNEL_MODES = ("1", "L", "P")
+
+
+def get_mask_files(img_files: Sequence[str]) -> List[str]:
+    """Returns the mask file of each image, e.g. 'data/yoeo_segmentations/1.png' for 'data/images/1.jpg'.
+
+    :param img_files: Paths of the images
+    :type img_files: Sequence[str]
+    :return: Paths of the masks
+    :rtype: List[str]
+    """
+    mask_files = []
+    for path in img_files:
+        image_dir = os.path.dirname(path)
+        mask_dir = "yoeo_segmentations".join(image_dir.rsplit("images", 1))
+        assert mask_dir != image_dir, \
+            f"Image path must contain a folder named 'images'! \n'{image_dir}'"
+        mask_file = os.path.join(mask_dir, os.path.basename(path))
+        mask_file = os.path.splitext(mask_file)[0] + '.png'
+        mask_files.append(mask_file)
+    return mask_files
+
+
+def read_mask(path: str) -> np.ndarray:
+    """Reads a segmentation mask with the class id of each pixel.
+
+    Single-channel masks (grayscale, palette or 1 bit) contain the class ids directly,
+    masks with 3 channels are expected to contain the class id in each channel and only the first one is read.
+
+    :param path: Path of the mask
+    :type path: str
+    :return: Class ids (H, W)
+    :rtype: np.ndarray
+    """
+    from PIL import Image
+
+    with Image.open(path) as mask:
+        if mask.mode in SINGLE_CHANNEL_MODES:
+            return np.array(mask, dtype=np.uint8)
+        return np.array(mask.convert('RGB'), dtype=np.uint8)[..., 0]
+
+
+def write_mask(path: str, mask: np.ndarray, mode: str = "P") -> None:
+    """Writes a segmentation mask as single-channel png.
+
+    In the palette mode, the palette has one gray value per class, which equals the class id,
+    so masks with few classes are stored with 1, 2 or 4 bits per pixel and older readers,
+    which convert the mask to RGB, still get the class ids.
+
+    :param path: Path of the mask
+    :type path: str
+    :param mask: Class ids (H, W)
+    :type mask: np.ndarray
+    :param mode: 'P' (palette) or 'L' (8 bit grayscale), defaults to "P"
+    :type mode: str, optional
+    """
+    from PIL import Image
+
+    if mode not in ("P", "L"):
+        raise ValueError(f"Unknown mask mode '{mode}', choose from 'P' and 'L'")
+    mask = np.ascontiguousarray(mask, dtype=np.uint8)
+    image = Image.frombuffer(mode, (mask.shape[1], mask.shape[0]), mask, "raw", mode, 0, 1)
+    if mode == "P":
+        num_classes = int(mask.max()) + 1 if mask.size else 1
+        image.putpalette([value for class_id in range(num_classes) for value in (class_id,) * 3], rawmode="RGB")
+    image.save(path, format="PNG", optimize=True)
+
+
+def convert_mask_file(path: str, mode: str = "P") -> Optional[str]:
+    """Converts a mask with the class id in each of its 3 channels to a single-channel png in place.
+
+    :param path: Path of the mask
+    :type path: str
+    :param mode: 'P' (palette) or 'L' (8 bit grayscale), defaults to "P"
+    :type mode: str, optional
+    :return: None if the mask was converted or is already single-channel, otherwise the reason why it was skipped
+    :rtype: Optional[str]
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            if image.mode in SINGLE_CHANNEL_MODES:
+                return None
+            mask = np.array(image.convert('RGB'), dtype=np.uint8)
+    except OSError as e:
+        return f"Could not read the mask: {e}"
+    if not ((mask[..., 0] == mask[..., 1]) & (mask[..., 0] == mask[..., 2])).all():
+        return "The channels differ, so the mask does not contain class ids"
+    # Replaces the mask only after the new file is complete, so an interrupted conversion does not destroy it
+    tmp_path = path + ".tmp"
+    write_mask(tmp_path, mask[..., 0], mode)
+    os.replace(tmp_path, path)
+    return None
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import yaml
+
+from yoeo.utils.segmentation_masks import write_mask
+
+SPLITS = ("train", "valid")
+
+
+def parse_resolution(resolution: str) -> Tuple[int, int]:
+    """Parses a resolution like '640x480' (width x height) or '416' (square).
+
+    :param resolution: Resolution string
+    :type resolution: str
+    :return: Width and height
+    :rtype: Tuple[int, int]
+    """
+    width, _, height = resolution.lower().partition("x")
+    return int(width), int(height or width)
+
+
+def _class_colors(num_classes: int, rng: np.random.Generator) -> np.ndarray:
+    return rng.integers(0, 256, size=(num_classes, 3), dtype=np.uint8)
+
+
+def _random_box(rng: np.random.Generator, width: int, height: int, min_size: float, max_size: float) -> Tuple[int, int, int, int]:
+    box_w = max(2, int(width * rng.uniform(min_size, max_size)))
+    box_h = max(2, int(height * rng.uniform(min_size, max_size)))
+    x1 = int(rng.integers(0, width - box_w + 1))
+    y1 = int(rng.integers(0, height - box_h + 1))
+    return x1, y1, x1 + box_w, y1 + box_h
+
+
+def generate_sample(
+        width: int,
+        height: int,
+        num_detection_classes: int,
+        num_segmentation_classes: int,
+        rng: np.random.Generator,
+        max_boxes: int = 10,
+        max_regions: int = 4,
+        detection_colors: Optional[np.ndarray] = None,
+        segmentation_colors: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Generates a random image with matching bounding box and segmentation annotations.
+
+    The image is noise with an ellipse for each segmentation region and a rectangle for each bounding box,
+    both painted in the color of their class, so a model can learn them.
+
+    :param width: Image width
+    :type width: int
+    :param height: Image height
+    :type height: int
+    :param num_detection_classes: Number of bounding box classes
+    :type num_detection_classes: int
+    :param num_segmentation_classes: Number of segmentation classes including the background (class 0)
+    :type num_segmentation_classes: int
+    :param rng: Random number generator
+    :type rng: np.random.Generator
+    :param max_boxes: Maximum number of bounding boxes, defaults to 10
+    :type max_boxes: int, optional
+    :param max_regions: Maximum number of segmentation regions, defaults to 4
+    :type max_regions: int, optional
+    :param detection_colors: Color of each bounding box class, defaults to None (random)
+    :type detection_colors: Optional[np.ndarray], optional
+    :param segmentation_colors: Color of each segmentation class, defaults to None (random)
+    :type segmentation_colors: Optional[np.ndarray], optional
+    :return: RGB image (H, W, 3), labels (N, 5) with normalized 'class x_center y_center width height' and mask (H, W) with the class ids
+    :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    if detection_colors is None:
+        detection_colors = _class_colors(num_detection_classes, rng)
+    if segmentation_colors is None:
+        segmentation_colors = _class_colors(num_segmentation_classes, rng)
+
+    img = rng.integers(0, 64, size=(height, width, 3), dtype=np.uint8)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    ys, xs = np.ogrid[:height, :width]
+
+    # Segmentation regions, later regions overlap earlier ones
+    if num_segmentation_classes > 1:
+        for _ in range(int(rng.integers(1, max_regions + 1))):
+            class_id = int(rng.integers(1, num_segmentation_classes))
+            x1, y1, x2, y2 = _random_box(rng, width, height, 0.1, 0.5)
+            center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+            radius_x, radius_y = (x2 - x1) / 2, (y2 - y1) / 2
+            region = ((xs - center_x) / radius_x) ** 2 + ((ys - center_y) / radius_y) ** 2 <= 1
+            mask[region] = class_id
+            img[region] = segmentation_colors[class_id]
+
+    # Bounding boxes are drawn on top of the segmentation
+    labels = np.zeros((0, 5), dtype=np.float32)
+    if num_detection_classes > 0 and max_boxes > 0:
+        num_boxes = int(rng.integers(0, max_boxes + 1))
+        labels = np.zeros((num_boxes, 5), dtype=np.float32)
+        for i in range(num_boxes):
+            class_id = int(rng.integers(0, num_detection_classes))
+            x1, y1, x2, y2 = _random_box(rng, width, height, 0.03, 0.3)
+            img[y1:y2, x1:x2] = detection_colors[class_id]
+            labels[i] = [class_id, (x1 + x2) / 2 / width, (y1 + y2) / 2 / height, (x2 - x1) / width, (y2 - y1) / height]
+
+    # Some noise on top, so the image does not compress to nothing
+    img = np.clip(img.astype(np.int16) + rng.integers(-16, 17, size=img.shape, dtype=np.int16), 0, 255).astype(np.uint8)
+    return img, labels, mask
+
+
+def create_synthetic_dataset(
+        output_dir: str,
+        names_path: str = "data/yoeo_names.yaml",
+        num_images: int = 100,
+        resolutions: Sequence[Tuple[int, int]] = ((640, 480),),
+        max_boxes: int = 10,
+        valid_fraction: float = 0.2,
+        image_format: str = "jpg",
+        seed: int = 0) -> str:
+    """Writes a random dataset in the layout of `ListDataset` to benchmark and test without a real dataset.
+
+    The output directory contains a `train` and `valid` directory, each with `images/`, `labels/` (YOLO .txt),
+    `yoeo_segmentations/` (single-channel .png masks with the class ids) and a list file with the image paths,
+    as well as a copy of the names file and a `synthetic.data` config for `yoeo-train` and `yoeo-test`.
+    The same seed produces the same dataset.
+
+    :param output_dir: Directory of the dataset
+    :type output_dir: str
+    :param names_path: Path to the class names file (.yaml) with 'detection' and 'segmentation' lists, defaults to "data/yoeo_names.yaml"
+    :type names_path: str, optional
+    :param num_images: Number of images over both splits, defaults to 100
+    :type num_images: int, optional
+    :param resolutions: (width, height) of the images, each image uses one of them at random, defaults to ((640, 480),)
+    :type resolutions: Sequence[Tuple[int, int]], optional
+    :param max_boxes: Maximum number of bounding boxes per image, defaults to 10
+    :type max_boxes: int, optional
+    :param valid_fraction: Fraction of the images in the validation split, defaults to 0.2
+    :type valid_fraction: float, optional
+    :param image_format: File extension of the images ('jpg' or 'png'), defaults to "jpg"
+    :type image_format: str, optional
+    :param seed: Random seed, defaults to 0
+    :type seed: int, optional
+    :return: Path to the data config file
+    :rtype: str
+    """
+    from PIL import Image
+
+    with open(names_path, "r") as f:
+        names: Dict[str, List[str]] = yaml.safe_load(f)
+    num_detection_classes = len(names["detection"])
+    num_segmentation_classes = len(names["segmentation"])
+
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    detection_colors = _class_colors(num_detection_classes, rng)
+    segmentation_colors = _class_colors(num_segmentation_classes, rng)
+
+    num_valid = int(round(num_images * valid_fraction))
+    split_sizes = {"train": num_images - num_valid, "valid": num_valid}
+    list_paths = {}
+    for split in SPLITS:
+        split_dir = os.path.join(output_dir, split)
+        images_dir = os.path.join(split_dir, "images")
+        labels_dir = os.path.join(split_dir, "labels")
+        masks_dir = os.path.join(split_dir, "yoeo_segmentations")
+        for directory in (images_dir, labels_dir, masks_dir):
+            os.makedirs(directory, exist_ok=True)
+
+        image_paths = []
+        for i in range(split_sizes[split]):
+            width, height = resolutions[int(rng.integers(0, len(resolutions)))]
+            img, labels, mask = generate_sample(
+                width, height, num_detection_classes, num_segmentation_classes, rng,
+                max_boxes=max_boxes, detection_colors=detection_colors, segmentation_colors=segmentation_colors)
+
+            name = f"{split}_{i:06d}"
+            image_path = os.path.join(images_dir, f"{name}.{image_format}")
+            Image.fromarray(img).save(image_path)
+            write_mask(os.path.join(masks_dir, f"{name}.png"), mask)
+            with open(os.path.join(labels_dir, f"{name}.txt"), "w") as f:
+                for label in labels:
+                    f.write(f"{int(label[0])} {label[1]:.6f} {label[2]:.6f} {label[3]:.6f} {label[4]:.6f}\n")
+            image_paths.append(image_path)
+
+        list_paths[split] = os.path.join(split_dir, f"{split}.txt")
+        with open(list_paths[split], "w") as f:
+            f.writelines(path + "\n" for path in image_paths)
+
+    names_output_path = os.path.join(output_dir, "yoeo_names.yaml")
+    with open(names_output_path, "w") as f:
+        yaml.dump(names, f)
+
+    # Detection and segmentation use the same images
+    data_path = os.path.join(output_dir, "synthetic.data")
+    with open(data_path, "w") as f:
+        f.write(f"train={list_paths['train']}\n")
+        f.write(f"valid={list_paths['valid']}\n")
+        f.write(f"yolotrain={list_paths['train']}\n")
+        f.write(f"yolovalid={list_paths['valid']}\n")
+        f.write(f"unettrain={list_paths['train']}\n")
+        f.write(f"unetvalid={list_paths['valid']}\n")
+        f.write(f"names={names_output_path}\n")
+    return data_path
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import sys
+import time
+import warnings
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+# PyTorch is only imported when the telemetry is used
+if TYPE_CHECKING:
+    import torch
+    from yoeo.utils.logger import Logger
+
+STAGES = ("data_wait", "augmentation", "compute", "optimizer")
+
+# Message of the warning PyTorch emits for each synchronizing CUDA operation in the "warn" sync debug mode
+SYNC_WARNING = "called a synchronizing CUDA operation"
+
+
+def _rss_mib() -> Optional[float]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class TrainTelemetry:
+    """Measures the throughput of the training loop and accumulates the losses on the device.
+
+    The wall time of each step is split into waiting for the data loader ('data_wait'), the batch 'augmentation'
+    on the device (if used), 'compute' (forward and backward pass) and the 'optimizer' step. Every `log_interval` steps,
+    the images per second, the share of each stage, the device synchronizations per step and the memory are logged
+    and a warning is printed if the data wait exceeds `stall_threshold` of the step time, i.e. training is input bound.
+
+    The losses are summed as tensors on the device, so they only have to be copied to the host once per epoch.
+
+    Usage::
+
+        telemetry = TrainTelemetry(device, logger)
+        for _, imgs, targets, _ in telemetry.iterate(dataloader):
+            with telemetry.stage("compute"):
+                loss = criterion(model(imgs), targets)
+                loss.backward()
+            with telemetry.stage("optimizer"):
+                optimizer.step()
+            telemetry.add_losses(loss=loss)
+        print(telemetry.epoch_losses())
+
+    :param device: Device of the training
+    :type device: torch.device
+    :param logger: Logger for the metrics, defaults to None (only the stall warning is printed)
+    :type logger: Optional[Logger], optional
+    :param log_interval: Number of steps between two logs, defaults to 50
+    :type log_interval: int, optional
+    :param stall_threshold: Fraction of the step time spent waiting for data that triggers a warning, defaults to 0.3
+    :type stall_threshold: float, optional
+    :param synchronize: If True, CUDA is synchronized at the end of each stage, so the stage times include the queued kernels.
+        Otherwise only the total step time over a log interval is exact, defaults to False
+    :type synchronize: bool, optional
+    :param count_syncs: If True, the synchronizing operations of each step are counted on CUDA with the sync debug mode
+        of PyTorch, which adds a warning with a stack capture to each synchronization of the measured step, defaults to False
+    :type count_syncs: bool, optional
+    """
+
+    def __init__(
+            self,
+            device: torch.device,
+            logger: Optional[Logger] = None,
+            log_interval: int = 50,
+            stall_threshold: float = 0.3,
+            synchronize: bool = False,
+            count_syncs: bool = False):
+        import torch
+
+        self.device = torch.device(device)
+        self.is_cuda = self.device.type == "cuda"
+        self.logger = logger
+        self.log_interval = log_interval
+        self.stall_threshold = stall_threshold
+        self.synchronize = synchronize and self.is_cuda
+        self.count_syncs = count_syncs and self.is_cuda
+        self.step = 0
+        self.history: List[Dict[str, float]] = []
+        self._losses: Dict[str, torch.Tensor] = {}
+        self._loss_counts: Dict[str, int] = {}
+        self._reset_window()
+
+    def _reset_window(self) -> None:
+        self._window_start = time.perf_counter()
+        self._stage_times = {name: 0.0 for name in STAGES}
+        self._window_steps = 0
+        self._window_images = 0
+        self._window_syncs = 0
+        if self.is_cuda:
+            import torch
+            torch.cuda.reset_peak_memory_stats(self.device)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Adds the wall time of the enclosed block to a stage of the current step."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.synchronize:
+                import torch
+                torch.cuda.synchronize(self.device)
+            self._stage_times[name] = self._stage_times.get(name, 0.0) + time.perf_counter() - start
+
+    def add_losses(self, **losses: torch.Tensor) -> None:
+        """Adds the losses of a step to the sums of the epoch without copying them to the host."""
+        for name, value in losses.items():
+            value = value.detach()
+            self._losses[name] = self._losses[name] + value if name in self._losses else value
+            self._loss_counts[name] = self._loss_counts.get(name, 0) + 1
+
+    def epoch_losses(self) -> Dict[str, float]:
+        """Returns the mean of each loss since the last call with a single copy to the host and resets the sums.
+
+        Losses given as a vector (e.g. the components of the yolo loss) are returned as a list.
+
+        :return: Mean of each loss
+        :rtype: Dict[str, float]
+        """
+        import torch
+
+        if not self._losses:
+            return {}
+        names = list(self._losses)
+        sizes = [self._losses[name].numel() for name in names]
+        values = torch.cat([self._losses[name].reshape(-1).float() for name in names]).tolist()
+        means = {}
+        for name, size in zip(names, sizes):
+            loss_values = [value / self._loss_counts[name] for value in values[:size]]
+            means[name] = loss_values[0] if size == 1 else loss_values
+            values = values[size:]
+        self._losses = {}
+        self._loss_counts = {}
+        return means
+
+    def iterate(self, dataloader: Iterable) -> Iterator:
+        """Yields the batches of a data loader and measures the time waiting for each of them.
+
+        Each iteration of the loop is one training step. With `count_syncs`, the synchronizing operations of each step
+        are counted with the sync debug mode of PyTorch, other warnings are shown at the end of the step.
+
+        :param dataloader: Data loader of the training
+        :type dataloader: Iterable
+        """
+        if not self.count_syncs:
+            yield from self._iterate(dataloader)
+            return
+
+        import torch
+        sync_debug_mode = torch.cuda.get_sync_debug_mode()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.filterwarnings("always", message=f".*{SYNC_WARNING}")
+            for batch in self._iterate(dataloader):
+                # Only the synchronizations of the loop body are counted, not the ones of the logging
+                torch.cuda.set_sync_debug_mode("warn")
+                try:
+                    yield batch
+                finally:
+                    torch.cuda.set_sync_debug_mode(sync_debug_mode)
+
+                for warning in caught:
+                    if SYNC_WARNING in str(warning.message):
+                        self._window_syncs += 1
+                    else:
+                        # Recorded warnings can not be passed on to `warnings.showwarning`, which would record them again
+                        sys.stderr.write(warnings.formatwarning(warning.message, warning.category, warning.filename, warning.lineno))
+                caught.clear()
+
+    def _iterate(self, dataloader: Iterable) -> Iterator:
+        iterator = iter(dataloader)
+        while True:
+            with self.stage("data_wait"):
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    return
+            yield batch
+            self._end_step(batch)
+
+    def _end_step(self, batch) -> None:
+        self.step += 1
+        self._window_steps += 1
+        if isinstance(batch, (list, tuple)) and len(batch) > 1 and hasattr(batch[1], "__len__"):
+            self._window_images += len(batch[1])
+        if self._window_steps >= self.log_interval:
+            self.log()
+
+    def metrics(self) -> List[Tuple[str, float]]:
+        """Returns the metrics of the steps since the last log as (tag, value) pairs."""
+        import torch
+
+        if self.is_cuda:
+            # Waits for the queued kernels, so the step time of the interval is exact
+            torch.cuda.synchronize(self.device)
+        duration = time.perf_counter() - self._window_start
+        steps = max(self._window_steps, 1)
+        metrics = [
+            ("telemetry/images_per_s", self._window_images / duration if duration > 0 else 0.0),
+            ("telemetry/step_ms", duration * 1000 / steps),
+        ]
+        for name, seconds in self._stage_times.items():
+            metrics.append((f"telemetry/{name}_ms", seconds * 1000 / steps))
+            metrics.append((f"telemetry/{name}_fraction", seconds / duration if duration > 0 else 0.0))
+        if self.count_syncs:
+            metrics.append(("telemetry/syncs_per_step", self._window_syncs / steps))
+        if self.is_cuda:
+            metrics.append(("telemetry/max_memory_allocated_mib", torch.cuda.max_memory_allocated(self.device) / 2 ** 20))
+            metrics.append(("telemetry/memory_reserved_mib", torch.cuda.memory_reserved(self.device) / 2 ** 20))
+        rss = _rss_mib()
+        if rss is not None:
+            metrics.append(("telemetry/rss_mib", rss))
+        return metrics
+
+    def log(self) -> None:
+        """Logs the metrics of the steps since the last log, warns about an input bound training and starts a new interval."""
+        if self._window_steps == 0:
+            return
+        metrics = self.metrics()
+        self.history.append({"step": self.step, **{tag.split("/", 1)[1]: value for tag, value in metrics}})
+        if self.logger is not None:
+            self.logger.list_of_scalars_summary(metrics, self.step)
+
+        data_wait = dict(metrics)["telemetry/data_wait_fraction"]
+        if data_wait > self.stall_threshold:
+            print(f"WARNING: Training is input bound, {data_wait:.0%} of the last {self._window_steps} steps were spent waiting for data. "
+                  f"Increase --n_cpu or profile the data pipeline with yoeo-bench-data.")
+        self._reset_window()
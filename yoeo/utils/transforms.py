@@ -2,14 +2,35 @@ import torch
 import torch.nn.functional as F
 import numpy as np
 
-import imgaug.augmenters as iaa
-from imgaug.augmentables.bbs import BoundingBox, BoundingBoxesOnImage
+from imgaug.augmentables.bbs import BoundingBoxesOnImage
 from imgaug.augmentables.segmaps import SegmentationMapsOnImage
 
 from .utils import xywh2xyxy_np
 import torchvision.transforms as transforms
 
 
+def _xyxy2xywh_np(x):
+    y = np.zeros_like(x)
+    y[..., 0] = (x[..., 0] + x[..., 2]) / 2
+    y[..., 1] = (x[..., 1] + x[..., 3]) / 2
+    y[..., 2] = x[..., 2] - x[..., 0]
+    y[..., 3] = x[..., 3] - x[..., 1]
+    return y
+
+
+def _clip_boxes_np(boxes, shape):
+    """Removes the (N, 5) boxes with absolute 'class x1 y1 x2 y2' outside of the image and clips the others,
+    like `BoundingBoxesOnImage.clip_out_of_image` of imgaug, but for all boxes at once."""
+    height, width = shape[:2]
+    eps = np.finfo(np.float32).eps
+    inside = (np.maximum(boxes[:, 1], 0) <= np.minimum(boxes[:, 3], width - eps)) & \
+        (np.maximum(boxes[:, 2], 0) <= np.minimum(boxes[:, 4], height - eps))
+    boxes = boxes[inside]
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, width - eps)
+    boxes[:, [2, 4]] = np.clip(boxes[:, [2, 4]], 0, height - eps)
+    return boxes
+
+
 class ImgAug(object):
     def __init__(self, augmentations=[]):
         self.augmentations = augmentations
@@ -18,14 +39,10 @@ class ImgAug(object):
         # Unpack data
         img, boxes, seg = data
 
-        # Convert xywh to xyxy
-        boxes = np.array(boxes)
+        # Convert xywh to xyxy, the boxes stay a single array and only imgaug creates its box objects
+        boxes = np.array(boxes, dtype=np.float64).reshape(-1, 5)
         boxes[:, 1:] = xywh2xyxy_np(boxes[:, 1:])
-
-        # Convert bounding boxes to imgaug
-        bounding_boxes = BoundingBoxesOnImage(
-            [BoundingBox(*box[1:], label=box[0]) for box in boxes],
-            shape=img.shape)
+        bounding_boxes = BoundingBoxesOnImage.from_xyxy_array(boxes[:, 1:], shape=img.shape)
 
         # Convert sementations to imgaug
         segmentation_mask = SegmentationMapsOnImage(seg, shape=img.shape)
@@ -36,24 +53,12 @@ class ImgAug(object):
             bounding_boxes=bounding_boxes,
             segmentation_maps=segmentation_mask)
 
-        # Clip out of image boxes
-        bounding_boxes = bounding_boxes.clip_out_of_image()
-
-        # Convert bounding boxes back to numpy
-        boxes = np.zeros((len(bounding_boxes), 5))
-        for box_idx, box in enumerate(bounding_boxes):
-            # Extract coordinates for unpadded + unscaled image
-            x1 = box.x1
-            y1 = box.y1
-            x2 = box.x2
-            y2 = box.y2
-
-            # Returns (x, y, w, h)
-            boxes[box_idx, 0] = box.label
-            boxes[box_idx, 1] = ((x1 + x2) / 2)
-            boxes[box_idx, 2] = ((y1 + y2) / 2)
-            boxes[box_idx, 3] = (x2 - x1)
-            boxes[box_idx, 4] = (y2 - y1)
+        # The augmentations keep the number and order of the boxes, so the class ids still belong to the same rows
+        boxes[:, 1:] = bounding_boxes.to_xyxy_array(dtype=np.float64)
+
+        # Clip out of image boxes and convert them back to xywh
+        boxes = _clip_boxes_np(boxes, img.shape)
+        boxes[:, 1:] = _xyxy2xywh_np(boxes[:, 1:])
 
         # Convert segmentation back to numpy
         seg = segmentation_mask.get_arr()
@@ -85,24 +90,85 @@ class AbsoluteLabels(object):
         return img, boxes, seg
 
 
-class PadSquare(ImgAug):
-    def __init__(self, ):
-        self.augmentations = iaa.Sequential([
-            iaa.PadToAspectRatio(
-                1.0,
-                position="center-center").to_deterministic()
-        ])
+class PadSquare(object):
+    """Pads the image and mask with zeros to a square, like imgaug's `PadToAspectRatio(1.0, position="center-center")`.
+
+    The boxes (absolute 'class x y w h') are shifted by the padding and clipped to the image. With `relative_labels`,
+    they are also scaled to the padded image in the same step, which replaces a following `RelativeLabels`.
+
+    :param relative_labels: Returns boxes relative to the padded image, defaults to False
+    :type relative_labels: bool, optional
+    """
+
+    def __init__(self, relative_labels=False):
+        self.relative_labels = relative_labels
+
+    def __call__(self, data):
+        img, boxes, seg = data
+        h, w = img.shape[:2]
+        size = max(h, w)
+        # An odd padding puts the extra pixel at the bottom or right, like imgaug
+        top, left = (size - h) // 2, (size - w) // 2
+        padding = ((top, size - h - top), (left, size - w - left))
+        img = np.pad(img, padding + ((0, 0),) * (img.ndim - 2))
+        seg = np.pad(seg, padding + ((0, 0),) * (seg.ndim - 2))
+
+        # Shift the boxes by the padding and clip them to the image like the other imgaug transforms
+        boxes = np.array(boxes, dtype=np.float64).reshape(-1, 5)
+        boxes[:, 1:] = xywh2xyxy_np(boxes[:, 1:]) + (left, top, left, top)
+        boxes = _clip_boxes_np(boxes, img.shape)
+
+        # Convert to xywh and scale to the padded image in one step
+        scale = 1 / size if self.relative_labels else 1.0
+        boxes[:, 1:] = _xyxy2xywh_np(boxes[:, 1:]) * scale
+        return img, boxes, seg
+
+
+class ClipLabels(object):
+    """Clips the boxes (absolute 'class x y w h') to the image like `PadSquare`, but keeps the image unpadded.
+
+    :param relative_labels: Returns boxes relative to the image, defaults to False
+    :type relative_labels: bool, optional
+    """
+
+    def __init__(self, relative_labels=False):
+        self.relative_labels = relative_labels
+
+    def __call__(self, data):
+        img, boxes, seg = data
+        h, w = img.shape[:2]
+        boxes = np.array(boxes, dtype=np.float64).reshape(-1, 5)
+        boxes[:, 1:] = xywh2xyxy_np(boxes[:, 1:])
+        boxes = _clip_boxes_np(boxes, img.shape)
+        boxes[:, 1:] = _xyxy2xywh_np(boxes[:, 1:])
+        if self.relative_labels:
+            boxes[:, [1, 3]] /= w
+            boxes[:, [2, 4]] /= h
+        return img, boxes, seg
 
 
 class ToTensor(object):
-    def __init__(self, ):
-        pass
+    """Converts a sample to tensors, the image to float in [0, 1] and the mask to float class ids.
+
+    With `uint8`, the image (3, H, W) and mask (1, H, W) stay uint8, so the batches need a quarter of the memory
+    and of the transfer from the data loader workers. `normalize_batch` converts them after the transfer.
+
+    :param uint8: Keeps the image and mask uint8, defaults to False
+    :type uint8: bool, optional
+    """
+
+    def __init__(self, uint8=False):
+        self.uint8 = uint8
 
     def __call__(self, data):
         img, boxes, seg = data
-        # Extract image as PyTorch tensor
-        img = transforms.ToTensor()(img)
-        seg = transforms.ToTensor()(seg) * 255 # Because troch maps this to 0-1 instead of 0-255
+        if self.uint8:
+            img = torch.from_numpy(np.ascontiguousarray(img.transpose(2, 0, 1)))
+            seg = torch.from_numpy(np.ascontiguousarray(seg.reshape(seg.shape[:2] + (-1,))[..., 0]))[None]
+        else:
+            # Extract image as PyTorch tensor
+            img = transforms.ToTensor()(img)
+            seg = transforms.ToTensor()(seg) * 255 # Because troch maps this to 0-1 instead of 0-255
 
         bb_targets = torch.zeros((len(boxes), 6))
         bb_targets[:, 1:] = transforms.ToTensor()(boxes)
@@ -123,7 +189,53 @@ class Resize(object):
 
 DEFAULT_TRANSFORMS = transforms.Compose([
     AbsoluteLabels(),
-    PadSquare(),
-    RelativeLabels(),
+    PadSquare(relative_labels=True),
     ToTensor(),
 ])
+
+
+def uint8_transforms(transform):
+    """Returns a copy of a `Compose` of transforms, whose `ToTensor` keeps the images and masks uint8.
+
+    :param transform: Transforms ending with `ToTensor`
+    :type transform: torchvision.transforms.Compose
+    :return: Transforms with `ToTensor(uint8=True)`
+    :rtype: torchvision.transforms.Compose
+    """
+    return transforms.Compose([
+        ToTensor(uint8=True) if isinstance(step, ToTensor) else step for step in transform.transforms])
+
+
+def rectangular_transforms(transform):
+    """Returns a copy of a `Compose` of transforms without `PadSquare`, for datasets which letterbox the samples
+    to the rectangular shape of their batch instead.
+
+    Each `PadSquare` is replaced by `ClipLabels`, so the boxes are still clipped and relative to the image.
+
+    :param transform: Transforms with `PadSquare`
+    :type transform: torchvision.transforms.Compose
+    :return: Transforms without `PadSquare`
+    :rtype: torchvision.transforms.Compose
+    """
+    return transforms.Compose([
+        ClipLabels(step.relative_labels) if isinstance(step, PadSquare) else step for step in transform.transforms])
+
+
+def normalize_batch(imgs, mask_targets=None):
+    """Converts a batch of uint8 images to float in [0, 1] and the masks to class ids for the loss.
+
+    Call it after the batch is moved to the device, so the transfer uses the smaller uint8 data.
+    Float images are returned unchanged.
+
+    :param imgs: Images (B, 3, H, W)
+    :type imgs: torch.Tensor
+    :param mask_targets: Masks (B, H, W), defaults to None
+    :type mask_targets: Optional[torch.Tensor], optional
+    :return: Float images and long masks
+    :rtype: Tuple[torch.Tensor, Optional[torch.Tensor]]
+    """
+    if imgs.dtype == torch.uint8:
+        imgs = imgs.float().div_(255)
+    if mask_targets is not None:
+        mask_targets = mask_targets.long()
+    return imgs, mask_targets
@@ -1,14 +1,14 @@
 from __future__ import division, annotations
 
+import os
 import time
 import platform
 import tqdm
 import torch
 import torch.nn as nn
-import torchvision
 import numpy as np
-import subprocess
 import random
+from importlib import metadata
 from typing import List, Optional, Tuple
 
 from yoeo.utils.dataclasses import GroupConfig
@@ -476,6 +476,9 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
          detections with shape: nx6 (x1, y1, x2, y2, conf, cls)
     """
 
+    # torchvision takes long to import and is only needed here
+    from torchvision.ops import nms
+
     nc = prediction.shape[2] - 5  # number of classes
 
     # Settings
@@ -538,7 +541,7 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
 
         # boxes (offset by class), scores
         boxes, scores = x[:, :4] + c, x[:, 4]
-        i = torchvision.ops.nms(boxes, scores, iou_thres)  # NMS
+        i = nms(boxes, scores, iou_thres)  # NMS
         if i.shape[0] > max_det:  # limit detections
             i = i[:max_det]
 
@@ -579,16 +582,51 @@ def print_environment_info():
     # Print OS information
     print(f"System: {platform.system()} {platform.release()}")
 
-    # Print poetry package version
+    # Print package version
     try:
-        print(
-            f"Current Version: {subprocess.check_output(['poetry', 'version'], stderr=subprocess.DEVNULL).decode('ascii').strip()}")
-    except (subprocess.CalledProcessError, FileNotFoundError):
+        print(f"Current Version: {metadata.version('YOEO')}")
+    except metadata.PackageNotFoundError:
         print("Not using the poetry package")
 
     # Print commit hash if possible
-    try:
-        print(
-            f"Current Commit Hash: {subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode('ascii').strip()}")
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    commit_hash = _read_git_commit_hash()
+    if commit_hash:
+        print(f"Current Commit Hash: {commit_hash}")
+    else:
         print("No git or repo found")
+
+
+def _read_git_commit_hash(repo_dir: str = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+                          ) -> Optional[str]:
+    """
+    Reads the short hash of the checked out commit directly from the '.git' directory of the repository,
+    which is a lot faster than starting a git process.
+
+    :param repo_dir: Root directory of the repository, defaults to the one containing this package
+    :type repo_dir: str
+    :return: Short commit hash or None if it could not be found
+    :rtype: Optional[str]
+    """
+    git_dir = os.path.join(repo_dir, ".git")
+    try:
+        with open(os.path.join(git_dir, "HEAD"), "r") as f:
+            head = f.read().strip()
+
+        # Detached head
+        if not head.startswith("ref: "):
+            return head[:7]
+
+        ref = head[len("ref: "):]
+        ref_path = os.path.join(git_dir, ref)
+        if os.path.isfile(ref_path):
+            with open(ref_path, "r") as f:
+                return f.read().strip()[:7]
+
+        # The ref may only be stored in the packed refs
+        with open(os.path.join(git_dir, "packed-refs"), "r") as f:
+            for line in f:
+                if line.rstrip().endswith(f" {ref}"):
+                    return line.split(" ")[0][:7]
+    except OSError:
+        pass
+    return None